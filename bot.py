@@ -1,17 +1,21 @@
 import os
 import re
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from telegram import BotCommand
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
+from telegram import BotCommand, Update
 from telegram.request import HTTPXRequest
 
 load_dotenv()
 
 from utils.logger import setup_logger
-from utils.loader import discover_tests
+from utils.loader import load_catalog_and_tree
+from utils.catalog import get_catalog
+from utils.catalog_watcher import start_catalog_watcher, stop_catalog_watchers
+from utils.render_cache import watch_catalog
+from utils.media_reader import shutdown_media_reader
 
 # --- Старт/довідка/статистика ---
-from handlers.start import cmd_start, cmd_help, cmd_rules, cmd_stats, stats_clear_all_start, stats_clear_all_confirm
+from handlers.start import cmd_start, cmd_help, cmd_rules, cmd_stats, cmd_leaderboard, stats_clear_all_start, stats_clear_all_confirm
 
 # --- Меню, пошук, відкриття питання з пошуку ---
 from handlers.menu import (
@@ -21,6 +25,7 @@ from handlers.menu import (
     handle_search_query,
     open_question_from_search,
     stop_search_cb,
+    search_page_cb,
 )
 
 # --- Learning/Test режими ---
@@ -42,7 +47,15 @@ from handlers.testing import (
 )
 
 # --- Статистика в БД ---
-from handlers.statistics_db import initialize_database, close_db_connection
+from handlers.statistics_db import initialize_database, close_db_connection, shutdown_write_queue
+from handlers.search_index import ensure_search_index
+from handlers.answer_analytics import start_rollup_job, stop_rollup_job
+from handlers.persistence import create_persistence
+from handlers.state_sync import prepare_session_test
+from handlers.rate_limiter import create_rate_limiter
+from handlers.webhook import webhook_config, run_webhook
+from handlers.update_processor import create_update_processor
+from handlers.text_router import TextRouter
 
 # --- Вибір тесту та дерево ---
 from handlers.test_selection import handle_test_selection, add_cancel_cb
@@ -117,7 +130,7 @@ from handlers.topics import topics_start, topics_cb
 logger = setup_logger()
 
 # --- Регекси для меню/ввідних форматів ---
-MAIN_MENU_REGEX = re.compile(r"^(🎓 Режим навчання|📝 Режим тестування|⭐ Улюблені|🔎 Пошук)$")
+MAIN_MENU_LABELS = ("🎓 Режим навчання", "📝 Режим тестування", "⭐ Улюблені", "🔎 Пошук")
 CUSTOM_RANGE_REGEX = re.compile(r"^\d+-\d+$")
 NUMBER_REGEX = re.compile(r"^\d+$")
 USERNAME_REGEX = re.compile(r"^@[A-Za-z0-9_]{3,32}$")
@@ -129,6 +142,7 @@ async def set_commands(application):
         BotCommand("help", "Допомога"),
         BotCommand("rules", "Правила"),
         BotCommand("stats", "Моя статистика"),
+        BotCommand("leaderboard", "Рейтинг тесту"),
         BotCommand("favorites", "Улюблені"),
         BotCommand("office", "Мій кабінет"),
         BotCommand("wrong_answers", "Мої помилки"),
@@ -146,39 +160,98 @@ async def error_handler(update, context):
 async def post_init(application):
     await set_commands(application)
     await initialize_database()
-    catalog = discover_tests("tests")
+    catalog, tree = load_catalog_and_tree("tests")
     application.bot_data["tests_catalog"] = catalog
+    application.bot_data["tests_tree"] = tree
+    # кеш відрендерених підписів скидає записи змінених тестів
+    watch_catalog(get_catalog("tests"))
+
+    # Опційний watcher (CATALOG_WATCH): зміни на диску одразу потрапляють у bot_data
+    if start_catalog_watcher("tests"):
+        def _swap_catalog(version, changed):
+            cat, tr = load_catalog_and_tree("tests")
+            application.bot_data["tests_catalog"] = cat
+            application.bot_data["tests_tree"] = tr
+            logger.info(f"[CATALOG] v{version}: {len(changed)} змін, {len(cat)} тестів")
+        get_catalog("tests").add_listener(_swap_catalog)
+
+    # Повнотекстовий індекс питань (FTS5) — дозвіряємо у фоні, щоб не затримувати старт
+    application.create_task(ensure_search_index("tests"))
+
+    # Періодичний ролап answer_events → question_stats (складність питань)
+    start_rollup_job(application)
+
     logger.info(f"✅ Бот ініціалізовано. Завантажено {len(catalog)} тестів")
 
 
 async def post_shutdown(application):
+    stop_catalog_watchers()
+    await stop_rollup_job()
+    shutdown_media_reader()
+    # дописати все, що лежить у write-behind черзі, і лише потім закрити БД
+    await shutdown_write_queue()
     await close_db_connection()
     logger.info("✅ Бот зупинено, з'єднання закрито")
 
 
-# ======== ROUTERS for group=0 (щоб не конфліктували add/edit) ========
+# ======== ROUTERS (текст — TextRouter на групу, медіа — group=0) ========
+
+# режими редагування, в яких editq_message чекає текст
+EDITQ_TEXT_MODES = ("await_num_for_edit", "await_num_for_delete", "await_field_input", "await_media_input", "await_field_choice")
+
+
+def _addq_active(update, user_data) -> bool:
+    return bool(user_data.get("add_question") or user_data.get("add_question_active"))
+
+
+def _is_reply(update, user_data) -> bool:
+    return update.effective_message.reply_to_message is not None
 
-async def _route_text_group0(update, context):
+
+def build_text_routers():
     """
-    Єдиний роутер для ВСЬОГО тексту в group=0.
-    Вибір:
-      - якщо активний майстер додавання → handle_add_question_step
-      - інакше, якщо активне редагування → editq_message
-      - інакше нічого (не заважаємо іншим групам)
+    Текстові маршрути груп 0–2 — у тому ж порядку, в якому раніше
+    реєструвались MessageHandler-и (перший збіг у групі виграє).
     """
-    # Активний майстер додавання?
-    addq_flow = context.user_data.get("add_question")
-    addq_active = context.user_data.get("add_question_active")
-    if addq_flow or addq_active:
-        await handle_add_question_step(update, context)
-        return
+    g = lambda name: getattr(vip, name, None)
 
-    # Активне редагування?
-    edit_mode = context.user_data.get("editq_mode")
-    if edit_mode in {"await_num_for_edit", "await_num_for_delete", "await_field_input", "await_media_input", "await_field_choice"}:
-        await editq_message(update, context)
-        return
-    # інакше — пропускаємо
+    # Group 0: ВУЗЬКІ/ПРІОРИТЕТНІ — кнопки майстрів і стан активного майстра
+    r0 = TextRouter(0)
+    r0.exact("➕ Додати питання", handle_add_question)
+    r0.exact("✏️ Редагувати питання", editq_command)
+    # @username — лише VIP-довіреним; майстри додавання/редагування його не отримують
+    r0.pattern(USERNAME_REGEX, g("vip_trusted_handle_username_text"))
+    r0.when(_addq_active, handle_add_question_step, "add_question")
+    r0.state("editq_mode", {mode: editq_message for mode in EDITQ_TEXT_MODES})
+
+    # Group 1: ОФІС, МЕНЮ, СПЕЦ. ТЕКСТОВІ
+    r1 = TextRouter(1)
+    r1.exact("🔎 Пошук", handle_home_menu)
+    r1.exact("👤 Мій кабінет", office_open)
+    r1.exact("👑 Адмін-панель", owner_entry)
+    r1.exact(("Моя статистика", "Мої улюблені", "Мої тести", "Спільні тести", "Мої питання", "⬅️ Назад"), office_buttons_handler)
+    r1.exact("Мої питання", office_my_questions)
+    r1.exact("Мої помилки", wrong_answers_cmd)
+    r1.when(_is_reply, owner_text_entry, "reply")
+    r1.exact(MAIN_MENU_LABELS, handle_main_menu)
+    r1.exact("🎓 Навчання з улюблених", start_favorites_learning)
+    r1.exact("📝 Тест з улюблених", start_favorites_test)
+    r1.exact(("🔙 Назад", "⬅️ Назад"), back_text_handler)
+    # Learning
+    r1.pattern(r"^(\d+-\d+)$", handle_learning_range)
+    r1.exact("🔢 Власний діапазон", handle_learning_range)
+    r1.pattern(CUSTOM_RANGE_REGEX, handle_custom_range)
+    r1.exact(("🔢 По порядку", "🎲 В роздріб", "🔙 Назад", "⬅️ Назад"), handle_learning_order)
+    # Testing
+    r1.exact(("🔟 10 питань", "5️⃣0️⃣ 50 питань", "💯 100 питань", "🔢 Власна кількість", "🔙 Назад"), handle_test_settings)
+    r1.pattern(NUMBER_REGEX, handle_custom_test_count)
+
+    # Group 2: /start через кнопку і динамічний вибір тесту (останній)
+    r2 = TextRouter(2)
+    r2.exact("🔙 Обрати інший тест", cmd_start)
+    r2.fallback(handle_test_selection)
+
+    return [r0, r1, r2]
 
 
 async def _route_media_group0(update, context):
@@ -210,13 +283,31 @@ def main():
     request = HTTPXRequest(
         connect_timeout=30.0, read_timeout=60.0, write_timeout=30.0, pool_timeout=30.0
     )
-    app = Application.builder().token(token).request(request).build()
+    builder = Application.builder().token(token).request(request)
+    # Активні сесії квізу переживають рестарт/редеплой (SESSION_PERSIST=0 — вимкнути)
+    persistence = create_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    # Ліміти Telegram на чат/бота з пріоритетом інтерактиву (RATE_LIMIT=0 — вимкнути)
+    rate_limiter = create_rate_limiter()
+    if rate_limiter is not None:
+        builder = builder.rate_limiter(rate_limiter)
+    # Оновлення різних користувачів — паралельно, одного — по черзі (UPDATE_CONCURRENCY=1 — вимкнути)
+    update_processor = create_update_processor()
+    if update_processor is not None:
+        builder = builder.concurrent_updates(update_processor)
+    app = builder.build()
     app.post_init = post_init
     app.post_shutdown = post_shutdown
     app.add_error_handler(error_handler)
     app.bot_data["lang"] = lang
 
     g = lambda name: getattr(vip, name, None)
+    text_routers = {r.group: r for r in build_text_routers()}
+
+    # Тест активної сесії — закріплений і скомпільований поза циклом подій до всіх хендлерів;
+    # відновлена після рестарту сесія зміненого тесту завершується
+    app.add_handler(TypeHandler(Update, prepare_session_test), group=-1)
 
     # =======================
     # === COMMANDS ===
@@ -225,6 +316,7 @@ def main():
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CommandHandler("rules", cmd_rules))
     app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("leaderboard", cmd_leaderboard))
     app.add_handler(CommandHandler("favorites", show_favorites))
     app.add_handler(CommandHandler("office", office_open))
     app.add_handler(CommandHandler("wrong_answers", wrong_answers_cmd))
@@ -240,30 +332,26 @@ def main():
     if g("vip_edit_add_single_file_start"):
         app.add_handler(CallbackQueryHandler(g("vip_edit_add_single_file_start"), pattern=r"^vip_edit_addfile\|\d+$"), group=0)
 
-    # --- Майстер додавання питання: старт і колбеки гейту/скасування
-    app.add_handler(MessageHandler(filters.Regex(r"^➕ Додати питання$"), handle_add_question), group=0)
+    # --- Весь текст group=0: кнопки майстрів, @username для VIP, стан майстрів (build_text_routers)
+    app.add_handler(text_routers[0].handler(), group=0)
+
+    # --- Майстер додавання питання: колбеки гейту/скасування
     app.add_handler(CallbackQueryHandler(skip_image_button_handler, pattern=r"^addq_skip$"), group=0)
     app.add_handler(CallbackQueryHandler(addq_req_continue_cb, pattern=r"^addq_req_continue$"), group=0)
     app.add_handler(CallbackQueryHandler(addq_req_send_cb, pattern=r"^addq_req_send$"), group=0)
     app.add_handler(CallbackQueryHandler(addq_req_cancel_cb, pattern=r"^addq_req_cancel$"), group=0)
     app.add_handler(CallbackQueryHandler(addq_cancel_cb, pattern=r"^addq_cancel$"), group=0)
 
-    # --- Редагування питання: меню/кнопки
-    app.add_handler(MessageHandler(filters.Regex(r"^✏️ Редагувати питання$"), editq_command), group=0)
+    # --- Редагування питання: кнопки
     app.add_handler(CallbackQueryHandler(editq_buttons_cb, pattern=r"^editq_(show_all|edit|delete)$"), group=0)
     app.add_handler(CallbackQueryHandler(editq_buttons_cb, pattern=r"^editq_field\|"), group=0)
     app.add_handler(CallbackQueryHandler(editq_buttons_cb, pattern=r"^editq_media_clear\|\d+$"), group=0)
     app.add_handler(CallbackQueryHandler(editq_back, pattern=r"^editq_back$"), group=0)
     app.add_handler(CallbackQueryHandler(editq_cancel_cb, pattern=r"^editq_cancel$"), group=0)
 
-    # ❗ ЄДИНІ роутери group=0 (замість двох конкуруючих MessageHandler-ів)
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Regex(USERNAME_REGEX), _route_text_group0), group=0)
+    # ❗ ЄДИНИЙ роутер медіа group=0
     app.add_handler(MessageHandler(filters.Document.ALL | filters.PHOTO | filters.VIDEO | filters.AUDIO, _route_media_group0), group=0)
 
-    # --- VIP: довірені — username як текст ---
-    if g("vip_trusted_handle_username_text"):
-        app.add_handler(MessageHandler(filters.Regex(USERNAME_REGEX), g("vip_trusted_handle_username_text")), group=0)
-
     # --- VIP: wipe media ---
     if g("vip_wipe_media_start"):
         app.add_handler(CallbackQueryHandler(g("vip_wipe_media_start"), pattern=r"^vip_media_wipe\|\d+$"), group=0)
@@ -289,24 +377,11 @@ def main():
     # =======================
     # Group 1: ОФІС, VIP, МЕНЮ, СПЕЦ. ТЕКСТОВІ
     # =======================
-    app.add_handler(MessageHandler(filters.Regex(r"^(🔎 Пошук)$"), handle_home_menu), group=1)
+    # Весь текст group=1: кабінет, адмін-панель, меню, навчання/тестування (build_text_routers)
+    app.add_handler(text_routers[1].handler(), group=1)
     app.add_handler(CallbackQueryHandler(stop_search_cb, pattern=r"^stop_search$"), group=1)
-    app.add_handler(MessageHandler(filters.Regex(r"^👤 Мій кабінет$"), office_open), group=1)
-
-    app.add_handler(MessageHandler(filters.Regex(r"^👑 Адмін-панель$"), owner_entry), group=1)
-
+    app.add_handler(CallbackQueryHandler(search_page_cb, pattern=r"^srch\|(q|all)\|\d+$"), group=1)
     app.add_handler(CallbackQueryHandler(add_cancel_cb, pattern=r"^add_cancel\|(folder|test)$"), group=1)
-    app.add_handler(
-        MessageHandler(
-            filters.Regex(r"^(Моя статистика|Мої улюблені|Мої тести|Спільні тести|Мої питання|⬅️ Назад)$"),
-            office_buttons_handler
-        ),
-        group=1
-    )
-    app.add_handler(MessageHandler(filters.Regex(r"^Мої питання$"), office_my_questions), group=1)
-    app.add_handler(MessageHandler(filters.Regex(r"^Мої помилки$"), wrong_answers_cmd), group=1)
-
-    app.add_handler(MessageHandler(filters.REPLY & filters.TEXT & ~filters.COMMAND, owner_text_entry), group=1)
 
     if g("vip_img_upload"):
         app.add_handler(CallbackQueryHandler(g("vip_img_upload"), pattern=r"^vip_img_upload$"), group=1)
@@ -357,6 +432,8 @@ def main():
     if g("vip_go_to_test"):
         app.add_handler(CallbackQueryHandler(g("vip_go_to_test"), pattern=r"^vip_go\|\d+$"), group=1)
 
+    if g("vip_question_stats"):
+        app.add_handler(CallbackQueryHandler(g("vip_question_stats"), pattern=r"^vip_qstats\|\d+$"), group=1)
     if g("vip_edit_move_open"):
         app.add_handler(CallbackQueryHandler(g("vip_edit_move_open"), pattern=r"^vip_edit_move\|\d+$"), group=1)
     if g("vip_move_open"):
@@ -379,37 +456,11 @@ def main():
     if g("vip_trusted_pick_target"):
         app.add_handler(CallbackQueryHandler(g("vip_trusted_pick_target"), pattern=r"^vip_trusted_pick\|\d+\|.+$"), group=1)
 
-    app.add_handler(MessageHandler(filters.Regex(r"^(🔎 Пошук)$"), handle_home_menu), group=1)
-
-    app.add_handler(MessageHandler(filters.Regex(MAIN_MENU_REGEX), handle_main_menu), group=1)
-    app.add_handler(MessageHandler(filters.Regex(r"^🎓 Навчання з улюблених$"), start_favorites_learning), group=1)
-    app.add_handler(MessageHandler(filters.Regex(r"^📝 Тест з улюблених$"), start_favorites_test), group=1)
-    app.add_handler(MessageHandler(filters.Regex(r"^(🔙 Назад|⬅️ Назад)$"), back_text_handler), group=1)
-
     # НОВЕ: callback для вибору/очистки тем
     app.add_handler(CallbackQueryHandler(topics_cb, pattern=r"^topic\|"), group=1)
 
-    # 3) Learning
-    app.add_handler(MessageHandler(filters.Regex(r"^(\d+-\d+)$"), handle_learning_range), group=1)
-    app.add_handler(MessageHandler(filters.Regex(r"^🔢 Власний діапазон$"), handle_learning_range), group=1)
-    app.add_handler(MessageHandler(filters.TEXT & filters.Regex(CUSTOM_RANGE_REGEX), handle_custom_range), group=1)
-    app.add_handler(MessageHandler(filters.Regex(r"^(🔢 По порядку|🎲 В роздріб|🔙 Назад|⬅️ Назад)$"), handle_learning_order), group=1)
-
-    # 4) Testing
-    app.add_handler(MessageHandler(filters.Regex(r"^(🔟 10 питань|5️⃣0️⃣ 50 питань|💯 100 питань|🔢 Власна кількість|🔙 Назад)$"), handle_test_settings), group=1)
-    app.add_handler(
-        MessageHandler(
-            (filters.TEXT & filters.Regex(NUMBER_REGEX)),
-            handle_custom_test_count
-        ),
-        group=1
-    )
-
-    # 5) /start через кнопку
-    app.add_handler(MessageHandler(filters.Regex(r"^🔙 Обрати інший тест$"), cmd_start), group=2)
-
-    # 6) Динамічний вибір тесту (останній)
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_test_selection), group=2)
+    # Group 2: «🔙 Обрати інший тест» і динамічний вибір тесту (build_text_routers)
+    app.add_handler(text_routers[2].handler(), group=2)
 
     # --- Callback handlers (квіз) ---
     app.add_handler(CallbackQueryHandler(answer_handler, pattern=r"^ans\|\d+\|\d+$"))
@@ -441,7 +492,12 @@ def main():
     logger.info("✅ Бот запущений!")
     logger.info("⏹ Натисни CTRL+C щоб зупинити.")
 
-    app.run_polling(poll_interval=0.1, drop_pending_updates=True)
+    # WEBHOOK_URL задано — Telegram сам надсилає оновлення (handlers/webhook.py), інакше polling
+    webhook = webhook_config()
+    if webhook is not None:
+        run_webhook(app, webhook)
+    else:
+        app.run_polling(poll_interval=0.1, drop_pending_updates=True)
 
 
 if __name__ == "__main__":
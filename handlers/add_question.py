@@ -766,10 +766,11 @@ async def _finalize_and_save_question(data: dict, context: ContextTypes.DEFAULT_
     except Exception as e:
         print(f"[ADD_Q] failed to record qowner: {e}")
 
-    from utils.loader import discover_tests, discover_tests_hierarchy
+    from utils.loader import load_catalog_and_tree
     try:
-        context.bot_data["tests_catalog"] = discover_tests(TESTS_DIR)
-        context.bot_data["tests_tree"] = discover_tests_hierarchy(TESTS_DIR)
+        catalog, tree = load_catalog_and_tree(TESTS_DIR, changed=[json_path])
+        context.bot_data["tests_catalog"] = catalog
+        context.bot_data["tests_tree"] = tree
         print("[ADD_Q] Catalog & tree reloaded after adding question")
     except Exception as e:
         print(f"[ADD_Q] Failed to reload catalog/tree: {e}")
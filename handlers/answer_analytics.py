@@ -0,0 +1,323 @@
+# handlers/answer_analytics.py
+"""
+Аналітика складності питань.
+
+  - кожна відповідь у квізі → рядок answer_events (statistics_db.add_answer_event,
+    через write-behind чергу: гарячий шлях не чекає диска);
+  - періодичний ролап (JobQueue PTB, без неї — фонова asyncio-задача) дочитує
+    нові події по id шматками по ANSWER_ROLLUP_CHUNK рядків, перетворює шматок
+    на колонки і агрегує по (тест, питання): спроби, правильні, латентність,
+    частоти варіантів A–D. З NumPy — векторно (np.unique + np.bincount),
+    без нього — звичайним словником. Кожен шматок додається в question_stats
+    разом із позицією rollup_state в одній транзакції, тож кожна подія
+    агрегується рівно один раз, скільки б їх не було;
+  - читання: question_stats_for_test() (VIP-меню тесту), hardest_questions()
+    і suspicious_questions() (панель власника).
+
+Змінні оточення: ANSWER_ROLLUP_INTERVAL_S (300), ANSWER_ROLLUP_CHUNK (50000),
+ANSWER_STATS_MIN_ATTEMPTS (5) — поріг спроб для списків «складних» питань.
+"""
+import os
+import time
+import asyncio
+import logging
+import warnings
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from handlers.db import db
+from handlers.statistics_db import flush_pending_writes
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:  # pragma: no cover - numpy опційний
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger("test_bot.analytics")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+ROLLUP_INTERVAL_S = _env_int("ANSWER_ROLLUP_INTERVAL_S", 300)
+ROLLUP_CHUNK = _env_int("ANSWER_ROLLUP_CHUNK", 50000)
+MIN_ATTEMPTS = _env_int("ANSWER_STATS_MIN_ATTEMPTS", 5)
+
+N_OPTIONS = 4                  # варіанти A–D (chosen поза межами не йде в розподіл)
+_ROLLUP_NAME = "answer_events"
+
+# (тест, q_index, спроби, правильні, сума латентності мс, к-сть латентностей, c0, c1, c2, c3)
+_Delta = Tuple[str, int, int, int, int, int, int, int, int, int]
+
+_rollup_lock = asyncio.Lock()
+_fallback_task: Optional[asyncio.Task] = None
+_stats = {"runs": 0, "events": 0, "last_ms": 0.0, "last_events": 0, "engine": "numpy" if NUMPY_AVAILABLE else "python"}
+
+
+# ====== Агрегація шматка ======
+
+def _aggregate_numpy(tests: Sequence[str], q_idx: Sequence[int], chosen: Sequence[int],
+                     correct: Sequence[int], latency: Sequence[int]) -> List[_Delta]:
+    # назви тестів → коди (словник швидший за np.unique по рядках)
+    codes: Dict[str, int] = {}
+    test_codes = np.fromiter((codes.setdefault(t, len(codes)) for t in tests), dtype=np.int64, count=len(tests))
+    names = list(codes)
+    q = np.fromiter(q_idx, dtype=np.int64, count=len(q_idx))
+    span = int(q.max()) + 1
+    uniq, inv = np.unique(test_codes * span + q, return_inverse=True)
+    n = len(uniq)
+
+    attempts = np.bincount(inv, minlength=n)
+    n_correct = np.bincount(inv, weights=np.fromiter(correct, dtype=np.float64, count=len(correct)), minlength=n)
+
+    lat = np.fromiter(latency, dtype=np.float64, count=len(latency))
+    has_lat = lat >= 0
+    lat_sum = np.bincount(inv[has_lat], weights=lat[has_lat], minlength=n)
+    lat_n = np.bincount(inv[has_lat], minlength=n)
+
+    ch = np.fromiter(chosen, dtype=np.int64, count=len(chosen))
+    ok = (ch >= 0) & (ch < N_OPTIONS)
+    dist = np.bincount(inv[ok] * N_OPTIONS + ch[ok], minlength=n * N_OPTIONS).reshape(n, N_OPTIONS)
+
+    uq = uniq.tolist()
+    return [
+        (names[key // span], key % span, a, int(c), int(ls), ln, *d)
+        for key, a, c, ls, ln, d in zip(
+            uq, attempts.tolist(), n_correct.tolist(), lat_sum.tolist(), lat_n.tolist(), dist.tolist()
+        )
+    ]
+
+
+def _aggregate_python(tests: Sequence[str], q_idx: Sequence[int], chosen: Sequence[int],
+                      correct: Sequence[int], latency: Sequence[int]) -> List[_Delta]:
+    acc: Dict[Tuple[str, int], List[int]] = {}
+    for t, q, c, ok, lat in zip(tests, q_idx, chosen, correct, latency):
+        row = acc.get((t, q))
+        if row is None:
+            row = acc[(t, q)] = [0] * (4 + N_OPTIONS)
+        row[0] += 1
+        row[1] += 1 if ok else 0
+        if lat >= 0:
+            row[2] += int(lat)
+            row[3] += 1
+        if 0 <= c < N_OPTIONS:
+            row[4 + c] += 1
+    return [(t, q, *row) for (t, q), row in acc.items()]
+
+
+def aggregate_chunk(rows: Sequence[tuple]) -> List[_Delta]:
+    """
+    rows: [(id, test_name, q_index, chosen, correct, latency_ms)] → приріст по питаннях.
+    Відсутні chosen / latency_ms приходять як -1 (COALESCE у запиті).
+    """
+    if not rows:
+        return []
+    _ids, tests, q_idx, chosen, correct, latency = zip(*rows)  # рядки → колонки
+    if NUMPY_AVAILABLE:
+        return _aggregate_numpy(tests, q_idx, chosen, correct, latency)
+    return _aggregate_python(tests, q_idx, chosen, correct, latency)
+
+
+# ====== Ролап ======
+
+async def run_rollup(chunk: int = ROLLUP_CHUNK) -> Dict[str, Any]:
+    """Дочитати нові події і додати їх у question_stats. Повертає {"events", "questions", "ms"}."""
+    async with _rollup_lock:
+        t0 = time.perf_counter()
+        await flush_pending_writes()
+
+        row = await db.fetchone("SELECT last_id FROM rollup_state WHERE name = ?", (_ROLLUP_NAME,))
+        last_id = row[0] if row else 0
+        events = 0
+        touched = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = await db.fetchall("""
+                SELECT id, test_name, q_index, COALESCE(chosen, -1), correct, COALESCE(latency_ms, -1)
+                FROM answer_events WHERE id > ? ORDER BY id LIMIT ?
+            """, (last_id, chunk))
+            if not rows:
+                break
+            deltas = await loop.run_in_executor(None, aggregate_chunk, rows)
+            new_last = rows[-1][0]
+            async with db.transaction() as conn:
+                await conn.executemany("""
+                    INSERT INTO question_stats(test_name, q_index, attempts, correct, latency_sum_ms, latency_n,
+                                               chosen_0, chosen_1, chosen_2, chosen_3)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(test_name, q_index) DO UPDATE SET
+                        attempts = attempts + excluded.attempts,
+                        correct = correct + excluded.correct,
+                        latency_sum_ms = latency_sum_ms + excluded.latency_sum_ms,
+                        latency_n = latency_n + excluded.latency_n,
+                        chosen_0 = chosen_0 + excluded.chosen_0,
+                        chosen_1 = chosen_1 + excluded.chosen_1,
+                        chosen_2 = chosen_2 + excluded.chosen_2,
+                        chosen_3 = chosen_3 + excluded.chosen_3,
+                        updated_at = CURRENT_TIMESTAMP
+                """, deltas)
+                await conn.execute("""
+                    INSERT INTO rollup_state(name, last_id) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id
+                """, (_ROLLUP_NAME, new_last))
+            last_id = new_last
+            events += len(rows)
+            touched += len(deltas)
+            if len(rows) < chunk:
+                break
+
+        ms = (time.perf_counter() - t0) * 1000.0
+        _stats["runs"] += 1
+        _stats["events"] += events
+        _stats["last_events"] = events
+        _stats["last_ms"] = round(ms, 1)
+        if events:
+            logger.info(f"[ANALYTICS] rollup: {events} events → {touched} question rows in {ms:.0f} ms")
+        return {"events": events, "questions": touched, "ms": round(ms, 1)}
+
+
+async def _rollup_job(context) -> None:
+    try:
+        await run_rollup()
+    except Exception as e:
+        logger.warning(f"[ANALYTICS] rollup failed: {e}")
+
+
+async def _fallback_loop() -> None:
+    while True:
+        await asyncio.sleep(ROLLUP_INTERVAL_S)
+        await _rollup_job(None)
+
+
+def start_rollup_job(application) -> None:
+    """Запустити періодичний ролап: JobQueue, якщо PTB встановлено з [job-queue], інакше asyncio-задача."""
+    global _fallback_task
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # PTB попереджає, якщо JobQueue не встановлена
+        jq = application.job_queue
+    if jq is not None:
+        jq.run_repeating(_rollup_job, interval=ROLLUP_INTERVAL_S, first=ROLLUP_INTERVAL_S, name="answer_rollup")
+        return
+    if _fallback_task is None or _fallback_task.done():
+        _fallback_task = asyncio.get_running_loop().create_task(_fallback_loop(), name="answer-rollup")
+
+
+async def stop_rollup_job() -> None:
+    global _fallback_task
+    if _fallback_task is not None:
+        _fallback_task.cancel()
+        try:
+            await _fallback_task
+        except asyncio.CancelledError:
+            pass
+        _fallback_task = None
+
+
+def rollup_stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+
+# ====== Читання зведень ======
+
+_COLUMNS = "test_name, q_index, attempts, correct, latency_sum_ms, latency_n, chosen_0, chosen_1, chosen_2, chosen_3"
+
+
+def _row_to_dict(row: tuple) -> Dict[str, Any]:
+    attempts = row[2] or 0
+    dist = list(row[6:10])
+    return {
+        "test_name": row[0],
+        "q_index": row[1],
+        "attempts": attempts,
+        "correct": row[3],
+        "p_correct": (row[3] / attempts) if attempts else 0.0,
+        "avg_latency_ms": (row[4] / row[5]) if row[5] else None,
+        "chosen": dist,
+        "chosen_share": [(c / attempts) if attempts else 0.0 for c in dist],
+    }
+
+
+async def question_stats_for_test(test_name: str) -> List[Dict[str, Any]]:
+    """Зведення по всіх питаннях тесту (за q_index)."""
+    rows = await db.fetchall(
+        f"SELECT {_COLUMNS} FROM question_stats WHERE test_name = ? ORDER BY q_index", (test_name,)
+    )
+    return [_row_to_dict(r) for r in rows]
+
+
+async def hardest_questions(limit: int = 10, min_attempts: int = MIN_ATTEMPTS,
+                            test_name: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Питання з найменшою часткою правильних (лише з достатньою кількістю спроб)."""
+    where = "attempts >= ?"
+    params: List[Any] = [min_attempts]
+    if test_name is not None:
+        where += " AND test_name = ?"
+        params.append(test_name)
+    rows = await db.fetchall(f"""
+        SELECT {_COLUMNS} FROM question_stats
+        WHERE {where}
+        ORDER BY CAST(correct AS REAL) / attempts, attempts DESC
+        LIMIT ?
+    """, params + [limit])
+    return [_row_to_dict(r) for r in rows]
+
+
+async def suspicious_questions(correct_of: Callable[[str, int], Optional[int]], limit: int = 10,
+                               min_attempts: int = MIN_ATTEMPTS) -> List[Dict[str, Any]]:
+    """
+    Ймовірно «зламані» питання: якийсь неправильний варіант обирають частіше,
+    ніж правильний (можливо, хибний ключ). correct_of(тест, q_index) → індекс правильного.
+    """
+    rows = await db.fetchall(
+        f"SELECT {_COLUMNS} FROM question_stats WHERE attempts >= ? AND correct * 2 < attempts",
+        (min_attempts,),
+    )
+    out = []
+    for r in rows:
+        item = _row_to_dict(r)
+        right = correct_of(item["test_name"], item["q_index"])
+        if right is None or not (0 <= right < N_OPTIONS):
+            continue
+        top = max(range(N_OPTIONS), key=lambda i: item["chosen"][i])
+        if top != right and item["chosen"][top] > item["chosen"][right]:
+            item["top_choice"] = top
+            out.append(item)
+    out.sort(key=lambda x: x["chosen_share"][x["top_choice"]], reverse=True)
+    return out[:limit]
+
+
+def format_question_line(item: Dict[str, Any], with_test: bool = False) -> str:
+    """'№12: 34% правильних (50 спроб), A 10% · B 34% · C 50% · D 6%, ~8.2 с'"""
+    shares = " · ".join(f"{'ABCD'[i]} {item['chosen_share'][i] * 100:.0f}%" for i in range(N_OPTIONS))
+    lat = item["avg_latency_ms"]
+    lat_txt = f", ~{lat / 1000:.1f} с" if lat is not None else ""
+    name = item["test_name"] if len(item["test_name"]) <= 40 else item["test_name"][:39] + "…"
+    head = f"{name} №{item['q_index'] + 1}" if with_test else f"№{item['q_index'] + 1}"
+    return f"{head}: {item['p_correct'] * 100:.0f}% правильних ({item['attempts']} спроб), {shares}{lat_txt}"
+
+
+def _benchmark(n: int = 1_000_000) -> None:
+    """python -c "from handlers.answer_analytics import _benchmark; _benchmark()" """
+    import random
+    rnd = random.Random(1)
+    tests = [f"test{i}" for i in range(200)]
+    rows = [
+        (i, rnd.choice(tests), rnd.randrange(300), rnd.randrange(4), rnd.random() < 0.6,
+         rnd.randrange(500, 30000) if rnd.random() < 0.9 else -1)
+        for i in range(n)
+    ]
+    for name, fn in (("numpy", _aggregate_numpy if NUMPY_AVAILABLE else None), ("python", _aggregate_python)):
+        if fn is None:
+            print(f"{name}: not installed")
+            continue
+        t0 = time.perf_counter()
+        for start in range(0, n, ROLLUP_CHUNK):
+            part = rows[start:start + ROLLUP_CHUNK]
+            _ids, tests_c, q_c, ch_c, ok_c, lat_c = zip(*part)
+            fn(tests_c, q_c, ch_c, ok_c, lat_c)
+        print(f"{name}: {n} events in {(time.perf_counter() - t0) * 1000:.0f} ms")
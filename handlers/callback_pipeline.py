@@ -0,0 +1,78 @@
+# handlers/callback_pipeline.py
+"""
+Швидке підтвердження inline-кнопок квізу.
+
+Telegram показує «годинник» на кнопці, доки бот не відповість на callback_query.
+Раніше query.answer() викликався лише після підрахунку, запису в БД і редагування
+повідомлення — користувач чекав увесь цей ланцюжок.
+
+@fast_ack_callback:
+  1) одразу (окремою задачею) відповідає на callback_query — спінер зникає
+     ще до підрахунку і записів у БД;
+  2) сам хендлер виконується в межах обробки оновлення, тож під замком
+     користувача з UserOrderedUpdateProcessor (handlers/update_processor.py):
+     відповідь, «Далі», «⭐», коментар чи текст одного користувача змінюють
+     user_data строго по черзі, а інші користувачі обробляються паралельно.
+
+Усередині хендлерів замість query.answer() використовуйте answer_once(query):
+він не відправляє повторну відповідь на вже підтверджений callback.
+"""
+import functools
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger("test_bot")
+
+# id callback_query, на які вже відповіли (обмежений за розміром)
+_ACKED_MAX = 4096
+_acked: "OrderedDict[str, None]" = OrderedDict()
+
+_stats = {"acked": 0, "handled": 0}
+
+
+def _mark_acked(query_id: str) -> None:
+    _acked[query_id] = None
+    if len(_acked) > _ACKED_MAX:
+        _acked.popitem(last=False)
+
+
+async def _send_answer(query, *args, **kwargs) -> None:
+    try:
+        await query.answer(*args, **kwargs)
+    except Exception as e:
+        logger.debug("[CB] answer failed: %s", e)
+
+
+async def answer_once(query, *args, **kwargs) -> None:
+    """query.answer(), якщо на цей callback ще не відповідали (помилки ігноруються)."""
+    if query is None or query.id in _acked:
+        return
+    _mark_acked(query.id)
+    await _send_answer(query, *args, **kwargs)
+
+
+def fast_ack_callback(
+    handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]:
+    """Декоратор CallbackQuery-хендлера: миттєвий ack, далі сам хендлер під замком користувача."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        query = update.callback_query
+        if query is not None and query.id not in _acked:
+            # позначаємо одразу: answer_once() у хендлері вже не відповідатиме вдруге
+            _mark_acked(query.id)
+            _stats["acked"] += 1
+            context.application.create_task(_send_answer(query), update=update)
+        _stats["handled"] += 1
+        await handler(update, context)
+
+    return wrapper
+
+
+def pipeline_stats() -> Dict[str, int]:
+    return dict(_stats)
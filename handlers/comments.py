@@ -1,33 +1,48 @@
 import os
 import json
 import glob
+import asyncio
 import aiofiles
 import html
 import logging
 from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
 from telegram import Update, ForceReply
 from telegram.ext import ContextTypes
 from utils.keyboards import comment_menu, build_options_markup
+from handlers.statistics_db import add_comment_db, import_comments_db, get_comments_db, get_comment_counts_db
+from handlers.message_state import note_markup
 
 logger = logging.getLogger("test_bot")
 
+# Коментарі зберігаються в stats.db (таблиця comments, індекс (test_name, q_index)).
+# Старі <test>.comments.json і легасі <test>_q<idx>.json імпортуються один раз
+# при першому зверненні до тесту й перейменовуються на *.bak.
+# Лічильники для бейджа 💬 на кнопках — у пам'яті: {тест: {q_index: n}},
+# завантажуються одним GROUP BY на тест і далі лише інкрементуються.
+
+_counts: Dict[str, Dict[int, int]] = {}
+_imported: Set[Tuple[str, str]] = set()
+_import_lock = asyncio.Lock()
+
 # ---------- ВНУТРІШНІ УТИЛІТИ ----------
 
 def _test_comments_path(test_name: str, test_dir: str) -> str:
     """
-    Шлях до файлу коментарів для тесту у тій же теці, де лежить сам тест.
+    Шлях до (старого) файлу коментарів для тесту у тій же теці, де лежить сам тест.
     """
     safe = test_name  # можна додати санацію
     return os.path.join(test_dir, f"{safe}.comments.json")
 
-async def _load_comments_dict(test_name: str, test_dir: str) -> dict:
+async def _read_json_comment_files(test_name: str, test_dir: str) -> Tuple[dict, List[str]]:
     """
-    Завантажити словник коментарів для тесту:
-    { "q_index(str)": [ {user_id, username, text, ts}, ... ] }.
+    Прочитати старі файли коментарів тесту:
+    ({ "q_index(str)": [ {user_id, username, text, ts}, ... ] }, [прочитані файли]).
     Підтримка легасі-файлів <test>_q<idx>.json.
     """
     path = _test_comments_path(test_name, test_dir)
     data: dict = {}
+    files: List[str] = []
 
     if os.path.exists(path):
         try:
@@ -36,11 +51,12 @@ async def _load_comments_dict(test_name: str, test_dir: str) -> dict:
                 data = json.loads(raw) if raw.strip() else {}
                 if not isinstance(data, dict):
                     data = {}
+            files.append(path)
         except Exception:
             data = {}
 
     # Легасі: <test>_q*.json
-    legacy_pattern = os.path.join(test_dir, f"{test_name}_q*.json")
+    legacy_pattern = os.path.join(glob.escape(test_dir), f"{glob.escape(test_name)}_q*.json")
     legacy_files = glob.glob(legacy_pattern)
     if legacy_files:
         for lf in legacy_files:
@@ -64,27 +80,65 @@ async def _load_comments_dict(test_name: str, test_dir: str) -> dict:
                             "text": text,
                             "ts": c.get("ts") if isinstance(c, dict) else None
                         })
+                    files.append(lf)
                 except Exception:
                     pass
             except Exception:
                 pass
 
-    return data
+    return data, files
 
-async def _save_comments_dict(test_name: str, test_dir: str, data: dict):
-    """Зберегти агрегований словник коментарів для тесту."""
-    path = _test_comments_path(test_name, test_dir)
-    async with aiofiles.open(path, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+async def _ensure_imported(test_name: str, test_dir: Optional[str]) -> None:
+    """Одноразовий імпорт старих JSON-коментарів тесту в stats.db."""
+    if not test_dir or (test_name, test_dir) in _imported:
+        return
+    async with _import_lock:
+        if (test_name, test_dir) in _imported:
+            return
+        data, files = await _read_json_comment_files(test_name, test_dir)
+        if files:
+            rows = []
+            for key, items in data.items():
+                try:
+                    q_index = int(key)
+                except (TypeError, ValueError):
+                    continue
+                for c in items if isinstance(items, list) else []:
+                    if not isinstance(c, dict) or not c.get("text"):
+                        continue
+                    rows.append((test_name, q_index, c.get("user_id"), c.get("username"),
+                                 str(c["text"])[:1000], c.get("ts")))
+            try:
+                n = await import_comments_db(rows)
+            except Exception as e:
+                logger.error(f"[COMMENTS] import of {test_name} failed, JSON files kept: {e}")
+                return
+            for fp in files:
+                try:
+                    os.replace(fp, fp + ".bak")
+                except OSError as e:
+                    logger.warning(f"[COMMENTS] cannot rename {fp}: {e}")
+            _counts.pop(test_name, None)
+            logger.info(f"[COMMENTS] imported {n} comments of '{test_name}' from {len(files)} JSON file(s)")
+        _imported.add((test_name, test_dir))
+
+async def _counts_for_test(test_name: str, test_dir: Optional[str] = None) -> Dict[int, int]:
+    await _ensure_imported(test_name, test_dir)
+    counts = _counts.get(test_name)
+    if counts is None:
+        counts = _counts[test_name] = await get_comment_counts_db(test_name)
+    return counts
 
 # ---------- ПУБЛІЧНИЙ ХЕЛПЕР ----------
 
-async def get_comments_count(test_name: str, q_index: int, test_dir: str) -> int:
+async def get_comments_count(test_name: str, q_index: int, test_dir: Optional[str] = None) -> int:
     """
-    Повертає кількість коментарів для питання.
+    Повертає кількість коментарів для питання (з лічильників у пам'яті).
     """
-    data = await _load_comments_dict(test_name, test_dir)
-    return len(data.get(str(q_index), []))
+    if not test_name:
+        return 0
+    counts = await _counts_for_test(test_name, test_dir)
+    return counts.get(q_index, 0)
 
 # ---------- ХЕНДЛЕРИ ----------
 
@@ -118,18 +172,11 @@ async def handle_comment_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
         await msg.reply_text("❌ Порожній коментар не збережено. Напишіть текст")
         return
 
-    data = await _load_comments_dict(test_name, test_dir)
-    key = str(q_index)
-    data.setdefault(key, [])
-
-    data[key].append({
-        "user_id": user_id,
-        "username": username,
-        "text": text[:1000],
-        "ts": datetime.utcnow().isoformat() + "Z"
-    })
-
-    await _save_comments_dict(test_name, test_dir, data)
+    counts = await _counts_for_test(test_name, test_dir)
+    if not await add_comment_db(test_name, q_index, user_id, username, text[:1000], datetime.utcnow().isoformat() + "Z"):
+        await msg.reply_text("⚠️ Не вдалося зберегти коментар. Спробуйте надіслати його ще раз.")
+        return
+    counts[q_index] = counts.get(q_index, 0) + 1
 
     context.user_data.pop("awaiting_comment", None)
     context.user_data.pop("comment_q_index", None)
@@ -138,22 +185,20 @@ async def handle_comment_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     # Оновлення клавіатури під питанням
     try:
-        comments_count = len(data.get(key, []))
+        comments_count = counts[q_index]
         is_fav = q_index in context.user_data.get("fav_set", set())
 
         chat_id = context.user_data.get("question_chat_id")
         msg_id = context.user_data.get("question_message_id")
         if chat_id and msg_id:
-            await context.bot.edit_message_reply_markup(
-                chat_id=chat_id,
-                message_id=msg_id,
-                reply_markup=build_options_markup(
-                    q_index,
-                    highlight=True,
-                    is_favorited=is_fav,
-                    comments_count=comments_count
-                )
+            markup = build_options_markup(
+                q_index,
+                highlight=True,
+                is_favorited=is_fav,
+                comments_count=comments_count
             )
+            await context.bot.edit_message_reply_markup(chat_id=chat_id, message_id=msg_id, reply_markup=markup)
+            note_markup(context.chat_data, msg_id, markup)
     except Exception as e:
         logger.error(f"[COMMENTS] Failed to update question keyboard: {e}")
 
@@ -234,8 +279,8 @@ async def comment_view_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.answer("❓ Спочатку оберіть тест.", show_alert=True)
         return
 
-    comments_dict = await _load_comments_dict(test_name, test_dir)
-    comments = comments_dict.get(str(q_index), [])
+    await _ensure_imported(test_name, test_dir)
+    comments = await get_comments_db(test_name, q_index)
 
     if not comments:
         await query.message.reply_text("ℹ️ Для цього питання ще немає коментарів.", reply_markup=comment_menu(q_index))
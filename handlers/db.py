@@ -0,0 +1,207 @@
+# handlers/db.py
+"""
+Єдиний шар доступу до stats.db.
+
+  - одне підключення-писач (усі INSERT/UPDATE/DELETE/DDL) + asyncio.Lock,
+    щоб транзакції різних корутин не перемішувались на одному з'єднанні;
+  - невеликий пул read-only підключень (WAL дозволяє читати паралельно з записом):
+    DB_READERS (за замовчуванням 3);
+  - кеш підготовлених запитів sqlite3 на кожному з'єднанні: DB_STATEMENT_CACHE (256);
+  - транзакції: `async with db.transaction() as conn: ...` — commit або rollback;
+  - хронометраж: час кожного запиту накопичується за викликачем (модуль.функція),
+    повільні (> DB_SLOW_MS, 100 мс) пишуться в лог; query_stats() — топ викликачів.
+
+Модулі не відкривають власних aiosqlite.connect — лише через `db`.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import aiosqlite
+
+logger = logging.getLogger("test_bot.db")
+
+DB_FILENAME = os.path.join(os.path.dirname(__file__), "..", "stats.db")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class Database:
+    def __init__(self, path: str, readers: int = 3, statement_cache: int = 256, slow_ms: int = 100):
+        self.path = path
+        self.readers = max(0, readers)
+        self.statement_cache = max(0, statement_cache)
+        self.slow_ms = slow_ms
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock: Optional[asyncio.Lock] = None
+        self._pool: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._open_lock: Optional[asyncio.Lock] = None
+        # викликач -> [кількість, сумарно мс, макс мс]
+        self._timings: Dict[str, List[float]] = {}
+
+    # ---------- підключення ----------
+
+    async def writer(self) -> aiosqlite.Connection:
+        """Підключення-писач (створюється при першому зверненні)."""
+        if self._writer is None:
+            if self._open_lock is None:
+                self._open_lock = asyncio.Lock()
+            async with self._open_lock:
+                if self._writer is None:
+                    conn = await aiosqlite.connect(self.path, cached_statements=self.statement_cache)
+                    await conn.execute("PRAGMA journal_mode=WAL;")
+                    await conn.execute("PRAGMA synchronous=NORMAL;")
+                    await conn.execute("PRAGMA foreign_keys=ON;")
+                    self._writer_lock = asyncio.Lock()
+                    self._writer = conn
+        return self._writer
+
+    async def _open_pool(self) -> None:
+        await self.writer()  # файл БД і WAL мають існувати до read-only підключень
+        pool: asyncio.Queue = asyncio.Queue()
+        uri = "file:" + os.path.abspath(self.path) + "?mode=ro"
+        for _ in range(self.readers):
+            try:
+                conn = await aiosqlite.connect(uri, uri=True, cached_statements=self.statement_cache)
+                await conn.execute("PRAGMA query_only=ON;")
+            except Exception as e:
+                logger.warning(f"[DB] read-only connection failed, reads go to the writer: {e}")
+                break
+            self._reader_conns.append(conn)
+            pool.put_nowait(conn)
+        self._pool = pool
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Підключення для читання з пулу (або писач, якщо пул порожній/вимкнений)."""
+        if self._pool is None:
+            if self._open_lock is None:
+                self._open_lock = asyncio.Lock()
+            await self.writer()
+            async with self._open_lock:
+                if self._pool is None:
+                    await self._open_pool()
+        if not self._reader_conns:
+            yield await self.writer()
+            return
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Транзакція на писачі: commit при успіху, rollback при винятку."""
+        conn = await self.writer()
+        async with self._writer_lock:
+            t0 = time.perf_counter()
+            try:
+                yield conn
+                await conn.commit()
+            except BaseException:
+                try:
+                    await conn.rollback()
+                except Exception:
+                    pass
+                raise
+            finally:
+                self._record(_caller(3), t0)
+
+    # ---------- запити ----------
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        t0 = time.perf_counter()
+        try:
+            async with self.reader() as conn:
+                async with conn.execute(sql, params) as cur:
+                    return await cur.fetchall()
+        finally:
+            self._record(_caller(2), t0)
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        t0 = time.perf_counter()
+        try:
+            async with self.reader() as conn:
+                async with conn.execute(sql, params) as cur:
+                    return await cur.fetchone()
+        finally:
+            self._record(_caller(2), t0)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> aiosqlite.Cursor:
+        """Один оператор запису в окремій транзакції (rowcount / lastrowid — у курсорі)."""
+        async with self.transaction() as conn:
+            return await conn.execute(sql, params)
+
+    # ---------- метрики ----------
+
+    def _record(self, caller: str, t0: float) -> None:
+        ms = (time.perf_counter() - t0) * 1000.0
+        item = self._timings.get(caller)
+        if item is None:
+            self._timings[caller] = [1, ms, ms]
+        else:
+            item[0] += 1
+            item[1] += ms
+            if ms > item[2]:
+                item[2] = ms
+        if ms > self.slow_ms:
+            logger.warning(f"[DB] slow query from {caller}: {ms:.1f} ms")
+
+    def query_stats(self, top: int = 10) -> List[Dict[str, Any]]:
+        """Викликачі, відсортовані за сумарним часом у БД."""
+        rows = [
+            {"caller": k, "count": int(v[0]), "total_ms": round(v[1], 1),
+             "avg_ms": round(v[1] / v[0], 2), "max_ms": round(v[2], 1)}
+            for k, v in self._timings.items()
+        ]
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows[:top]
+
+    # ---------- закриття ----------
+
+    async def close(self) -> None:
+        for conn in self._reader_conns:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+        self._reader_conns = []
+        self._pool = None
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+        self._open_lock = None
+
+
+def _caller(depth: int) -> str:
+    """'модуль.функція' викликача (для хронометражу; depth — рівень кадру)."""
+    try:
+        f = sys._getframe(depth)
+        # пропускаємо внутрішні кадри contextlib (transaction викликається через async with)
+        while f is not None and f.f_globals.get("__name__") in ("contextlib", __name__):
+            f = f.f_back
+        if f is None:
+            return "?"
+        mod = f.f_globals.get("__name__", "?").rsplit(".", 1)[-1]
+        return f"{mod}.{f.f_code.co_name}"
+    except ValueError:
+        return "?"
+
+
+db = Database(
+    DB_FILENAME,
+    readers=_env_int("DB_READERS", 3),
+    statement_cache=_env_int("DB_STATEMENT_CACHE", 256),
+    slow_ms=_env_int("DB_SLOW_MS", 100),
+)
@@ -15,6 +15,9 @@ from handlers.statistics_db import (
 )
 from handlers.comments import get_comments_count
 from utils.i18n import t
+from handlers.state_sync import get_session_questions
+from handlers.quiz_session import QuizSession
+from handlers.message_state import note_markup
 
 # --- Inline toggle (callback fav|<q_index>) ---
 async def favorite_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -38,7 +41,7 @@ async def favorite_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     test_name = context.user_data.get("current_test", "unknown")
     test_dir = context.user_data.get("current_test_dir")
-    questions = context.user_data.get("questions", [])
+    questions = get_session_questions(context)
     if q_index >= len(questions):
         await query.answer("❌ Питання не знайдено.", show_alert=True)
         return
@@ -83,6 +86,7 @@ async def favorite_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             comments_count=comments_count
         )
         await query.edit_message_reply_markup(reply_markup=markup)
+        note_markup(context.chat_data, query.message.message_id, markup)
     except Exception:
         pass
 
@@ -156,7 +160,7 @@ async def start_favorites_learning(update: Update, context: ContextTypes.DEFAULT
     """
     user_id = update.effective_user.id
     test_name = context.user_data.get("current_test")
-    questions = context.user_data.get("questions", [])
+    questions = get_session_questions(context)
     if not test_name or not questions:
         await update.message.reply_text("❌ Спочатку обери тест зі списку.", reply_markup=main_menu())
         return
@@ -168,12 +172,7 @@ async def start_favorites_learning(update: Update, context: ContextTypes.DEFAULT
         return
 
     # Стан сесії навчання
-    context.user_data["mode"] = "learning"
-    context.user_data["order"] = fav_indices
-    context.user_data["step"] = 0
-    context.user_data["score"] = 0
-    context.user_data["wrong_pairs"] = []
-    context.user_data["current_streak"] = 0
+    QuizSession.start(context.user_data, "learning", fav_indices)
 
     # ВАЖЛИВО: скидаємо “живе” повідомлення, щоб надсилати НОВЕ, а не редагувати старе
     context.user_data.pop("question_chat_id", None)
@@ -193,7 +192,7 @@ async def start_favorites_test(update: Update, context: ContextTypes.DEFAULT_TYP
 
     user_id = update.effective_user.id
     test_name = context.user_data.get("current_test")
-    questions = context.user_data.get("questions", [])
+    questions = get_session_questions(context)
     if not test_name or not questions:
         await update.message.reply_text("❌ Спочатку обери тест зі списку.", reply_markup=main_menu())
         return
@@ -207,15 +206,7 @@ async def start_favorites_test(update: Update, context: ContextTypes.DEFAULT_TYP
     random.shuffle(fav_indices)
 
     # Стан сесії тесту
-    context.user_data["mode"] = "test"
-    context.user_data["order"] = fav_indices
-    context.user_data["step"] = 0
-    context.user_data["score"] = 0
-    context.user_data["wrong_pairs"] = []
-    context.user_data["current_streak"] = 0
-
-    from datetime import datetime
-    context.user_data["start_time"] = datetime.now()
+    QuizSession.start(context.user_data, "test", fav_indices)
 
     # ВАЖЛИВО: скидаємо “живе” повідомлення, щоб надсилати НОВЕ, а не редагувати старе
     context.user_data.pop("question_chat_id", None)
@@ -1,30 +1,27 @@
 # handlers/learning.py
 import random
-import aiofiles
 import logging
-import io
 import os
-import base64
 import re
-from datetime import datetime
 from typing import List
 
 from telegram import (
     Update,
-    InputMediaPhoto,
-    InputMediaVideo,
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaAnimation,   # для GIF
+    InputFile,
 )
 from telegram.ext import ContextTypes
-from telegram.error import BadRequest
 from utils.keyboards import (
     learning_range_keyboard, learning_order_keyboard,
     build_options_markup, get_progress_bar
 )
 from utils.formatting import format_question_text
+from utils.render_cache import cached_caption, question_key
 from utils.i18n import t
+from handlers.media_registry import PLACEHOLDER_KEY, PLACEHOLDER_PNG, deliver
+from handlers.state_sync import get_session_questions, session_topic_pool
+from handlers.quiz_session import QuizSession, get_session
+from handlers.message_state import remember_sent, update_question_media
+from utils.media_reader import open_upload
 
 logger = logging.getLogger("test_bot.learning")
 
@@ -36,27 +33,23 @@ _IMG_EXT_ANIM = {".gif"}
 _AUDIO_EXTS = {".mp3", ".wav", ".ogg", ".m4a", ".aac", ".flac"}
 _VIDEO_INLINE = {".mp4"}
 
-def _placeholder_png_bytes() -> bytes:
-    b64 = (
-        b'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAA'
-        b'AAC0lEQVR42mP8/x8AAwMCAO+XU2sAAAAASUVORK5CYII='
-    )
-    return base64.b64decode(b64)
-
-async def _load_file_bytes(path: str | None) -> bytes | None:
-    if not path:
-        return None
+_SEND_METHODS = {
+    "photo": "send_photo",
+    "animation": "send_animation",
+    "video": "send_video",
+    "audio": "send_audio",
+    "document": "send_document",
+}
+
+async def _media_upload(path: str, filename: str, attach: bool = False) -> InputFile:
+    """InputFile для аплоаду (читання — у пулі utils.media_reader); OSError — файл не читається."""
+    if path == PLACEHOLDER_KEY:
+        return InputFile(PLACEHOLDER_PNG, filename=filename, attach=attach)
     try:
-        async with aiofiles.open(path, "rb") as f:
-            return await f.read()
-    except Exception as e:
+        return await open_upload(path, filename, attach=attach)
+    except OSError as e:
         logger.debug("[LEARN][MEDIA] read failed %s: %s", path, e)
-        return None
-
-def _bio_with_name(data: bytes, filename: str) -> io.BytesIO:
-    bio = io.BytesIO(data)
-    bio.name = filename
-    return bio
+        raise OSError(f"cannot read media {path}") from e
 
 def _pick_media_for_question(q: dict) -> tuple[str, str | None]:
     if ENABLE_MEDIA:
@@ -231,14 +224,6 @@ async def handle_custom_range(update: Update, context: ContextTypes.DEFAULT_TYPE
         logger.warning(f"[LEARN] Custom range parse error '{txt}' err={e}")
         await update.message.reply_text(t(lang, "learning_set_custom", count=total_questions))
 
-def _match_topic_filter(q: dict, topic: str) -> bool:
-    if not topic:
-        return True
-    tps = q.get("topics")
-    if not isinstance(tps, list):
-        return False
-    return any(isinstance(tp, str) and tp.strip().lower() == topic.strip().lower() for tp in tps)
-
 async def handle_learning_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _is_learning_flow(context) or "learning_range" not in context.user_data:
         logger.info("[LEARN] order choice outside learning flow — ignore")
@@ -264,9 +249,8 @@ async def handle_learning_order(update: Update, context: ContextTypes.DEFAULT_TY
 
     # ⛳ ФІЛЬТР ЗА ТЕМОЮ (якщо обрана)
     topic = context.user_data.get("topic_filter")
-    questions = context.user_data.get("questions", [])
     if topic:
-        question_range = [i for i in question_range if 0 <= i < len(questions) and _match_topic_filter(questions[i], topic)]
+        question_range = session_topic_pool(context, topic, start - 1, end)
         if not question_range:
             await update.message.reply_text(f"За темою #{topic} у вибраному діапазоні питань немає. Показую всі теми.")
             question_range = list(range(start - 1, end))
@@ -283,13 +267,7 @@ async def handle_learning_order(update: Update, context: ContextTypes.DEFAULT_TY
         return
 
     # Стан сесії
-    context.user_data["mode"] = "learning"
-    context.user_data["order"] = order
-    context.user_data["step"] = 0
-    context.user_data["score"] = 0
-    context.user_data["wrong_pairs"] = []
-    context.user_data["current_streak"] = 0
-    context.user_data["start_time"] = datetime.now()
+    QuizSession.start(context.user_data, "learning", order)
 
     # Скидаємо «живе» повідомлення попередніх сесій
     for k in ("question_chat_id", "question_message_id", "question_message_type"):
@@ -338,125 +316,82 @@ async def send_current_question(chat_id, context, edit_from_query=None):
     - audio (.mp3/.wav/.ogg/.m4a/.aac/.flac) → audio
     - якщо медіа немає — placeholder як photo
     """
-    step = context.user_data.get("step", 0)
-    order = context.user_data.get("order", [])
-    questions = context.user_data.get("questions", [])
+    session = get_session(context.user_data)
+    questions = get_session_questions(context)
 
-    if step >= len(order):
+    if session is None or session.finished:
         from .testing import show_results  # спільний підсумок
         await show_results(chat_id, context)
         return
 
-    q_index = order[step]
+    q_index = session.current
     context.user_data["current_q_index"] = q_index
+    session.mark_shown()  # латентність відповіді (answer_events)
     q = questions[q_index]
 
     # Формуємо підпис з «повітрям» як у тестуванні
-    progress = get_progress_bar(step + 1, len(order))
-    body = format_question_text(q, mode="learning")
-    body = _with_spacing(body)
+    progress = get_progress_bar(session.step + 1, session.total)
+    qkey = question_key(questions, q_index)
+    body = cached_caption(
+        qkey and qkey + ("learning_card",),
+        lambda: _with_spacing(format_question_text(q, mode="learning")),
+    )
     caption = f"{progress}\n\n{body}"
 
     markup = build_options_markup(q_index, two_columns=True)
 
     media_type, path = _pick_media_for_question(q)
 
-    # Якщо немає медіа — плейсхолдер
-    if media_type == "none" or not path:
-        data = _placeholder_png_bytes()
-        bio = _bio_with_name(data, f"q{q_index+1}.png")
-        new_kind = "photo"
-        saved_kind = context.user_data.get("question_message_type")
-
-        if edit_from_query is not None and saved_kind == new_kind:
-            try:
-                await edit_from_query.edit_message_media(
-                    media=InputMediaPhoto(media=bio, caption=caption, parse_mode="HTML"),
-                    reply_markup=markup
-                )
-                context.user_data["question_message_type"] = "photo"
-                context.user_data["question_chat_id"] = edit_from_query.message.chat_id
-                context.user_data["question_message_id"] = edit_from_query.message.message_id
-                return
-            except Exception as e:
-                logger.debug("[LEARN] edit placeholder failed: %s", e)
-
-        sent = await context.bot.send_photo(
-            chat_id=chat_id, photo=bio, caption=caption, reply_markup=markup, parse_mode="HTML"
+    # Якщо немає медіа (або файл зник) — плейсхолдер
+    if media_type == "none" or not path or not os.path.exists(path):
+        new_kind, key, fname = "photo", PLACEHOLDER_KEY, f"q{q_index+1}.png"
+    else:
+        new_kind, fname = _decide_inline_kind_and_filename(
+            "image" if media_type == "image" else media_type, path
         )
-        context.user_data["question_message_type"] = "photo"
-        context.user_data["question_chat_id"] = sent.chat_id
-        context.user_data["question_message_id"] = sent.message_id
-        return
+        key = path
 
-    # Є медіа — читаємо
-    data = await _load_file_bytes(path)
-    if not data:
-        data = _placeholder_png_bytes()
-        bio = _bio_with_name(data, f"q{q_index+1}.png")
-        sent = await context.bot.send_photo(
-            chat_id=chat_id, photo=bio, caption=caption, reply_markup=markup, parse_mode="HTML"
-        )
-        context.user_data["question_message_type"] = "photo"
-        context.user_data["question_chat_id"] = sent.chat_id
-        context.user_data["question_message_id"] = sent.message_id
-        return
+    async def _upload():
+        return await _media_upload(key, fname)
 
-    new_kind, fname = _decide_inline_kind_and_filename(
-        "image" if media_type == "image" else media_type, path
-    )
     saved_kind = context.user_data.get("question_message_type")
 
     # Спроба відредагувати існуюче повідомлення, якщо тип збігається
-    if new_kind == saved_kind and edit_from_query is not None:
-        try:
-            if new_kind == "photo":
-                media = InputMediaPhoto(_bio_with_name(data, fname), caption=caption, parse_mode="HTML")
-            elif new_kind == "animation":
-                media = InputMediaAnimation(_bio_with_name(data, fname), caption=caption, parse_mode="HTML")
-            elif new_kind == "video":
-                media = InputMediaVideo(_bio_with_name(data, fname), caption=caption, parse_mode="HTML")
-            elif new_kind == "audio":
-                media = InputMediaAudio(_bio_with_name(data, fname), caption=caption, parse_mode="HTML")
-            else:
-                media = InputMediaDocument(_bio_with_name(data, fname), caption=caption, parse_mode="HTML")
-
-            await edit_from_query.edit_message_media(media=media, reply_markup=markup)
-            context.user_data["question_message_type"] = new_kind
-            context.user_data["question_chat_id"] = edit_from_query.message.chat_id
-            context.user_data["question_message_id"] = edit_from_query.message.message_id
+    if new_kind == saved_kind and edit_from_query is not None and edit_from_query.message is not None:
+        async def _upload_attached():
+            return await _media_upload(key, fname, attach=True)
+
+        # те саме медіа — лише підпис/клавіатура; інше — edit_media (file_id або аплоад)
+        if await update_question_media(
+            edit_from_query.message, context.chat_data, new_kind, key, caption, markup, _upload_attached
+        ):
+            _set_question_anchor(context, new_kind, edit_from_query.message)
             return
-        except BadRequest as e:
-            if "Message is not modified" in str(e):
-                logger.debug("[LEARN] message not modified, ignore")
-                return
-            logger.debug("[LEARN] edit same-type failed: %s", e)
-        except Exception as e:
-            logger.debug("[LEARN] edit same-type failed: %s", e)
 
     # Надсилаємо нове повідомлення відповідного типу
-    bio = _bio_with_name(data, fname)
-    if new_kind == "photo":
-        sent = await context.bot.send_photo(
-            chat_id, bio, caption=caption, reply_markup=markup, parse_mode="HTML"
-        )
-    elif new_kind == "animation":
-        sent = await context.bot.send_animation(
-            chat_id, bio, caption=caption, reply_markup=markup, parse_mode="HTML"
-        )
-    elif new_kind == "video":
-        sent = await context.bot.send_video(
-            chat_id, bio, caption=caption, reply_markup=markup, parse_mode="HTML"
-        )
-    elif new_kind == "audio":
-        sent = await context.bot.send_audio(
-            chat_id, bio, caption=caption, reply_markup=markup, parse_mode="HTML"
-        )
-    else:
-        sent = await context.bot.send_document(
-            chat_id, bio, caption=caption, reply_markup=markup, parse_mode="HTML"
-        )
+    def _sender(kind: str):
+        method = getattr(context.bot, _SEND_METHODS[kind])
+        async def _send(media):
+            return await method(chat_id, media, caption=caption, reply_markup=markup, parse_mode="HTML")
+        return _send
+
+    async def _upload_placeholder():
+        return await _media_upload(PLACEHOLDER_KEY, f"q{q_index+1}.png")
+
+    try:
+        sent = await deliver(key, new_kind, _sender(new_kind), _upload)
+    except OSError as e:
+        # Файл не прочитався — показуємо плейсхолдер
+        logger.debug("[LEARN][MEDIA] %s — fallback to placeholder", e)
+        new_kind = "photo"
+        key = PLACEHOLDER_KEY
+        sent = await deliver(key, new_kind, _sender(new_kind), _upload_placeholder)
+
+    remember_sent(context.chat_data, sent, new_kind, key, caption, markup)
+    _set_question_anchor(context, new_kind, sent)
 
-    context.user_data["question_message_type"] = new_kind
-    context.user_data["question_chat_id"] = sent.chat_id
-    context.user_data["question_message_id"] = sent.message_id
+def _set_question_anchor(context, kind: str, message) -> None:
+    """Запам'ятати «живе» повідомлення питання для наступних редагувань."""
+    context.user_data["question_message_type"] = kind
+    context.user_data["question_chat_id"] = message.chat_id
+    context.user_data["question_message_id"] = message.message_id
@@ -0,0 +1,144 @@
+# handlers/media_registry.py
+"""
+Реєстр Telegram file_id для медіа питань.
+
+Після першого завантаження файла Telegram повертає file_id — далі той самий
+файл надсилаємо за цим ідентифікатором, без повторного читання з диска та
+аплоаду байтів. Ключ — (абсолютний шлях, kind) + відбиток (size, mtime):
+якщо файл на диску змінився, запис автоматично стає недійсним.
+
+Записи живуть у stats.db (таблиця media_registry) і дублюються у пам'яті,
+щоб гарячий шлях «наступне питання» не ходив у БД.
+"""
+import os
+import base64
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram.error import BadRequest
+
+from utils.media_reader import close_upload
+
+from handlers.statistics_db import (
+    get_media_file_id,
+    save_media_file_id,
+    delete_media_file_id,
+)
+
+logger = logging.getLogger("test_bot.media")
+
+# 1x1 PNG-заглушка для питань без медіа (декодуємо один раз)
+PLACEHOLDER_PNG: bytes = base64.b64decode(
+    b'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAA'
+    b'AAC0lEQVR42mP8/x8AAwMCAO+XU2sAAAAASUVORK5CYII='
+)
+# Псевдо-шлях заглушки в реєстрі (файла на диску немає)
+PLACEHOLDER_KEY = "::placeholder::q.png"
+
+# (path, kind) -> (size, mtime, file_id | None); None = «перевірили, у БД немає»
+_memo: Dict[Tuple[str, str], Tuple[int, float, Optional[str]]] = {}
+
+# deliver(): file_id ще не шукали (на відміну від None — «шукали, у реєстрі немає»)
+LOOKUP: Any = object()
+
+
+def _fingerprint(path: str) -> Optional[Tuple[str, int, float]]:
+    if path == PLACEHOLDER_KEY:
+        return PLACEHOLDER_KEY, len(PLACEHOLDER_PNG), 0.0
+    try:
+        abs_path = os.path.abspath(path)
+        st = os.stat(abs_path)
+        return abs_path, st.st_size, st.st_mtime
+    except OSError:
+        return None
+
+
+def extract_file_id(message: Any, kind: str) -> Optional[str]:
+    """Дістає file_id з повідомлення, яке повернув Telegram після send_*/edit_media."""
+    if message is None or isinstance(message, bool):
+        return None
+    if kind == "photo":
+        photos = getattr(message, "photo", None) or ()
+        return photos[-1].file_id if photos else None
+    for attr in (kind, "document"):
+        obj = getattr(message, attr, None)
+        if obj is not None and getattr(obj, "file_id", None):
+            return obj.file_id
+    return None
+
+
+async def lookup_file_id(path: str, kind: str) -> Optional[str]:
+    """file_id для файла, якщо він уже завантажувався і з того часу не змінювався."""
+    fp = _fingerprint(path)
+    if fp is None:
+        return None
+    abs_path, size, mtime = fp
+    cached = _memo.get((abs_path, kind))
+    if cached is not None and cached[0] == size and cached[1] == mtime:
+        return cached[2]
+    file_id = await get_media_file_id(abs_path, kind, size, mtime)
+    _memo[(abs_path, kind)] = (size, mtime, file_id)
+    return file_id
+
+
+async def remember_file_id(path: str, kind: str, message: Any) -> None:
+    """Запам'ятати file_id з відповіді Telegram для подальших відправок."""
+    file_id = extract_file_id(message, kind)
+    fp = _fingerprint(path)
+    if not file_id or fp is None:
+        return
+    abs_path, size, mtime = fp
+    _memo[(abs_path, kind)] = (size, mtime, file_id)
+    await save_media_file_id(abs_path, kind, size, mtime, file_id)
+
+
+async def forget_file_id(path: str, kind: str) -> None:
+    fp = _fingerprint(path)
+    abs_path = fp[0] if fp else os.path.abspath(path)
+    _memo.pop((abs_path, kind), None)
+    await delete_media_file_id(abs_path, kind)
+
+
+# фрагменти повідомлень Telegram про недійсний/чужий file_id
+_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file", "file_id", "file identifier")
+
+
+def _is_file_id_error(e: BadRequest) -> bool:
+    msg = str(e).lower()
+    return any(part in msg for part in _FILE_ID_ERRORS)
+
+
+async def deliver(
+    path: str,
+    kind: str,
+    action: Callable[[Any], Awaitable[Any]],
+    load_upload: Callable[[], Awaitable[Any]],
+    file_id: Any = LOOKUP,
+) -> Any:
+    """
+    Виконує action(media) — send_*/edit_media — спершу з file_id з реєстру.
+    Якщо file_id немає або Telegram відхилив саме його — завантажуємо файл
+    (load_upload()) і запам'ятовуємо новий file_id. Інші BadRequest прокидаються
+    далі без змін у реєстрі.
+    file_id — уже знайдений заздалегідь (handlers/prefetch.py), тоді реєстр не читаємо.
+    """
+    if file_id is LOOKUP:
+        file_id = await lookup_file_id(path, kind)
+    if file_id:
+        try:
+            return await action(file_id)
+        except BadRequest as e:
+            # «message to edit not found», «caption is too long», «not modified»...
+            # не стосуються file_id — аплоад упав би так само
+            if not _is_file_id_error(e):
+                raise
+            logger.info("[MEDIA] cached file_id rejected for %s (%s) — re-upload", path, e)
+            await forget_file_id(path, kind)
+
+    upload = await load_upload()
+    try:
+        result = await action(upload)
+    finally:
+        close_upload(upload)
+    await remember_file_id(path, kind, result)
+    return result
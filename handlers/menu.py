@@ -3,9 +3,10 @@ import aiofiles.os
 import asyncio
 import os
 import json
+import html
 import logging
 from datetime import datetime
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from utils.keyboards import (
     main_menu,
@@ -16,14 +17,21 @@ from utils.keyboards import (
     search_stop_kb,  # ⛔ додано
 )
 from utils.i18n import t
-from utils.loader import attach_images, discover_tests_hierarchy, build_listing_for_path, discover_tests
+from utils.loader import attach_images, build_listing_for_path, load_catalog_and_tree
 from handlers.favorites import show_favorites_for_current_test
 from utils.export_docx import export_test_to_docx, _safe_filename
-from handlers.state_sync import reload_current_test_state
+from handlers.state_sync import reload_current_test_state, get_session_questions
 from utils.formatting import format_question_text  # ⛔ для форматованого виводу питань
+from utils.question_cache import load_questions
+from handlers.search_index import search_questions, search_test_names
+from handlers.quiz_session import QuizSession
+from handlers.rate_limiter import bulk_sends
 
 logger = logging.getLogger("test_bot")
 
+SEARCH_PAGE_SIZE = 10      # результатів пошуку на сторінку
+SEARCH_SNIPPET_LEN = 120   # символів питання у списку по банку
+
 # ----------------------------- ДОПОМІЖНЕ -----------------------------
 
 def _refresh_tree_and_catalog(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -33,16 +41,11 @@ def _refresh_tree_and_catalog(context: ContextTypes.DEFAULT_TYPE) -> None:
       - bot_data['tests_catalog'] (мапа "назва тесту -> entry")
     """
     try:
-        tree = discover_tests_hierarchy("tests")
+        catalog, tree = load_catalog_and_tree("tests")
         context.bot_data["tests_tree"] = tree
-    except Exception as e:
-        logger.exception("[MENU] discover_tests_hierarchy failed: %s", e)
-
-    try:
-        catalog = discover_tests("tests")
         context.bot_data["tests_catalog"] = catalog
     except Exception as e:
-        logger.exception("[MENU] discover_tests failed: %s", e)
+        logger.exception("[MENU] load_catalog_and_tree failed: %s", e)
 
 # ----------------------------- ПОШУК -----------------------------
 
@@ -94,7 +97,9 @@ async def handle_search_query(update: Update, context: ContextTypes.DEFAULT_TYPE
     """
     Обробка введеного рядка пошуку. Працює тільки якщо встановлено прапор awaiting_search.
     - awaiting_search == 'test'      → пошук по назвах тестів у bot_data['tests_catalog']
-    - awaiting_search == 'question'  → пошук в поточному тесті по полю 'question'
+                                       + по текстах питань усього банку (в якому тесті питання)
+    - awaiting_search == 'question'  → пошук в поточному тесті (текст питання і варіанти)
+    Пошук — FTS5 у stats.db (handlers/search_index.py), результати посторінково.
     """
     mode = context.user_data.get("awaiting_search")
     if not mode:
@@ -111,51 +116,93 @@ async def handle_search_query(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("✍️ Введи, будь ласка, мінімум 6 символів для пошуку.", reply_markup=search_stop_kb())
         return
 
+    context.user_data["search_query"] = query_text
+
     if mode == "test":
         catalog = context.bot_data.get("tests_catalog") or {}
-        qlow = query_text.lower()
-        matches = [name for name in catalog.keys() if qlow in name.lower()]
+        matches = await search_test_names(query_text, catalog.keys(), limit=30)
         logger.info("[SEARCH] Found %d test matches for '%s'", len(matches), query_text)
 
-        if not matches:
+        if matches:
+            # Виводимо список тестів (reply-клавіатура), режим пошуку залишається активним
+            await update.message.reply_text(
+                "🔎 Знайдені тести (натисни, щоб обрати):",
+                reply_markup=tests_menu(matches)
+            )
+
+        # «В якому тесті було це питання?» — збіги по текстах питань усього банку
+        found_questions = await _send_bank_results(update.message, query_text, page=0)
+
+        if not matches and not found_questions:
             await update.message.reply_text("Нічого не знайдено. Спробуй інший запит.", reply_markup=search_stop_kb())
             return
 
-        matches = matches[:30]
-        # Виводимо список тестів (reply-клавіатура), режим пошуку залишається активним
-        await update.message.reply_text(
-            "🔎 Знайдені тести (натисни, щоб обрати):",
-            reply_markup=tests_menu(matches)
-        )
         # Додатково — кнопка зупинки пошуку окремим повідомленням (щоб не втратити її за клавіатурою)
         await update.message.reply_text("Коли завершиш пошук — натисни кнопку нижче \nАбо обери тест зі списку", reply_markup=search_stop_kb())
         return
 
     if mode == "question":
-        questions = context.user_data.get("questions", [])
+        questions = get_session_questions(context)
         if not questions:
             await update.message.reply_text("❌ У вибраному тесті немає питань.", reply_markup=search_stop_kb())
             return
 
-        qlow = query_text.lower()
-        results = []
-        for idx, q in enumerate(questions):
-            qtext = str(q.get("question", ""))
-            if qlow in qtext.lower():
-                results.append(idx)
-            if len(results) >= 20:  # обмежимо до 20, щоб не спамити
-                break
-
-        logger.info("[SEARCH] Found %d question matches for '%s'", len(results), query_text)
-
-        if not results:
+        shown = await _send_test_results(update.message, context, query_text, page=0)
+        if not shown:
             await update.message.reply_text("Нічого не знайдено у текстах питань.", reply_markup=search_stop_kb())
-            return
+            # можливо, питання є в іншому тесті
+            await _send_bank_results(update.message, query_text, page=0)
+
+        # ⚠️ ВАЖЛИВО: НЕ скидаємо awaiting_search/search_mode тут!
+        # Користувач може одразу вводити наступний запит.
+        return
 
-        # Заголовок про кількість збігів
-        await update.message.reply_text(f"🔎 Знайдено збігів: {len(results)}. Показую питання:")
 
-        # Друкуємо кожне знайдене питання у форматі з жирним та відміткою правильної відповіді
+def _session_hit_index(questions, hit: dict):
+    """(json_path, q_index) збігу → індекс у поточному тесті сесії (base + custom)."""
+    offset = 0
+    for (json_path, _media), size in zip(questions.parts, questions.part_sizes):
+        if os.path.abspath(json_path) == hit["json_path"]:
+            return offset + hit["q_index"] if hit["q_index"] < size else None
+        offset += size
+    return None
+
+
+def _search_pager_kb(scope: str, page: int, total: int):
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("⬅️", callback_data=f"srch|{scope}|{page - 1}"))
+    if page + 1 < pages:
+        row.append(InlineKeyboardButton("➡️", callback_data=f"srch|{scope}|{page + 1}"))
+    return InlineKeyboardMarkup([row]) if row else None
+
+
+async def _send_test_results(message, context: ContextTypes.DEFAULT_TYPE, query_text: str, page: int) -> int:
+    """Сторінка збігів у поточному тесті (кожне питання окремим повідомленням). Повертає кількість показаних."""
+    questions = get_session_questions(context)
+    parts = getattr(questions, "parts", None)
+    if parts:
+        total, hits = await search_questions(
+            query_text, [p for p, _m in parts], limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE
+        )
+        results = [i for i in (_session_hit_index(questions, h) for h in hits) if i is not None]
+    else:
+        # старий формат сесії (повна копія питань у user_data) — лінійний пошук
+        qlow = query_text.lower()
+        found = [idx for idx, q in enumerate(questions) if qlow in str(q.get("question", "")).lower()]
+        total = len(found)
+        results = found[page * SEARCH_PAGE_SIZE:(page + 1) * SEARCH_PAGE_SIZE]
+    logger.info("[SEARCH] Found %d question matches for '%s' (page %d)", total, query_text, page)
+    if not results:
+        return 0
+
+    first = page * SEARCH_PAGE_SIZE + 1
+    await message.reply_text(f"🔎 Знайдено збігів: {total}. Показую {first}–{first + len(results) - 1}:")
+
+    # Друкуємо кожне знайдене питання у форматі з жирним та відміткою правильної відповіді.
+    # Пачка повідомлень — низький пріоритет, щоб не гальмувати квізи інших користувачів
+    with bulk_sends():
         for q_index in results:
             q = questions[q_index]
             body = f"№{q_index + 1}\n\n" + format_question_text(
@@ -165,14 +212,77 @@ async def handle_search_query(update: Update, context: ContextTypes.DEFAULT_TYPE
                 show_correct_if_no_highlight=True
             )
             try:
-                await update.message.reply_text(body, parse_mode="HTML", reply_markup=search_stop_kb())
+                await message.reply_text(body, parse_mode="HTML", reply_markup=search_stop_kb())
             except Exception as e:
                 logger.warning("[SEARCH] send question result failed: %s", e)
 
-        # ⚠️ ВАЖЛИВО: НЕ скидаємо awaiting_search/search_mode тут!
-        # Користувач може одразу вводити наступний запит.
+    pager = _search_pager_kb("q", page, total)
+    if pager:
+        await message.reply_text("Ще результати:", reply_markup=pager)
+    return len(results)
+
+
+def _bank_results_text(query_text: str, total: int, page: int, hits: list) -> str:
+    lines = [f"📚 Питання в банку тестів за запитом «{html.escape(query_text)}»: {total}"]
+    for n, hit in enumerate(hits, start=page * SEARCH_PAGE_SIZE + 1):
+        qs = load_questions(hit["json_path"])
+        raw = qs[hit["q_index"]] if hit["q_index"] < len(qs) else {}
+        qtext = str(raw.get("question", "") if isinstance(raw, dict) else "").replace("\n", " ")
+        if len(qtext) > SEARCH_SNIPPET_LEN:
+            qtext = qtext[:SEARCH_SNIPPET_LEN - 1] + "…"
+        lines.append(
+            f"{n}. 📘 <b>{html.escape(hit['test_name'])}</b> — №{hit['q_index'] + 1}\n   {html.escape(qtext)}"
+        )
+    return "\n".join(lines)
+
+
+async def _send_bank_results(message, query_text: str, page: int) -> int:
+    """Сторінка збігів по всьому банку: тест + номер + початок питання. Повертає загальну кількість."""
+    total, hits = await search_questions(query_text, None, limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE)
+    if not hits:
+        return 0
+    await message.reply_text(
+        _bank_results_text(query_text, total, page, hits),
+        parse_mode="HTML",
+        reply_markup=_search_pager_kb("all", page, total),
+    )
+    return total
+
+
+async def search_page_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Інлайн-пагінація результатів пошуку: srch|q|<page> (поточний тест) або srch|all|<page> (банк)."""
+    query = update.callback_query
+    await query.answer()
+    parts = (query.data or "").split("|")
+    query_text = context.user_data.get("search_query")
+    if len(parts) != 3 or not query_text:
+        return
+    try:
+        page = max(0, int(parts[2]))
+    except ValueError:
         return
 
+    if parts[1] == "all":
+        total, hits = await search_questions(query_text, None, limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE)
+        if not hits:
+            return
+        try:
+            await query.edit_message_text(
+                _bank_results_text(query_text, total, page, hits),
+                parse_mode="HTML",
+                reply_markup=_search_pager_kb("all", page, total),
+            )
+        except Exception as e:
+            logger.warning("[SEARCH] edit page failed: %s", e)
+        return
+
+    if parts[1] == "q":
+        try:
+            await query.edit_message_reply_markup(reply_markup=None)
+        except Exception:
+            pass
+        await _send_test_results(query.message, context, query_text, page)
+
 # ---------------------- СТАРІ МЕНЮ/ДІЇ ----------------------
 
 async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -427,12 +537,8 @@ async def handle_download_test(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
 
-        # RAM sync після генерації
-        context.user_data["questions"] = questions
-        context.user_data["total_questions"] = len(questions)
-    else:
-        # Якщо перевикористали — теж синхронізуємо RAM зі свіжими JSON
-        await reload_current_test_state(context)
+    # RAM sync зі свіжими JSON (перекомпіляція — лише якщо файли змінились)
+    await reload_current_test_state(context)
 
 # (Для сумісності) — відкриття питання з пошуку
 async def open_question_from_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -447,18 +553,12 @@ async def open_question_from_search(update: Update, context: ContextTypes.DEFAUL
     except ValueError:
         return
 
-    questions = context.user_data.get("questions", [])
+    questions = get_session_questions(context)
     if not questions or q_index < 0 or q_index >= len(questions):
         await query.answer("❌ Питання не знайдено.", show_alert=True)
         return
 
-    context.user_data["mode"] = "learning"
-    context.user_data["order"] = [q_index]
-    context.user_data["step"] = 0
-    context.user_data["score"] = 0
-    context.user_data["wrong_pairs"] = []
-    context.user_data["current_streak"] = 0
-    context.user_data["start_time"] = datetime.now()
+    QuizSession.start(context.user_data, "learning", [q_index])
 
     from handlers.learning import send_current_question
     await query.message.reply_text("📌 Відкриваю знайдене питання…")
@@ -0,0 +1,188 @@
+# handlers/message_state.py
+"""
+Стан «живого» повідомлення з питанням у чаті і найдешевше його оновлення.
+
+Раніше кожне «Далі» робило edit_media зі свіжим InputMedia — навіть коли і
+попереднє, і наступне питання показуються тією самою заглушкою чи картинкою,
+і вистачило б edit_message_caption. Тепер для кожного чату (chat_data[STATE_KEY])
+пам'ятаємо, що зараз у повідомленні: id, медіа (kind + шлях/заглушка), хеш
+підпису і клавіатуру, — і обираємо операцію:
+
+  noop        — нічого не змінилось;
+  markup      — змінилась лише клавіатура  → edit_message_reply_markup;
+  caption     — те саме медіа, інший підпис → edit_message_caption (разом з клавіатурою);
+  media_file_id / media_upload — інше медіа → edit_media за file_id з реєстру
+                або з аплоадом файла (media_registry.deliver).
+
+Стан невідомий (рестарт, інше повідомлення) — чесний edit_media, як раніше.
+Спільний для testing.py і learning.py; лічильники — message_state_stats().
+"""
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram import (
+    InputMediaPhoto,
+    InputMediaVideo,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaAnimation,
+)
+from telegram.error import BadRequest
+
+from handlers.media_registry import LOOKUP, deliver
+
+logger = logging.getLogger("test_bot.message")
+
+STATE_KEY = "question_msg"
+
+_INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "animation": InputMediaAnimation,
+    "video": InputMediaVideo,
+    "audio": InputMediaAudio,
+    "document": InputMediaDocument,
+}
+
+_stats = {"noop": 0, "markup": 0, "caption": 0, "media_file_id": 0, "media_upload": 0, "sent": 0}
+
+
+class MessageState:
+    __slots__ = ("message_id", "kind", "media_key", "caption_hash", "markup")
+
+    def __init__(self, message_id: int, kind: Optional[str], media_key: Optional[str],
+                 caption_hash: int, markup: Any):
+        self.message_id = message_id
+        self.kind = kind
+        self.media_key = media_key
+        self.caption_hash = caption_hash
+        self.markup = markup
+
+
+def _get(chat_data: Optional[Dict[str, Any]], message_id: int) -> Optional[MessageState]:
+    state = chat_data.get(STATE_KEY) if chat_data is not None else None
+    if isinstance(state, MessageState) and state.message_id == message_id:
+        return state
+    return None
+
+
+def _remember(chat_data: Optional[Dict[str, Any]], message_id: int, kind: Optional[str],
+              media_key: Optional[str], caption: str, markup: Any) -> None:
+    if chat_data is not None:
+        chat_data[STATE_KEY] = MessageState(message_id, kind, media_key, hash(caption), markup)
+
+
+def _not_modified(e: BadRequest) -> bool:
+    return "not modified" in str(e).lower()
+
+
+def remember_sent(chat_data: Optional[Dict[str, Any]], message: Any, kind: str, media_key: str,
+                  caption: str, markup: Any) -> None:
+    """Нове повідомлення з питанням надіслано — далі оновлюємо саме його."""
+    if message is None or isinstance(message, bool):
+        return
+    _stats["sent"] += 1
+    _remember(chat_data, message.message_id, kind, media_key, caption, markup)
+
+
+def note_markup(chat_data: Optional[Dict[str, Any]], message_id: int, markup: Any) -> None:
+    """Клавіатуру змінили в обхід трекера (напр. лічильник коментарів)."""
+    state = _get(chat_data, message_id)
+    if state is not None:
+        state.markup = markup
+
+
+async def update_question_media(
+    message: Any,
+    chat_data: Optional[Dict[str, Any]],
+    kind: str,
+    media_key: str,
+    caption: str,
+    markup: Any,
+    load_upload: Callable[[], Awaitable[Any]],
+    file_id: Any = LOOKUP,
+) -> bool:
+    """
+    Показати в message медіа media_key (kind) з підписом і клавіатурою найдешевшою
+    операцією. False — повідомлення не медійне або редагування не вдалось
+    (тоді викликач надсилає нове повідомлення).
+    """
+    state = _get(chat_data, message.message_id)
+    if state is not None and state.kind == kind and state.media_key == media_key:
+        same_caption = state.caption_hash == hash(caption)
+        try:
+            if same_caption and state.markup == markup:
+                _stats["noop"] += 1
+            elif same_caption:
+                await message.edit_reply_markup(reply_markup=markup)
+                _stats["markup"] += 1
+            else:
+                await message.edit_caption(caption=caption, reply_markup=markup, parse_mode="HTML")
+                _stats["caption"] += 1
+        except BadRequest as e:
+            if not _not_modified(e):
+                logger.warning("[MESSAGE] caption edit failed: %s", e)
+                return False
+        _remember(chat_data, message.message_id, kind, media_key, caption, markup)
+        return True
+
+    uploaded = []
+
+    async def _upload():
+        uploaded.append(True)
+        return await load_upload()
+
+    async def _edit(media):
+        cls = _INPUT_MEDIA.get(kind, InputMediaDocument)
+        return await message.edit_media(media=cls(media=media, caption=caption, parse_mode="HTML"), reply_markup=markup)
+
+    try:
+        await deliver(media_key, kind, _edit, _upload, file_id)
+    except BadRequest as e:
+        if not _not_modified(e):
+            logger.warning("[MESSAGE] edit_media failed: %s", e)
+            return False
+    except Exception as e:
+        logger.warning("[MESSAGE] edit_media failed: %s", e)
+        return False
+    _stats["media_upload" if uploaded else "media_file_id"] += 1
+    _remember(chat_data, message.message_id, kind, media_key, caption, markup)
+    return True
+
+
+async def update_question_caption(
+    message: Any,
+    chat_data: Optional[Dict[str, Any]],
+    caption: str,
+    markup: Any,
+) -> None:
+    """Те саме питання й медіа, новий підпис і/або клавіатура (напр. після відповіді)."""
+    state = _get(chat_data, message.message_id)
+    is_text = bool(getattr(message, "text", None)) and not getattr(message, "caption", None)
+    same_caption = state is not None and state.caption_hash == hash(caption)
+    try:
+        if same_caption and state.markup == markup:
+            _stats["noop"] += 1
+        elif same_caption:
+            await message.edit_reply_markup(reply_markup=markup)
+            _stats["markup"] += 1
+        elif is_text:
+            await message.edit_text(text=caption, reply_markup=markup, parse_mode="HTML")
+            _stats["caption"] += 1
+        else:
+            await message.edit_caption(caption=caption, reply_markup=markup, parse_mode="HTML")
+            _stats["caption"] += 1
+    except BadRequest as e:
+        if not _not_modified(e):
+            raise
+    if state is not None:
+        state.caption_hash = hash(caption)
+        state.markup = markup
+    else:
+        _remember(chat_data, message.message_id, None, None, caption, markup)
+
+
+def message_state_stats() -> Dict[str, int]:
+    out = dict(_stats)
+    # оновлення існуючого повідомлення, що обійшлись без аплоаду файла
+    out["uploads_saved"] = out["noop"] + out["markup"] + out["caption"] + out["media_file_id"]
+    return out
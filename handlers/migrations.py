@@ -0,0 +1,390 @@
+# handlers/migrations.py
+"""
+Версійовані міграції схеми stats.db.
+
+  - таблиця schema_version: по рядку на застосовану міграцію (версія, назва, час);
+  - MIGRATIONS — упорядкований список (версія, назва, функція(conn));
+    нова міграція = нова функція з @migration(наступний_номер, "опис"),
+    уже випущені міграції не редагуються;
+  - apply_migrations(): швидкий шлях — один SELECT MAX(version); якщо схема
+    актуальна, жодного DDL при старті. Інакше всі відсутні міграції
+    виконуються в ОДНІЙ транзакції (BEGIN IMMEDIATE): або застосовано все,
+    або нічого, помилка не ковтається, а піднімається далі.
+
+Міграція 1 написана так, щоб коректно «усиновити» бази, створені старим
+init_db (CREATE ... IF NOT EXISTS + додавання current_streak, якщо її немає).
+"""
+import logging
+from typing import Awaitable, Callable, List, Tuple
+
+import aiosqlite
+
+from handlers.db import Database
+
+logger = logging.getLogger("test_bot.db")
+
+MigrationFn = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+# (версія, назва, функція) — у порядку зростання версії
+MIGRATIONS: List[Tuple[int, str, MigrationFn]] = []
+
+
+def migration(version: int, name: str):
+    """Зареєструвати міграцію; версії мають іти строго по зростанню без пропусків."""
+    def deco(fn: MigrationFn) -> MigrationFn:
+        expected = MIGRATIONS[-1][0] + 1 if MIGRATIONS else 1
+        if version != expected:
+            raise ValueError(f"migration {fn.__name__}: version {version}, expected {expected}")
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return deco
+
+
+async def _column_exists(conn: aiosqlite.Connection, table: str, column: str) -> bool:
+    async with conn.execute(f"PRAGMA table_info({table});") as cur:
+        rows = await cur.fetchall()
+    return any(row[1] == column for row in rows)  # row[1] = name
+
+
+# ===================== Міграції =====================
+
+@migration(1, "base tables")
+async def _m001_base_tables(conn: aiosqlite.Connection) -> None:
+    # Результати тестів
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        test_name TEXT NOT NULL,
+        mode TEXT,
+        score INTEGER,
+        total_questions INTEGER,
+        duration REAL,
+        percent REAL,
+        current_streak INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    # бази, створені до появи колонки
+    if not await _column_exists(conn, "user_results", "current_streak"):
+        await conn.execute("ALTER TABLE user_results ADD COLUMN current_streak INTEGER DEFAULT 0;")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON user_results(user_id);")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON user_results(created_at DESC);")
+
+    # ⭐ Улюблені питання
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS favorites (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        test_name TEXT NOT NULL,
+        q_index INTEGER,
+        question_text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_fav_user_id ON favorites(user_id);")
+
+    # ❌ Неправильні відповіді (персональні списки помилок по тестах)
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS wrong_answers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        test_name TEXT NOT NULL,
+        q_index INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, test_name, q_index)
+    );
+    """)
+
+    # 📎 Реєстр file_id, які повернув Telegram після першого завантаження медіа
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS media_registry (
+        path TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        file_id TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (path, kind)
+    );
+    """)
+
+
+@migration(2, "full-text search index")
+async def _m002_search_index(conn: aiosqlite.Connection) -> None:
+    # 🔎 Повнотекстовий пошук по банку питань (наповнюється з каталогу тестів)
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS search_docs (
+        doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        json_path TEXT NOT NULL UNIQUE,
+        test_name TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    try:
+        # rowid = doc_id << 20 | q_index; prefix — для швидких запитів «слово*»
+        await conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+            question, answers,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+        """)
+        await conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_names USING fts5(
+            name,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+        """)
+    except aiosqlite.OperationalError as e:
+        # SQLite без FTS5: пошук працює лінійним проходом (handlers/search_index.py)
+        logger.warning(f"[MIGRATE] FTS5 is not available, search falls back to linear scan: {e}")
+
+
+@migration(3, "drop redundant wrong_answers indexes")
+async def _m003_wrong_answers_indexes(conn: aiosqlite.Connection) -> None:
+    # UNIQUE(user_id, test_name, q_index) уже дає індекс з тим самим префіксом;
+    # зайві індекси лише сповільнюють запис на кожну помилку
+    await conn.execute("DROP INDEX IF EXISTS idx_wrong_user;")
+    await conn.execute("DROP INDEX IF EXISTS idx_wrong_user_test;")
+    await conn.execute("DROP INDEX IF EXISTS idx_wa_user_test;")  # старий handlers/wrong_answers.py
+
+
+@migration(4, "user and test aggregates")
+async def _m004_aggregates(conn: aiosqlite.Connection) -> None:
+    # 📊 Підсумки по користувачу (усі тести) — /stats читає один рядок за PK
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        total_score INTEGER NOT NULL DEFAULT 0,
+        total_questions INTEGER NOT NULL DEFAULT 0,
+        sum_percent REAL NOT NULL DEFAULT 0,
+        best_percent REAL NOT NULL DEFAULT 0,
+        best_streak INTEGER NOT NULL DEFAULT 0,
+        last_test TEXT,
+        last_percent REAL,
+        last_at TIMESTAMP
+    );
+    """)
+    # 🏆 Підсумки по парі (користувач, тест) — спроби, найкращий/середній відсоток, рейтинг тесту
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_test_stats (
+        user_id INTEGER NOT NULL,
+        test_name TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        best_score INTEGER NOT NULL DEFAULT 0,
+        best_percent REAL NOT NULL DEFAULT 0,
+        sum_percent REAL NOT NULL DEFAULT 0,
+        best_streak INTEGER NOT NULL DEFAULT 0,
+        last_percent REAL,
+        last_at TIMESTAMP,
+        PRIMARY KEY (user_id, test_name)
+    );
+    """)
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_uts_leaderboard
+    ON user_test_stats(test_name, best_percent DESC, attempts);
+    """)
+
+    # Оновлення в тій самій транзакції, що й INSERT у user_results
+    # (write-behind пачка, wait=True, migrate_from_json — однаково)
+    await conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_user_results_aggregates
+    AFTER INSERT ON user_results
+    WHEN NEW.user_id IS NOT NULL
+    BEGIN
+        INSERT INTO user_stats(user_id, username, attempts, total_score, total_questions,
+                               sum_percent, best_percent, best_streak, last_test, last_percent, last_at)
+        VALUES (NEW.user_id, NEW.username, 1, COALESCE(NEW.score, 0), COALESCE(NEW.total_questions, 0),
+                COALESCE(NEW.percent, 0), COALESCE(NEW.percent, 0), COALESCE(NEW.current_streak, 0),
+                NEW.test_name, COALESCE(NEW.percent, 0), NEW.created_at)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username = COALESCE(excluded.username, username),
+            attempts = attempts + 1,
+            total_score = total_score + excluded.total_score,
+            total_questions = total_questions + excluded.total_questions,
+            sum_percent = sum_percent + excluded.sum_percent,
+            best_percent = MAX(best_percent, excluded.best_percent),
+            best_streak = MAX(best_streak, excluded.best_streak),
+            last_test = CASE WHEN excluded.last_at >= COALESCE(last_at, '') THEN excluded.last_test ELSE last_test END,
+            last_percent = CASE WHEN excluded.last_at >= COALESCE(last_at, '') THEN excluded.last_percent ELSE last_percent END,
+            last_at = MAX(COALESCE(last_at, ''), excluded.last_at);
+
+        INSERT INTO user_test_stats(user_id, test_name, attempts, best_score, best_percent,
+                                    sum_percent, best_streak, last_percent, last_at)
+        VALUES (NEW.user_id, NEW.test_name, 1, COALESCE(NEW.score, 0), COALESCE(NEW.percent, 0),
+                COALESCE(NEW.percent, 0), COALESCE(NEW.current_streak, 0), COALESCE(NEW.percent, 0), NEW.created_at)
+        ON CONFLICT(user_id, test_name) DO UPDATE SET
+            attempts = attempts + 1,
+            best_score = MAX(best_score, excluded.best_score),
+            best_percent = MAX(best_percent, excluded.best_percent),
+            sum_percent = sum_percent + excluded.sum_percent,
+            best_streak = MAX(best_streak, excluded.best_streak),
+            last_percent = CASE WHEN excluded.last_at >= COALESCE(last_at, '') THEN excluded.last_percent ELSE last_percent END,
+            last_at = MAX(COALESCE(last_at, ''), excluded.last_at);
+    END;
+    """)
+
+    # Заповнення з уже накопиченої історії (один раз)
+    await conn.execute("""
+    INSERT OR REPLACE INTO user_test_stats(user_id, test_name, attempts, best_score, best_percent,
+                                           sum_percent, best_streak, last_percent, last_at)
+    SELECT r.user_id, r.test_name, COUNT(*), MAX(COALESCE(r.score, 0)), MAX(COALESCE(r.percent, 0)),
+           SUM(COALESCE(r.percent, 0)), MAX(COALESCE(r.current_streak, 0)),
+           (SELECT COALESCE(x.percent, 0) FROM user_results x
+            WHERE x.user_id = r.user_id AND x.test_name = r.test_name
+            ORDER BY x.created_at DESC, x.id DESC LIMIT 1),
+           MAX(r.created_at)
+    FROM user_results r
+    WHERE r.user_id IS NOT NULL
+    GROUP BY r.user_id, r.test_name;
+    """)
+    await conn.execute("""
+    INSERT OR REPLACE INTO user_stats(user_id, username, attempts, total_score, total_questions,
+                                      sum_percent, best_percent, best_streak, last_test, last_percent, last_at)
+    SELECT r.user_id,
+           (SELECT x.username FROM user_results x
+            WHERE x.user_id = r.user_id AND x.username IS NOT NULL
+            ORDER BY x.created_at DESC, x.id DESC LIMIT 1),
+           COUNT(*), SUM(COALESCE(r.score, 0)), SUM(COALESCE(r.total_questions, 0)),
+           SUM(COALESCE(r.percent, 0)), MAX(COALESCE(r.percent, 0)), MAX(COALESCE(r.current_streak, 0)),
+           (SELECT x.test_name FROM user_results x WHERE x.user_id = r.user_id
+            ORDER BY x.created_at DESC, x.id DESC LIMIT 1),
+           (SELECT COALESCE(x.percent, 0) FROM user_results x WHERE x.user_id = r.user_id
+            ORDER BY x.created_at DESC, x.id DESC LIMIT 1),
+           MAX(r.created_at)
+    FROM user_results r
+    WHERE r.user_id IS NOT NULL
+    GROUP BY r.user_id;
+    """)
+
+
+@migration(5, "answer events and per-question rollup")
+async def _m005_answer_events(conn: aiosqlite.Connection) -> None:
+    # 📝 Журнал відповідей (лише дописується; читається ролапом по id)
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS answer_events (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        test_name TEXT NOT NULL,
+        q_index INTEGER NOT NULL,
+        chosen INTEGER,
+        correct INTEGER NOT NULL,
+        latency_ms INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    # 📈 Зведення по питанню (handlers/answer_analytics.py): спроби, правильні, латентність,
+    # скільки разів обрано кожен варіант A–D
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS question_stats (
+        test_name TEXT NOT NULL,
+        q_index INTEGER NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        correct INTEGER NOT NULL DEFAULT 0,
+        latency_sum_ms INTEGER NOT NULL DEFAULT 0,
+        latency_n INTEGER NOT NULL DEFAULT 0,
+        chosen_0 INTEGER NOT NULL DEFAULT 0,
+        chosen_1 INTEGER NOT NULL DEFAULT 0,
+        chosen_2 INTEGER NOT NULL DEFAULT 0,
+        chosen_3 INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (test_name, q_index)
+    );
+    """)
+    # До якого answer_events.id уже агреговано
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+
+
+@migration(6, "question comments")
+async def _m006_comments(conn: aiosqlite.Connection) -> None:
+    # 💬 Коментарі до питань (раніше — <test>.comments.json поруч із тестом, див. handlers/comments.py)
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        test_name TEXT NOT NULL,
+        q_index INTEGER NOT NULL,
+        user_id INTEGER,
+        username TEXT,
+        text TEXT NOT NULL,
+        created_at TEXT
+    );
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_test_q ON comments(test_name, q_index);")
+
+
+@migration(7, "persisted quiz sessions")
+async def _m007_user_sessions(conn: aiosqlite.Connection) -> None:
+    # 💾 Активні сесії квізу (handlers/persistence.py): лише посилання на тест і компактний стан
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_sessions (
+        user_id INTEGER PRIMARY KEY,
+        test_ref TEXT NOT NULL,
+        content_hash TEXT,
+        order_blob BLOB NOT NULL,
+        step INTEGER NOT NULL DEFAULT 0,
+        score INTEGER NOT NULL DEFAULT 0,
+        wrong_blob BLOB,
+        meta TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+
+# ===================== Застосування =====================
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def _current_version(conn: aiosqlite.Connection) -> int:
+    try:
+        async with conn.execute("SELECT MAX(version) FROM schema_version") as cur:
+            row = await cur.fetchone()
+    except aiosqlite.OperationalError:
+        return 0  # таблиці ще немає — нова або «стара» база
+    return int(row[0] or 0)
+
+
+async def apply_migrations(database: Database) -> int:
+    """Довести схему до LATEST_VERSION. Повертає кількість застосованих міграцій."""
+    conn = await database.writer()
+    if await _current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    applied: List[str] = []
+    async with database.transaction() as conn:
+        # IMMEDIATE: одразу беремо блокування запису, версію перевіряємо вже під ним
+        await conn.execute("BEGIN IMMEDIATE")
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        current = await _current_version(conn)
+        for version, name, fn in MIGRATIONS:
+            if version <= current:
+                continue
+            try:
+                await fn(conn)
+            except Exception as e:
+                logger.error(f"[MIGRATE] migration {version} ({name}) failed, rolling back: {e}")
+                raise
+            await conn.execute("INSERT INTO schema_version(version, name) VALUES (?, ?)", (version, name))
+            applied.append(f"{version} ({name})")
+
+    if applied:
+        logger.info(f"[MIGRATE] schema upgraded to v{LATEST_VERSION}: {', '.join(applied)}")
+    return len(applied)
@@ -1,10 +1,28 @@
 import os
+import html
 from typing import List, Tuple
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
 from telegram.ext import ContextTypes
 
 from utils.auth import is_owner
+from handlers.statistics_db import write_queue_stats
+from handlers.db import db
+from utils.question_cache import cache_stats
+from utils.render_cache import render_cache_stats
+from handlers.prefetch import prefetch_stats
+from utils.media_reader import media_reader_stats
+from handlers.message_state import message_state_stats
+from handlers.rate_limiter import rate_limiter_stats
+from handlers.webhook import webhook_stats
+from handlers.update_processor import update_processor_stats
+from handlers.text_router import text_router_stats
+from handlers.callback_pipeline import pipeline_stats
+from handlers.answer_analytics import (
+    run_rollup, rollup_stats, hardest_questions, suspicious_questions, format_question_line, MIN_ATTEMPTS,
+)
+from utils.question_cache import load_questions
+from utils.question import correct_index
 from utils.loader import discover_tests_hierarchy
 from utils.mod_tools import (
     TESTS_ROOT,
@@ -44,6 +62,7 @@ def _owner_root_kb() -> InlineKeyboardMarkup:
     rows = [
         [("📁 Розділи", "own|sec|root"), ("📚 Тести (custom)", "own|tests|custom")],
         [("🧹 Видалити порожні розділи", "own|sec|del_empty")],
+        [("📊 Продуктивність", "own|perf"), ("📈 Складність питань", "own|qstats")],
         [("🔄 Оновити", "own|refresh")],
     ]
     return _kb(rows)
@@ -128,6 +147,98 @@ async def owner_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=_owner_root_kb()
     )
 
+def _perf_text() -> str:
+    """Метрики внутрішніх черг і кешів (для діагностики навантаження)."""
+    wq = write_queue_stats()
+    qc = cache_stats()
+    rc = render_cache_stats()
+    pf = prefetch_stats()
+    mr = media_reader_stats()
+    ms = message_state_stats()
+    rl = rate_limiter_stats()
+    wh = webhook_stats()
+    up = update_processor_stats()
+    tr = text_router_stats()
+    cb = pipeline_stats()
+    dq = db.query_stats(5)
+    db_lines = "\n".join(
+        f"• {r['caller']}: {r['count']} × {r['avg_ms']} мс (макс {r['max_ms']})" for r in dq
+    ) or "• запитів ще не було"
+    if rl is None:
+        rl_lines = "• вимкнено (RATE_LIMIT=0)\n\n"
+    else:
+        q = rl["queued"]
+        rl_lines = (
+            f"• запитів: {rl['requests']}, чекали: {rl['throttled']} (сумарно {rl['wait_ms_total']} мс, макс {rl['wait_ms_max']} мс)\n"
+            f"• у черзі: інтерактив {q['interactive']}, звичайні {q['normal']}, пакетні {q['bulk']}; чатів: {rl['chats']}\n"
+            f"• 429 RetryAfter: {rl['retry_after']}, повторено: {rl['retried']}, не вдалось: {rl['gave_up']}\n\n"
+        )
+    if up is None:
+        up_lines = "• послідовно (UPDATE_CONCURRENCY=1)\n\n"
+    else:
+        up_lines = (
+            f"• оброблено: {up['processed']}, зараз: {up['active']} / {up['workers']} (пік {up['active_max']})\n"
+            f"• чекали на попереднє оновлення користувача: {up['waited']} (макс {up['wait_ms_max']} мс), "
+            f"замків: {up['locks']} (пік {up['locks_max']})\n\n"
+        )
+    if wh["received"] or wh["rejected"]:
+        rl_lines = (
+            f"• webhook: отримано {wh['received']}, відхилено (secret): {wh['rejected']}, некоректних: {wh['bad_request']}\n"
+            + rl_lines
+        )
+    return (
+        "📊 <b>Продуктивність</b>\n\n"
+        "<b>Write-behind черга БД</b>\n"
+        f"• у черзі: {wq['depth']}, записано: {wq['written']}, помилок: {wq['failed']}\n"
+        f"• пачок: {wq['batches']} (найбільша {wq['max_batch']})\n"
+        f"• скидання: останнє {wq['last_flush_ms']} мс, середнє {wq['avg_flush_ms']} мс, макс {wq['max_flush_ms']} мс\n\n"
+        "<b>Кеш питань</b>\n"
+        f"• записів: {qc['entries']} (скомпільованих тестів: {qc['compiled']}), {qc['bytes'] // 1024} / {qc['max_bytes'] // 1024} КБ\n"
+        f"• влучань: {qc['hit_rate_pct']}% ({qc['hits']}/{qc['hits'] + qc['misses']}), витіснень: {qc['evictions']}\n\n"
+        "<b>Кеш рендеру питань</b>\n"
+        f"• підписи: {rc['captions']['entries']} записів, влучань {rc['captions']['hit_rate_pct']}%, витіснень: {rc['captions']['evictions']}\n"
+        f"• клавіатури: {rc['keyboards']['entries']} записів, влучань {rc['keyboards']['hit_rate_pct']}%\n"
+        f"• наступне питання підготовлено: {pf['prepared']}, використано: {pf['used']}, не знадобилось: {pf['stale']}\n"
+        f"• медіа в пам'яті: {mr['cache']['entries']} файлів, {mr['cache']['bytes'] // 1024} / {mr['cache']['max_bytes'] // 1024} КБ\n"
+        f"• читань з диска: {mr['reads']} ({mr['read_bytes'] // 1024} КБ), потокових аплоадів: {mr['streamed']}, prefetch пропустив великих: {mr['preload_skipped']}\n"
+        f"• оновлення питань: без змін {ms['noop']}, підпис {ms['caption']}, клавіатура {ms['markup']}, "
+        f"медіа за file_id {ms['media_file_id']}, з аплоадом {ms['media_upload']} (без аплоаду: {ms['uploads_saved']})\n\n"
+        "<b>Вихідні запити до Telegram</b>\n"
+        f"{rl_lines}"
+        "<b>Обробка оновлень</b>\n"
+        f"• текстових маршрутів: {tr['dispatched']} (кнопки {tr['exact']}, шаблони {tr['pattern']}, "
+        f"стан {tr['state'] + tr['when']}, вибір тесту {tr['fallback']})\n"
+        f"{up_lines}"
+        "<b>Кнопки квізу (fast-ack)</b>\n"
+        f"• підтверджено одразу: {cb['acked']}, оброблено під замком користувача: {cb['handled']}\n\n"
+        "<b>Запити до БД (топ за сумарним часом)</b>\n"
+        f"{db_lines}"
+    )
+
+async def _qstats_text(context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Найскладніші та підозрілі питання по всьому банку (з answer_events)."""
+    await run_rollup()
+    catalog = context.bot_data.get("tests_catalog") or {}
+
+    def _correct_of(test_name: str, q_index: int):
+        entry = catalog.get(test_name) or {}
+        questions = load_questions(entry.get("json_path"))
+        return correct_index(questions[q_index]) if 0 <= q_index < len(questions) else None
+
+    hard = await hardest_questions(limit=10)
+    odd = await suspicious_questions(_correct_of, limit=10)
+    rs = rollup_stats()
+
+    lines = [f"📈 <b>Складність питань</b> (від {MIN_ATTEMPTS} спроб)\n", "<b>Найскладніші</b>"]
+    lines += [f"• {html.escape(format_question_line(x, with_test=True))}" for x in hard] or ["• даних ще немає"]
+    lines.append("\n<b>Підозрілі</b> (неправильний варіант обирають частіше за правильний)")
+    lines += [
+        f"• {html.escape(format_question_line(x, with_test=True))} — найчастіше {'ABCD'[x['top_choice']]}"
+        for x in odd
+    ] or ["• немає"]
+    lines.append(f"\nролап: {rs['events']} подій за {rs['runs']} запусків, останній {rs['last_ms']} мс ({rs['engine']})")
+    return "\n".join(lines)
+
 # ---------- Router ----------
 
 async def owner_router_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -151,6 +262,22 @@ async def owner_router_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    if parts[1] == "perf":
+        await query.edit_message_text(
+            _perf_text(),
+            parse_mode="HTML",
+            reply_markup=_kb([[("🔄 Оновити", "own|perf"), ("🏠 На головну", "own|home")]])
+        )
+        return
+
+    if parts[1] == "qstats":
+        await query.edit_message_text(
+            await _qstats_text(context),
+            parse_mode="HTML",
+            reply_markup=_kb([[("🔄 Оновити", "own|qstats"), ("🏠 На головну", "own|home")]])
+        )
+        return
+
     if parts[1] == "refresh":
         context.user_data["own_pathmap"] = {}
         await owner_entry(update, context)
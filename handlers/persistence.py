@@ -0,0 +1,206 @@
+# handlers/persistence.py
+"""
+Збереження активних сесій квізу між перезапусками (PTB BasePersistence на stats.db).
+
+Зберігається лише те, що потрібно, щоб продовжити тест з того ж місця:
+  - test_ref (шляхи частин тесту) + content_hash (відбиток вмісту на момент старту);
+  - QuizSession.to_record(): order (array('I')) і помилки (array('i')) як BLOB,
+    step, score; режим, серія і час старту — у JSON разом з
+  - кількома дрібними ключами user_data (назва/тека тесту, «живе» повідомлення...).
+Самі питання не зберігаються ніколи — після рестарту вони компілюються з файлів
+при першому оновленні користувача (state_sync.prepare_session_test); якщо
+відбиток вмісту не збігся, сесія завершується, а користувач отримує повідомлення.
+
+Записи:
+  - PTB раз на SESSION_FLUSH_S (30 с) передає користувачів, чиї оновлення
+    оброблялись; ми порівнюємо компактний запис з останнім записаним і пишемо
+    лише змінені (перегляд меню без зміни стану квізу нічого не пише);
+  - запис — через write-behind чергу statistics_db: усі змінені сесії
+    потрапляють в одну транзакцію;
+  - сесія без активного тесту → рядок видаляється (один раз).
+
+Інші частини user_data (VIP-майстри, очікування вводу тощо) не зберігаються.
+SESSION_PERSIST=0 вимикає збереження.
+"""
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from handlers.statistics_db import init_db, save_session_db, delete_session_db, load_sessions_db
+from handlers.quiz_session import SESSION_KEY, QuizSession, get_session
+
+logger = logging.getLogger("test_bot.session")
+
+# дрібні ключі сесії, які відновлюються разом із посиланням на тест
+META_KEYS = (
+    "current_test", "current_test_dir", "total_questions",
+    "current_q_index", "learning_range", "topic_filter", "browse_path",
+    "last_msg_id", "last_media_type", "question_chat_id", "question_message_id",
+)
+
+# (test_ref, content_hash, order_blob, step, score, wrong_blob, meta)
+_Record = Tuple[str, Optional[str], bytes, int, int, bytes, str]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(1.0, float(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def compact_session(data: Dict[str, Any]) -> Optional[_Record]:
+    """Компактний запис сесії або None, якщо активного тесту немає."""
+    ref = data.get("test_ref")
+    session = get_session(data)
+    if not ref or not session or not session.total:
+        return None
+    order_blob, step, score, wrong_blob, meta = session.to_record()
+
+    meta.update((k, data[k]) for k in META_KEYS if data.get(k) is not None)
+    fav = data.get("fav_set")
+    if fav:
+        meta["fav_set"] = sorted(fav)
+    return (
+        json.dumps(ref, ensure_ascii=False),
+        data.get("test_hash"),
+        order_blob,
+        step,
+        score,
+        wrong_blob,
+        json.dumps(meta, ensure_ascii=False, sort_keys=True),
+    )
+
+
+def expand_session(record: _Record) -> Dict[str, Any]:
+    """Запис з БД → ключі user_data (питання не завантажуються)."""
+    ref, content_hash, order_blob, step, score, wrong_blob, meta = record
+    data: Dict[str, Any] = json.loads(meta) if meta else {}
+    extra = {
+        "mode": data.pop("mode", None),
+        "streak": data.pop("streak", None) or data.pop("current_streak", 0),
+        "started": data.pop("started", None),
+    }
+    if "start_time" in data:
+        # записи, зроблені до появи QuizSession
+        try:
+            extra["started"] = datetime.fromisoformat(data.pop("start_time")).timestamp()
+        except (TypeError, ValueError):
+            pass
+    if "fav_set" in data:
+        data["fav_set"] = set(data["fav_set"])
+    session = QuizSession.from_record(order_blob, step, score, wrong_blob, extra)
+    data.update({
+        "test_ref": json.loads(ref),
+        "test_hash": content_hash,
+        "mode": session.mode,
+        SESSION_KEY: session,
+        # відбиток звіряється при першому зверненні до питань (state_sync)
+        "session_restored": True,
+    })
+    return data
+
+
+class SQLitePersistence(BasePersistence):
+    """Лише user_data і лише стан квізу; chat_data / bot_data / callback_data не зберігаються."""
+
+    def __init__(self, update_interval: Optional[float] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval or _env_float("SESSION_FLUSH_S", 30),
+        )
+        # user_id -> останній записаний запис (None — рядка в БД немає)
+        self._written: Dict[int, Optional[_Record]] = {}
+        self.stats = {"restored": 0, "written": 0, "deleted": 0, "skipped": 0}
+
+    # ---------- user_data ----------
+
+    async def get_user_data(self) -> Dict[int, Dict[str, Any]]:
+        # викликається в Application.initialize() — ще до post_init, тож схему доводимо тут
+        await init_db()
+        out: Dict[int, Dict[str, Any]] = {}
+        for row in await load_sessions_db():
+            user_id, record = row[0], tuple(row[1:])
+            try:
+                out[user_id] = expand_session(record)
+                self._written[user_id] = record
+            except Exception as e:
+                logger.warning(f"[SESSION] cannot restore session of {user_id}: {e}")
+        self.stats["restored"] = len(out)
+        if out:
+            logger.info(f"[SESSION] restored {len(out)} quiz sessions")
+        return out
+
+    async def update_user_data(self, user_id: int, data: Dict[str, Any]) -> None:
+        record = compact_session(data)
+        if record == self._written.get(user_id):
+            self.stats["skipped"] += 1
+            return
+        if record is None:
+            await delete_session_db(user_id)
+            self.stats["deleted"] += 1
+        else:
+            await save_session_db(user_id, *record)
+            self.stats["written"] += 1
+        self._written[user_id] = record
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if self._written.get(user_id) is not None:
+            await delete_session_db(user_id)
+        self._written.pop(user_id, None)
+
+    async def flush(self) -> None:
+        # записи вже в write-behind черзі; її зливає post_shutdown
+        logger.info(
+            f"[SESSION] written {self.stats['written']}, deleted {self.stats['deleted']}, "
+            f"unchanged {self.stats['skipped']}"
+        )
+
+    # ---------- не використовуються ----------
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> Dict[Any, Any]:
+        return {}
+
+    async def update_conversation(self, name: str, key: Any, new_state: Optional[object]) -> None:
+        pass
+
+
+def create_persistence() -> Optional[SQLitePersistence]:
+    """SQLitePersistence, якщо не вимкнено SESSION_PERSIST=0."""
+    if os.getenv("SESSION_PERSIST", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    return SQLitePersistence()
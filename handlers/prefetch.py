@@ -0,0 +1,68 @@
+# handlers/prefetch.py
+"""
+Попередня підготовка наступного питання, поки користувач читає результат відповіді.
+
+Після кожної зарахованої відповіді (testing.answer_handler) у фоні:
+  - прогріваємо кеш рендеру (підпис і клавіатура наступного питання);
+  - визначаємо, як надсилати його медіа (kind, шлях, ім'я файла — з перевіркою
+    існування файла), і шукаємо file_id у реєстрі (media_registry);
+  - якщо file_id немає — кладемо байти файла в кеш utils.media_reader
+    (великі файли, що підуть потоком чи не влізуть у кеш, не читаються).
+
+Результат — PreparedMedia у user_data[PREFETCH_KEY]; _show_question бере його,
+якщо індекс питання збігся, і «Далі» зводиться до edit_media без звернень до диска.
+Не встигли / інше питання — звичайний шлях, нічого не ламається.
+
+Бюджет пам'яті на байти — спільний кеш media_reader (MEDIA_CACHE_MB).
+"""
+import logging
+from typing import Any, Dict, Hashable, Optional
+
+logger = logging.getLogger("test_bot.prefetch")
+
+PREFETCH_KEY = "__prefetch"
+
+
+class PreparedMedia:
+    """
+    Як показати питання q_index: kind / шлях (key) / ім'я файла для send_*/edit_media,
+    file_id з реєстру (None — у реєстрі немає) і ключ байтів у кеші (None — не прочитано).
+    """
+    __slots__ = ("q_index", "kind", "key", "filename", "file_id", "data_key")
+
+    def __init__(self, q_index: int, kind: str, key: str, filename: str,
+                 file_id: Optional[str], data_key: Optional[Hashable] = None):
+        self.q_index = q_index
+        self.kind = kind
+        self.key = key
+        self.filename = filename
+        self.file_id = file_id
+        self.data_key = data_key
+
+
+_stats = {"prepared": 0, "used": 0, "stale": 0, "failed": 0}
+
+
+def store_prepared(user_data: Dict[str, Any], prepared: PreparedMedia) -> None:
+    user_data[PREFETCH_KEY] = prepared
+    _stats["prepared"] += 1
+
+
+def take_prepared(user_data: Dict[str, Any], q_index: int) -> Optional[PreparedMedia]:
+    """Підготовлене для q_index (і прибрати його); None — готуємо на місці."""
+    prepared = user_data.pop(PREFETCH_KEY, None)
+    if not isinstance(prepared, PreparedMedia):
+        return None
+    if prepared.q_index != q_index:
+        _stats["stale"] += 1
+        return None
+    _stats["used"] += 1
+    return prepared
+
+
+def note_failed() -> None:
+    _stats["failed"] += 1
+
+
+def prefetch_stats() -> Dict[str, Any]:
+    return dict(_stats)
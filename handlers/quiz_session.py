@@ -0,0 +1,158 @@
+# handlers/quiz_session.py
+"""
+Стан активної сесії квізу (тест / навчання / улюблені / помилки) одним об'єктом.
+
+Раніше кожен режим розкладав у user_data з десяток окремих ключів
+("order", "step", "score", "wrong_pairs", "start_time", "current_streak"...)
+і кожен вихід із сесії прибирав їх власним циклом pop. Тепер у user_data
+лежить один QuizSession під ключем SESSION_KEY:
+
+  - order       — array('I') індексів питань (4 байти на питання замість PyLong у списку);
+  - wrong_bits  — бітсет індексів з помилками (перевірка «вже помилявся» за O(1),
+                  повторна помилка на тому ж питанні не дублюється);
+  - wrong_log   — пари (q_index, choice) у порядку відповідей, пласким array('i');
+  - started_at  — time.monotonic() старту (тривалість не залежить від переведення годинника);
+  - shown_at    — коли показано поточне питання (латентність для answer_events).
+
+Ключ "mode" лишається в user_data: він маршрутизує текстові повідомлення ще до
+старту сесії (вибір кількості / діапазону).
+"""
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SESSION_KEY = "quiz"
+
+# ключі, що живуть поруч із сесією і втрачають сенс після її завершення
+_SESSION_SIDE_KEYS = ("last_msg_id", "last_media_type", "__prefetch")  # __prefetch — handlers/prefetch.py
+
+
+class QuizSession:
+    __slots__ = (
+        "mode", "order", "step", "score", "streak",
+        "wrong_bits", "wrong_log", "started_at", "started_wall", "shown_at",
+    )
+
+    def __init__(self, mode: str, order: Iterable[int]):
+        self.mode = mode
+        self.order = array("I", order)
+        self.step = 0
+        self.score = 0
+        self.streak = 0
+        self.wrong_bits = 0
+        self.wrong_log = array("i")
+        self.started_at = time.monotonic()
+        self.started_wall = time.time()
+        self.shown_at: Optional[float] = None
+
+    # ---------- життєвий цикл ----------
+
+    @classmethod
+    def start(cls, user_data: Dict[str, Any], mode: str, order: Iterable[int]) -> "QuizSession":
+        """Нова сесія замість попередньої (якщо була)."""
+        session = cls(mode, order)
+        end_session(user_data)
+        user_data["mode"] = mode
+        user_data[SESSION_KEY] = session
+        return session
+
+    @property
+    def total(self) -> int:
+        return len(self.order)
+
+    @property
+    def current(self) -> Optional[int]:
+        """Індекс поточного питання або None, якщо питання скінчились."""
+        return self.order[self.step] if self.step < len(self.order) else None
+
+    @property
+    def finished(self) -> bool:
+        return self.step >= len(self.order)
+
+    def mark_shown(self) -> None:
+        self.shown_at = time.monotonic()
+
+    def answer(self, q_index: int, choice: int, is_ok: bool) -> Optional[int]:
+        """Зарахувати відповідь; повертає латентність (мс) від показу питання."""
+        if is_ok:
+            self.score += 1
+            self.streak += 1
+        else:
+            self.streak = 0
+            bit = 1 << q_index
+            if not self.wrong_bits & bit:
+                self.wrong_bits |= bit
+                self.wrong_log.append(q_index)
+                self.wrong_log.append(choice)
+        if self.shown_at is None:
+            return None
+        return int((time.monotonic() - self.shown_at) * 1000)
+
+    def advance(self) -> Optional[int]:
+        """Перейти до наступного питання; None — сесію завершено."""
+        if self.step < len(self.order):
+            self.step += 1
+        return self.current
+
+    def finish(self) -> Dict[str, Any]:
+        """Підсумок сесії (для save_user_result_db і last_result)."""
+        total = len(self.order)
+        return {
+            "mode": self.mode,
+            "score": self.score,
+            "total": total,
+            "percent": (self.score / total * 100.0) if total else 0.0,
+            "duration": time.monotonic() - self.started_at,
+            "current_streak": self.streak,
+            "wrong_pairs": self.wrong_pairs,
+        }
+
+    # ---------- помилки ----------
+
+    @property
+    def wrong_pairs(self) -> List[Tuple[int, int]]:
+        log = self.wrong_log
+        return [(log[i], log[i + 1]) for i in range(0, len(log) - 1, 2)]
+
+    def is_wrong(self, q_index: int) -> bool:
+        return bool(self.wrong_bits >> q_index & 1)
+
+    # ---------- серіалізація (handlers/persistence.py) ----------
+
+    def to_record(self) -> Tuple[bytes, int, int, bytes, Dict[str, Any]]:
+        """(order_blob, step, score, wrong_blob, дрібні поля) — стабільний, поки стан не змінився."""
+        extra = {"mode": self.mode, "streak": self.streak, "started": int(self.started_wall)}
+        return self.order.tobytes(), self.step, self.score, self.wrong_log.tobytes(), extra
+
+    @classmethod
+    def from_record(cls, order_blob: bytes, step: int, score: int, wrong_blob: bytes,
+                    extra: Dict[str, Any]) -> "QuizSession":
+        session = cls(extra.get("mode") or "test", ())
+        session.order.frombytes(order_blob)
+        session.step = min(int(step), len(session.order))
+        session.score = int(score)
+        session.streak = int(extra.get("streak") or 0)
+        session.wrong_log.frombytes(wrong_blob or b"")
+        for q in session.wrong_log[::2]:
+            session.wrong_bits |= 1 << q
+        started = extra.get("started")
+        if isinstance(started, (int, float)):
+            # час простою бота теж іде в тривалість — як і до рестарту
+            session.started_wall = float(started)
+            session.started_at -= max(0.0, time.time() - started)
+        return session
+
+
+def get_session(user_data: Dict[str, Any]) -> Optional[QuizSession]:
+    session = user_data.get(SESSION_KEY)
+    return session if isinstance(session, QuizSession) else None
+
+
+def end_session(user_data: Dict[str, Any], clear_mode: bool = False) -> Optional[QuizSession]:
+    """Прибрати сесію (і прив'язані до неї ключі) з user_data; повертає її."""
+    session = user_data.pop(SESSION_KEY, None)
+    for k in _SESSION_SIDE_KEYS:
+        user_data.pop(k, None)
+    if clear_mode:
+        user_data.pop("mode", None)
+    return session if isinstance(session, QuizSession) else None
@@ -0,0 +1,384 @@
+# handlers/rate_limiter.py
+"""
+Обмеження вихідних запитів до Telegram (PTB BaseRateLimiter) з пріоритетами.
+
+Пошук надсилає до 20 повідомлень поспіль, розбір помилок — десятки шматків,
+і все це без огляду на ліміти Telegram (~1 повідомлення/с у чат, ~20/хв у групу,
+~30/с на бота). Наслідок — 429 RetryAfter, і «Далі» в квізі чекає разом з усіма.
+Тепер кожен send*/edit*/copy*/forward* проходить через:
+
+  - відро чату (GCRA): RATE_CHAT_PER_SEC з запасом RATE_CHAT_BURST; групи й канали
+    (chat_id < 0) — 20 на хвилину. Черга чату — за пріоритетом, а в межах
+    пріоритету — за порядком, тож правка квізу не чекає BULK-розсилку свого ж чату;
+  - глобальне відро RATE_GLOBAL_PER_SEC (30/с): коли токенів немає, чекаючі
+    обслуговуються за пріоритетом, а в межах пріоритету — за чергою:
+      INTERACTIVE — edit*, sendChatAction (питання квізу, підпис після відповіді);
+      NORMAL      — решта send*;
+      BULK        — пакетні розсилки (bulk_sends() / rate_limit_args=BULK);
+  - RetryAfter: чат (або весь бот, якщо чат невідомий) ставиться на паузу на
+    retry_after, запит повторюється до RATE_MAX_RETRIES разів.
+
+answerCallbackQuery, getFile, setMyCommands тощо не обмежуються (fast-ack у колбеках).
+Метрики черги — rate_limiter_stats(). RATE_LIMIT=0 вимикає обмежувач.
+Перевірка пріоритетів у черзі чату: python -m handlers.rate_limiter
+"""
+import os
+import heapq
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from itertools import count
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger("test_bot.ratelimit")
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+_PRIORITY_NAMES = ("interactive", "normal", "bulk")
+
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+_INTERACTIVE_ENDPOINTS = {"sendChatAction"}
+
+_priority_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("send_priority", default=None)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+@contextmanager
+def bulk_sends() -> Iterator[None]:
+    """Усі запити в межах блоку (у цій задачі) — з пріоритетом BULK."""
+    token = _priority_var.set(BULK)
+    try:
+        yield
+    finally:
+        _priority_var.reset(token)
+
+
+class _ChatBucket:
+    """
+    GCRA чату: момент, коли відро знову буде повним (tat), інтервал і запас.
+    Слот резервується лише тоді, коли запит виходить з черги чату, а черга —
+    за (пріоритет, порядок), тож правка квізу обганяє вже поставлені BULK-розсилки.
+    """
+    __slots__ = ("tat", "interval", "tolerance", "_waiters", "_seq", "_pump")
+
+    def __init__(self, per_sec: float, burst: int):
+        self.tat = 0.0
+        self.interval = 1.0 / per_sec
+        self.tolerance = self.interval * max(0, burst - 1)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def _ready_in(self, now: float) -> float:
+        """Скільки секунд до найближчого вільного слота (без резервування)."""
+        return max(0.0, max(self.tat, now) - self.tolerance - now)
+
+    def _reserve(self, now: float) -> None:
+        self.tat = max(self.tat, now) + self.interval
+
+    async def acquire(self, priority: int) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if not self._waiters and self._ready_in(now) == 0.0:
+            self._reserve(now)
+            return
+        fut = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = loop.create_task(self._run_pump())
+        await fut
+
+    async def _run_pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            now = loop.time()
+            delay = self._ready_in(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _prio, _seq, fut = heapq.heappop(self._waiters)
+            if fut.done():  # запит скасовано, поки чекав
+                continue
+            self._reserve(now)
+            fut.set_result(None)
+
+    def idle(self, now: float) -> bool:
+        return self.tat <= now and not self._waiters
+
+    def pause_until(self, until: float) -> None:
+        self.tat = max(self.tat, until + self.tolerance)
+
+    def close(self) -> None:
+        if self._pump is not None and not self._pump.done():
+            self._pump.cancel()
+        for _prio, _seq, fut in self._waiters:
+            if not fut.done():
+                fut.cancel()
+        self._waiters.clear()
+
+
+class _GlobalBucket:
+    """Глобальне відро: токени видаються чекаючим за (пріоритет, черга)."""
+
+    def __init__(self, per_sec: float, burst: int):
+        self.rate = per_sec
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.stamp = 0.0
+        self.paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def _refill(self, now: float) -> None:
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def depth(self) -> Dict[str, int]:
+        out = dict.fromkeys(_PRIORITY_NAMES, 0)
+        for prio, _seq, fut in self._waiters:
+            if not fut.done():
+                out[_PRIORITY_NAMES[prio]] += 1
+        return out
+
+    async def acquire(self, priority: int) -> None:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._refill(now)
+        if not self._waiters and now >= self.paused_until and self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return
+        fut = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = loop.create_task(self._run_pump())
+        await fut
+
+    async def _run_pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            now = loop.time()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens < 1.0:
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+                continue
+            _prio, _seq, fut = heapq.heappop(self._waiters)
+            if fut.done():  # запит скасовано, поки чекав
+                continue
+            self.tokens -= 1.0
+            fut.set_result(None)
+
+    async def close(self) -> None:
+        if self._pump is not None and not self._pump.done():
+            self._pump.cancel()
+        for _prio, _seq, fut in self._waiters:
+            if not fut.done():
+                fut.cancel()
+        self._waiters.clear()
+
+
+class OutboundRateLimiter(BaseRateLimiter[int]):
+    """
+    Відра на чат і глобальне, пріоритети і повтори після RetryAfter.
+    rate_limit_args — пріоритет (INTERACTIVE / NORMAL / BULK) для окремого виклику.
+    """
+
+    def __init__(
+        self,
+        global_per_sec: float = 30.0,
+        chat_per_sec: float = 1.0,
+        chat_burst: int = 3,
+        group_per_min: float = 20.0,
+        max_retries: int = 2,
+    ):
+        self.global_per_sec = max(0.1, global_per_sec)
+        self.chat_per_sec = max(0.01, chat_per_sec)
+        self.chat_burst = max(1, chat_burst)
+        self.group_per_sec = max(0.01, group_per_min / 60.0)
+        self.max_retries = max(0, max_retries)
+        self._global = _GlobalBucket(self.global_per_sec, int(self.global_per_sec))
+        self._chats: Dict[Any, _ChatBucket] = {}
+        self._calls = 0
+        self._stats = {
+            "requests": 0,
+            "passthrough": 0,
+            "throttled": 0,
+            "wait_ms_total": 0,
+            "wait_ms_max": 0,
+            "retry_after": 0,
+            "retried": 0,
+            "gave_up": 0,
+        }
+        self._by_priority = dict.fromkeys(_PRIORITY_NAMES, 0)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        await self._global.close()
+        for bucket in self._chats.values():
+            bucket.close()
+        self._chats.clear()
+
+    # ---- внутрішнє ----
+
+    def _priority(self, endpoint: str, rate_limit_args: Optional[int]) -> int:
+        if isinstance(rate_limit_args, int) and INTERACTIVE <= rate_limit_args <= BULK:
+            return rate_limit_args
+        ctx = _priority_var.get()
+        if ctx is not None:
+            return ctx
+        if endpoint.startswith("edit") or endpoint in _INTERACTIVE_ENDPOINTS:
+            return INTERACTIVE
+        return NORMAL
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> _ChatBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            self._calls += 1
+            if self._calls % 1000 == 0:  # прибрати відра чатів, що давно мовчать
+                for cid in [c for c, b in self._chats.items() if b.idle(now)]:
+                    del self._chats[cid]
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            per_sec = self.group_per_sec if is_group else self.chat_per_sec
+            bucket = self._chats[chat_id] = _ChatBucket(per_sec, self.chat_burst)
+        return bucket
+
+    async def _wait_turn(self, chat_id: Any, priority: int) -> None:
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        if chat_id is not None:
+            await self._chat_bucket(chat_id, t0).acquire(priority)
+        await self._global.acquire(priority)
+        waited = int((loop.time() - t0) * 1000)
+        if waited > 0:
+            self._stats["throttled"] += 1
+            self._stats["wait_ms_total"] += waited
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], waited)
+
+    def _pause(self, chat_id: Any, retry_after: float) -> None:
+        now = asyncio.get_running_loop().time()
+        until = now + retry_after
+        if chat_id is None:
+            self._global.paused_until = max(self._global.paused_until, until)
+        else:
+            self._chat_bucket(chat_id, now).pause_until(until)
+
+    # ---- BaseRateLimiter ----
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            self._stats["passthrough"] += 1
+            return await callback(*args, **kwargs)
+
+        priority = self._priority(endpoint, rate_limit_args)
+        chat_id = data.get("chat_id")
+        self._stats["requests"] += 1
+        self._by_priority[_PRIORITY_NAMES[priority]] += 1
+
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._stats["retry_after"] += 1
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                if attempt >= self.max_retries:
+                    self._stats["gave_up"] += 1
+                    raise
+                attempt += 1
+                self._stats["retried"] += 1
+                logger.warning("[RATELIMIT] %s chat=%s: retry after %.1fs (attempt %d)", endpoint, chat_id, retry_after, attempt)
+                self._pause(chat_id, retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self._stats)
+        out["by_priority"] = dict(self._by_priority)
+        out["queued"] = self._global.depth()
+        out["chats"] = len(self._chats)
+        return out
+
+
+_limiter: Optional[OutboundRateLimiter] = None
+
+
+def create_rate_limiter() -> Optional[OutboundRateLimiter]:
+    """OutboundRateLimiter з параметрами з env, якщо не вимкнено RATE_LIMIT=0."""
+    global _limiter
+    if os.getenv("RATE_LIMIT", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    _limiter = OutboundRateLimiter(
+        global_per_sec=_env_float("RATE_GLOBAL_PER_SEC", 30),
+        chat_per_sec=_env_float("RATE_CHAT_PER_SEC", 1),
+        chat_burst=int(_env_float("RATE_CHAT_BURST", 3)),
+        group_per_min=_env_float("RATE_GROUP_PER_MIN", 20),
+        max_retries=int(_env_float("RATE_MAX_RETRIES", 2)),
+    )
+    return _limiter
+
+
+def rate_limiter_stats() -> Optional[Dict[str, Any]]:
+    return _limiter.stats() if _limiter is not None else None
+
+
+# ===================== Перевірка =====================
+
+async def _check_chat_priority(bulk: int = 8) -> None:
+    """bulk розсилок у чат, потім одна правка того ж чату — правка має піти наступною."""
+    limiter = OutboundRateLimiter(chat_per_sec=10.0, chat_burst=3)
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    sent: List[Tuple[str, float]] = []
+
+    async def _call(endpoint: str) -> bool:
+        sent.append((endpoint, loop.time() - t0))
+        return True
+
+    async def _send(endpoint: str) -> None:
+        await limiter.process_request(_call, (endpoint,), {}, endpoint, {"chat_id": 42}, None)
+
+    async def _bulk() -> None:
+        with bulk_sends():
+            await asyncio.gather(*(_send("sendMessage") for _ in range(bulk)))
+
+    bulk_task = asyncio.create_task(_bulk())
+    await asyncio.sleep(0.01)  # запас відра витрачено, решта розсилок — у черзі чату
+    await _send("editMessageMedia")
+    await bulk_task
+    await limiter.shutdown()
+
+    order = [e for e, _t in sent]
+    edit_pos = order.index("editMessageMedia")
+    burst = limiter.chat_burst
+    for endpoint, at in sent:
+        print(f"  {at:5.2f} с  {endpoint}")
+    assert edit_pos == burst, f"правка вийшла {edit_pos + 1}-ю, очікувалось {burst + 1}-ю"
+    print(f"OK: правка пішла одразу після запасу відра ({burst}), обігнала {bulk - burst} BULK у черзі чату")
+
+
+if __name__ == "__main__":
+    asyncio.run(_check_chat_priority())
@@ -0,0 +1,292 @@
+# handlers/search_index.py
+"""
+Повнотекстовий пошук по всьому банку питань (SQLite FTS5 у stats.db).
+
+Таблиці (міграція 2 у handlers/migrations.py):
+  - search_docs  — по рядку на JSON тесту: шлях, назва, хеш вмісту з каталогу;
+  - search_fts   — текст питання та варіантів; rowid = doc_id << 20 | q_index;
+  - search_names — назви тестів (rowid = doc_id).
+
+Індекс наповнюється з каталогу (utils.catalog) інкрементально: перед пошуком
+звіряємо хеші з search_docs і переіндексовуємо лише змінені/нові JSON,
+видалені — прибираємо. Тож правка тесту (додавання питання, редагування,
+watcher) потрапляє в пошук при наступному запиті.
+
+Запит: кожне слово — префікс ("слово"*), усі слова обов'язкові, ранжування bm25
+(текст питання важить більше за варіанти). Нормалізація однакова для тексту
+і запиту: апострофи прибираються (м'яч → мяч), ґ → г.
+
+Якщо SQLite без FTS5 — той самий API працює лінійним проходом по каталогу.
+"""
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import handlers.statistics_db as sdb
+from handlers.db import db
+from utils.catalog import get_catalog
+from utils.loader import _load_json
+from utils.question import Question
+from utils.question_cache import load_questions
+
+logger = logging.getLogger("test_bot.search")
+
+ROWID_SHIFT = 20                      # до ~1 млн питань в одному JSON
+MAX_Q_INDEX = (1 << ROWID_SHIFT) - 1
+SYNC_BATCH = 50                       # JSON за одну транзакцію при переіндексації
+
+_APOSTROPHES = str.maketrans({"'": None, "’": None, "ʼ": None, "`": None, "ґ": "г", "Ґ": "Г"})
+_WORD_RE = re.compile(r"\w+")
+
+_sync_lock = asyncio.Lock()
+_synced_version: Optional[int] = None
+
+
+def normalize_text(text: Any) -> str:
+    return str(text or "").translate(_APOSTROPHES)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """'Головний орган' → '"головний"* "орган"*' (None — якщо слів немає)."""
+    words = _WORD_RE.findall(normalize_text(query).lower())
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def _doc_range(doc_id: int) -> Tuple[int, int]:
+    lo = doc_id << ROWID_SHIFT
+    return lo, lo | MAX_Q_INDEX
+
+
+# ====== Синхронізація з каталогом ======
+
+def _question_rows(json_path: str) -> List[Tuple[int, str, str]]:
+    """[(q_index, текст, варіанти)] — читається напряму, без засмічення кешу питань."""
+    data = _load_json(json_path)
+    rows = []
+    for i, raw in enumerate(data[:MAX_Q_INDEX + 1]):
+        q = Question(raw)
+        rows.append((i, normalize_text(q.text), normalize_text(" | ".join(q.answer_texts))))
+    return rows
+
+
+async def sync_search_index(catalog: Dict[str, dict]) -> Dict[str, int]:
+    """
+    Приводить індекс у відповідність до каталогу {назва: entry}.
+    Повертає {"indexed": .., "removed": ..}.
+    """
+    if not sdb.SEARCH_FTS_AVAILABLE:
+        return {"indexed": 0, "removed": 0}
+
+    want: Dict[str, Tuple[str, str]] = {}
+    for name, entry in catalog.items():
+        path = entry.get("json_path")
+        if path:
+            want[os.path.abspath(path)] = (name, entry.get("hash") or "")
+
+    rows = await db.fetchall("SELECT doc_id, json_path, test_name, hash FROM search_docs")
+    have = {row[1]: (row[0], row[2], row[3]) for row in rows}
+
+    removed = [(doc_id, path) for path, (doc_id, _n, _h) in have.items() if path not in want]
+    todo = [
+        path for path, (name, content_hash) in want.items()
+        if path not in have or have[path][2] != content_hash
+    ]
+    renamed = [
+        (name, have[path][0]) for path, (name, content_hash) in want.items()
+        if path in have and have[path][2] == content_hash and have[path][1] != name
+    ]
+
+    if removed or renamed:
+        async with db.transaction() as conn:
+            for doc_id, _path in removed:
+                await conn.execute("DELETE FROM search_fts WHERE rowid BETWEEN ? AND ?", _doc_range(doc_id))
+                await conn.execute("DELETE FROM search_names WHERE rowid = ?", (doc_id,))
+                await conn.execute("DELETE FROM search_docs WHERE doc_id = ?", (doc_id,))
+            for name, doc_id in renamed:
+                await conn.execute("UPDATE search_docs SET test_name = ? WHERE doc_id = ?", (name, doc_id))
+                await conn.execute("DELETE FROM search_names WHERE rowid = ?", (doc_id,))
+                await conn.execute("INSERT INTO search_names(rowid, name) VALUES (?, ?)", (doc_id, normalize_text(name)))
+
+    loop = asyncio.get_running_loop()
+    for start in range(0, len(todo), SYNC_BATCH):
+        batch = todo[start:start + SYNC_BATCH]
+        parsed = await loop.run_in_executor(None, lambda b=batch: [(p, _question_rows(p)) for p in b])
+        async with db.transaction() as conn:
+            for path, rows in parsed:
+                name, content_hash = want[path]
+                if path in have:
+                    doc_id = have[path][0]
+                    await conn.execute("DELETE FROM search_fts WHERE rowid BETWEEN ? AND ?", _doc_range(doc_id))
+                    await conn.execute("DELETE FROM search_names WHERE rowid = ?", (doc_id,))
+                    await conn.execute(
+                        "UPDATE search_docs SET test_name = ?, hash = ?, total = ? WHERE doc_id = ?",
+                        (name, content_hash, len(rows), doc_id),
+                    )
+                else:
+                    cur = await conn.execute(
+                        "INSERT INTO search_docs(json_path, test_name, hash, total) VALUES (?, ?, ?, ?)",
+                        (path, name, content_hash, len(rows)),
+                    )
+                    doc_id = cur.lastrowid
+                base = doc_id << ROWID_SHIFT
+                await conn.executemany(
+                    "INSERT INTO search_fts(rowid, question, answers) VALUES (?, ?, ?)",
+                    [(base | i, text, answers) for i, text, answers in rows],
+                )
+                await conn.execute("INSERT INTO search_names(rowid, name) VALUES (?, ?)", (doc_id, normalize_text(name)))
+
+    if todo or removed:
+        logger.info(f"[SEARCH] index synced: {len(todo)} JSON indexed, {len(removed)} removed")
+    return {"indexed": len(todo), "removed": len(removed)}
+
+
+async def ensure_search_index(root_dir: str = "tests") -> None:
+    """Дозвірити індекс з каталогом, якщо каталог змінився з останньої синхронізації."""
+    global _synced_version
+    if not sdb.SEARCH_FTS_AVAILABLE:
+        return
+    cat = get_catalog(root_dir)
+    loop = asyncio.get_running_loop()
+    catalog, _tree = await loop.run_in_executor(None, cat.refresh)
+    version = cat.version
+    if _synced_version == version:
+        return
+    if _sync_lock.locked():
+        # індекс уже наповнюється (старт бота) — шукаємо по тому, що є
+        return
+    async with _sync_lock:
+        if _synced_version == version:
+            return
+        try:
+            await sync_search_index(catalog)
+            _synced_version = version
+        except Exception as e:
+            logger.warning(f"[SEARCH] sync failed: {e}")
+
+
+# ====== Пошук ======
+
+async def search_questions(
+    query: str,
+    json_paths: Optional[Sequence[str]] = None,
+    limit: int = 10,
+    offset: int = 0,
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Питання за запитом: усього збігів і сторінка результатів
+    [{"test_name", "json_path", "q_index"}], найрелевантніші першими.
+    json_paths — обмежити пошук цими JSON (поточний тест), None — весь банк.
+    """
+    await ensure_search_index()
+    if not sdb.SEARCH_FTS_AVAILABLE:
+        return _linear_search_questions(query, json_paths, limit, offset)
+
+    match = build_match_query(query)
+    if not match:
+        return 0, []
+
+    where = "search_fts MATCH ?"
+    params: List[Any] = [match]
+    if json_paths is not None:
+        wanted = [os.path.abspath(p) for p in json_paths]
+        if not wanted:
+            return 0, []
+        rows = await db.fetchall(
+            f"SELECT doc_id FROM search_docs WHERE json_path IN ({','.join('?' * len(wanted))})", wanted
+        )
+        doc_ids = [row[0] for row in rows]
+        if not doc_ids:
+            return 0, []
+        where += " AND (" + " OR ".join("rowid BETWEEN ? AND ?" for _ in doc_ids) + ")"
+        for doc_id in doc_ids:
+            params.extend(_doc_range(doc_id))
+
+    try:
+        total = (await db.fetchone(f"SELECT COUNT(*) FROM search_fts WHERE {where}", params))[0]
+        if not total:
+            return 0, []
+        rows = await db.fetchall(f"""
+            SELECT f.rowid, d.test_name, d.json_path
+            FROM (
+                SELECT rowid, bm25(search_fts, 5.0, 1.0) AS score
+                FROM search_fts WHERE {where}
+                ORDER BY score LIMIT ? OFFSET ?
+            ) AS f
+            JOIN search_docs d ON d.doc_id = (f.rowid >> {ROWID_SHIFT})
+            ORDER BY f.score
+        """, params + [limit, offset])
+    except Exception as e:
+        logger.warning(f"[SEARCH] query failed ({match!r}): {e}")
+        return 0, []
+
+    hits = [
+        {"test_name": name, "json_path": path, "q_index": rowid & MAX_Q_INDEX}
+        for rowid, name, path in rows
+    ]
+    return total, hits
+
+
+async def search_test_names(query: str, names: Iterable[str], limit: int = 30) -> List[str]:
+    """
+    Назви тестів за запитом: спершу ранжовані збіги FTS (префікси слів),
+    далі — звичайні входження підрядка (щоб не загубити «середину слова»).
+    names — актуальні назви з каталогу (лише вони повертаються).
+    """
+    names = list(names)
+    known = set(names)
+    out: List[str] = []
+    match = build_match_query(query)
+    await ensure_search_index()
+    if sdb.SEARCH_FTS_AVAILABLE and match:
+        try:
+            rows = await db.fetchall("""
+                SELECT d.test_name FROM search_names n
+                JOIN search_docs d ON d.doc_id = n.rowid
+                WHERE search_names MATCH ? ORDER BY bm25(search_names) LIMIT ?
+            """, (match, limit * 4))
+            out = [row[0] for row in rows if row[0] in known]
+        except Exception as e:
+            logger.warning(f"[SEARCH] name query failed ({match!r}): {e}")
+
+    qlow = normalize_text(query).lower()
+    # точна назва і назви, що починаються із запиту, — вище за ранжування bm25
+    out.sort(key=lambda n: (normalize_text(n).lower() != qlow, not normalize_text(n).lower().startswith(qlow)))
+    out = out[:limit]
+    if len(out) < limit:
+        seen = set(out)
+        for name in names:
+            if name not in seen and qlow in normalize_text(name).lower():
+                out.append(name)
+                if len(out) >= limit:
+                    break
+    return out
+
+
+# ====== Лінійний запасний варіант (SQLite без FTS5) ======
+
+def _linear_search_questions(
+    query: str, json_paths: Optional[Sequence[str]], limit: int, offset: int
+) -> Tuple[int, List[Dict[str, Any]]]:
+    words = _WORD_RE.findall(normalize_text(query).lower())
+    if not words:
+        return 0, []
+    if json_paths is not None:
+        docs = [(os.path.basename(os.path.splitext(p)[0]), p) for p in json_paths]
+    else:
+        docs = [(name, e["json_path"]) for name, e in get_catalog("tests").catalog().items()]
+
+    total = 0
+    hits: List[Dict[str, Any]] = []
+    for name, path in docs:
+        for i, raw in enumerate(load_questions(path)):
+            q = Question(raw)
+            hay = normalize_text(q.text + " " + " ".join(q.answer_texts)).lower()
+            if all(w in hay for w in words):
+                if offset <= total < offset + limit:
+                    hits.append({"test_name": name, "json_path": os.path.abspath(path), "q_index": i})
+                total += 1
+    return total, hits
@@ -1,7 +1,9 @@
+import html
+
 from telegram import Update
 from telegram.ext import ContextTypes
 from utils.i18n import t
-from utils.loader import discover_tests_hierarchy, build_listing_for_path, discover_tests
+from utils.loader import build_listing_for_path, load_catalog_and_tree
 from utils.keyboards import browse_menu, stats_clear_inline_kb, stats_clear_confirm_kb
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -13,10 +15,8 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = context.bot_data.get("lang", "uk")
 
     # 🔄 Примусовий рефреш дерева і каталогу перед показом
-    tree = discover_tests_hierarchy("tests")
+    catalog, tree = load_catalog_and_tree("tests")
     context.bot_data["tests_tree"] = tree
-
-    catalog = discover_tests("tests")
     context.bot_data["tests_catalog"] = catalog
 
     # Корінь
@@ -54,39 +54,80 @@ async def cmd_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(rules_text)
 
 async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обробник команди /stats"""
-    from handlers.statistics_db import get_user_results
+    """Обробник команди /stats (підсумки за весь час з агрегатних таблиць)"""
+    from handlers.statistics_db import get_user_totals, get_user_test_stats
     lang = context.bot_data.get("lang", "uk")
-    
+
     user_id = update.effective_user.id
-    results = await get_user_results(user_id, limit=10)
-    
-    if not results:
+    totals = await get_user_totals(user_id)
+
+    if not totals:
         await update.message.reply_text(t(lang, "no_stats_yet"), reply_markup=stats_clear_inline_kb())
         return
-    
-    stats_text = t(lang, "stats_header", test="Усі тести", correct=0, total=0, acc=0, best=0) + "\n\n"
-    
-    total_correct = 0
-    total_answered = 0
-    best_streak = 0
-    
-    for i, result in enumerate(results, 1):
-        total_correct += result['score'] or 0
-        total_answered += result['total_questions'] or 0
-        best_streak = max(best_streak, result.get('current_streak', 0) or 0)
-        
-        stats_text += (
-            f"{i}. {result['test_name']}: {result['score']}/{result['total_questions']} "
-            f"({(result['percent'] or 0):.1f}%)\n"
-        )
-    
+
+    total_correct = totals["total_score"] or 0
+    total_answered = totals["total_questions"] or 0
     accuracy = (total_correct / total_answered * 100) if total_answered > 0 else 0
-    
-    stats_text += f"\n📊 Загалом: {total_correct}/{total_answered} ({accuracy:.1f}%)"
-    stats_text += f"\n🔥 Найкраща серія: {best_streak}"
-    
-    await update.message.reply_text(stats_text, reply_markup=stats_clear_inline_kb())
+
+    stats_text = html.escape(t(
+        lang, "stats_header", test="Усі тести", correct=total_correct, total=total_answered,
+        acc=f"{accuracy:.1f}", best=totals["best_streak"],
+    ), quote=False) + "\n\n"
+    stats_text += (
+        f"📝 Спроб: {totals['attempts']} (тестів: {totals['tests']})\n"
+        f"🎯 Середній результат: {totals['avg_percent']:.1f}%, найкращий: {(totals['best_percent'] or 0):.1f}%\n"
+    )
+    if totals["last_test"]:
+        stats_text += f"🕘 Остання спроба: {html.escape(totals['last_test'])} — {(totals['last_percent'] or 0):.1f}%\n"
+
+    per_test = await get_user_test_stats(user_id, limit=10)
+    if per_test:
+        stats_text += "\n<b>По тестах</b> (спроби · найкраще · середнє):\n"
+        for i, row in enumerate(per_test, 1):
+            stats_text += (
+                f"{i}. {html.escape(row['test_name'])}: {row['attempts']} · "
+                f"{(row['best_percent'] or 0):.1f}% · {row['avg_percent']:.1f}%\n"
+            )
+    stats_text += "\n🏆 Рейтинг тесту: /leaderboard [назва тесту]"
+
+    await update.message.reply_text(stats_text, parse_mode="HTML", reply_markup=stats_clear_inline_kb())
+
+def _display_name(row: dict) -> str:
+    return f"@{row['username']}" if row.get("username") else f"Користувач …{str(row['user_id'])[-4:]}"
+
+async def cmd_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /leaderboard [назва тесту] — рейтинг тесту.
+    Без аргументу: поточний тест, інакше — тест останньої спроби користувача.
+    """
+    from handlers.statistics_db import get_user_totals, get_test_leaderboard, get_user_test_rank
+    user_id = update.effective_user.id
+
+    test_name = " ".join(context.args or []).strip() or context.user_data.get("current_test")
+    if not test_name:
+        totals = await get_user_totals(user_id)
+        test_name = totals["last_test"] if totals else None
+    if not test_name:
+        await update.message.reply_text("ℹ️ Вкажіть назву тесту: /leaderboard <назва тесту>")
+        return
+
+    top = await get_test_leaderboard(test_name, limit=10)
+    if not top:
+        await update.message.reply_text(f"ℹ️ Для тесту «{test_name}» ще немає результатів.")
+        return
+
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [f"🏆 <b>Рейтинг: {html.escape(test_name)}</b>\n"]
+    for i, row in enumerate(top, 1):
+        lines.append(
+            f"{medals.get(i, f'{i}.')} {html.escape(_display_name(row))} — "
+            f"{(row['best_percent'] or 0):.1f}% ({row['best_score']} прав., спроб: {row['attempts']})"
+        )
+    rank = await get_user_test_rank(user_id, test_name)
+    if rank:
+        lines.append(f"\nВаше місце: {rank[0]} з {rank[1]}")
+
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
 
 # ====== Інлайн: очистка всієї статистики ======
 
@@ -1,14 +1,21 @@
 import os
-import json
 import asyncio
 import logging
-from telegram.ext import ContextTypes
-from utils.loader import attach_images
+from bisect import bisect_left
+from typing import List, Optional, Sequence
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+from utils.catalog import get_catalog
+from utils.question import CompiledTest, Question, find_compiled_test, load_compiled_test, get_compiled_test
+from handlers.quiz_session import end_session, get_session
 
 logger = logging.getLogger("test_bot")
 
 IGNORED_JSON_SUFFIXES = (".comments.json", ".docx.meta.json")
 
+# спільний CompiledTest, закріплений за сесією (не зберігається persistence)
+TEST_PIN_KEY = "__test"
+
 def _find_json_for_test(test_dir: str, test_name: str) -> str | None:
     """
     Повертає шлях до JSON-файла тесту в теці test_dir.
@@ -36,13 +43,176 @@ def _find_json_for_test(test_dir: str, test_name: str) -> str | None:
     candidates = sorted(jsons, key=lambda n: (0 if n[:-5].lower() == low else 1, len(n)))
     return os.path.join(test_dir, candidates[0])
 
+async def load_session_test(context: ContextTypes.DEFAULT_TYPE, parts) -> CompiledTest:
+    """
+    Прив'язує сесію користувача до скомпільованого тесту.
+    parts — [(json_path, media_dir), ...]. У user_data зберігаємо лише
+    посилання (test_ref), кількість питань і сам спільний об'єкт (TEST_PIN_KEY).
+    """
+    loop = asyncio.get_event_loop()
+    compiled = await loop.run_in_executor(None, load_compiled_test, parts)
+    context.user_data["test_ref"] = [list(p) for p in compiled.parts]
+    context.user_data[TEST_PIN_KEY] = compiled
+    context.user_data["test_hash"] = session_test_hash(compiled)
+    context.user_data["total_questions"] = len(compiled)
+    context.user_data.pop("session_restored", None)
+    context.user_data.pop("questions", None)  # старий формат (повна копія питань)
+    return compiled
+
+
+def session_test_hash(compiled: CompiledTest) -> str:
+    """Відбиток вмісту частин тесту: хеш із каталогу, інакше (mtime_ns, size) файла."""
+    catalog = get_catalog()
+    out = []
+    for (json_path, _media), (json_fp, _media_fp) in zip(compiled.parts, compiled.version):
+        h = catalog.content_hash(json_path)
+        out.append(h or ("%d:%d" % json_fp if json_fp[0] >= 0 else "-"))
+    return "|".join(out)
+
+
+# ключі user_data, що прив'язують сесію до версії тесту
+_SESSION_TEST_KEYS = ("test_ref", TEST_PIN_KEY, "test_hash", "total_questions", "current_q_index", "learning_range", "topic_filter")
+
+
+def _drop_changed_session(ud) -> None:
+    """Тест змінився після рестарту: order, рахунок і помилки вказують на інші питання — завершуємо сесію."""
+    session = end_session(ud, clear_mode=True)
+    for k in _SESSION_TEST_KEYS:
+        ud.pop(k, None)
+    logger.info(
+        f"[SESSION] test changed since the session started ({ud.get('current_test')}), "
+        f"session ended at {session.step if session else 0}/{session.total if session else 0}"
+    )
+
+
+def _verify_restored_session(context: ContextTypes.DEFAULT_TYPE, ref) -> Sequence[Question]:
+    """
+    Перше звернення до питань сесії, відновленої після рестарту (handlers/persistence.py),
+    якщо prepare_session_test ще не спрацював: компілюємо тест з файлів і звіряємо
+    відбиток; якщо тест змінився — сесію завершено, питань немає.
+    """
+    ud = context.user_data
+    ud.pop("session_restored", None)
+    compiled = load_compiled_test(ref)
+    if ud.get("test_hash") != session_test_hash(compiled):
+        _drop_changed_session(ud)
+        return []
+    ud[TEST_PIN_KEY] = compiled
+    return compiled
+
+
+async def prepare_session_test(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    group=-1, до всіх хендлерів: тест активної сесії має бути закріплений у
+    user_data[TEST_PIN_KEY], інакше гарячий шлях (показ питання, відповідь,
+    пул за темою) компілював би JSON просто в циклі подій. Компіляція — у пулі.
+
+    Перше оновлення сесії, відновленої після рестарту: якщо тест змінився —
+    завершуємо сесію і повідомляємо користувача; кнопки старого питання
+    (callback) далі не обробляються.
+    """
+    ud = context.user_data
+    if not ud:
+        return
+    ref = ud.get("test_ref")
+    restored = ud.pop("session_restored", None)
+    if not ref or (not restored and (TEST_PIN_KEY in ud or get_session(ud) is None)):
+        return
+    loop = asyncio.get_running_loop()
+    if not restored:
+        compiled = find_compiled_test(ref) or await loop.run_in_executor(None, get_compiled_test, ref)
+        ud[TEST_PIN_KEY] = compiled
+        return
+    compiled = await loop.run_in_executor(None, load_compiled_test, ref)
+    if ud.get("test_hash") == session_test_hash(compiled):
+        ud[TEST_PIN_KEY] = compiled
+        return
+
+    test_name = ud.get("current_test") or "тест"
+    _drop_changed_session(ud)
+    text = f"⚠️ «{test_name}» змінився, поки бот перезапускався, — попередню сесію завершено. Почніть тест заново."
+    query = update.callback_query
+    if query is not None:
+        try:
+            await query.answer()
+        except Exception:
+            pass
+    chat = update.effective_chat
+    if chat is not None:
+        try:
+            await context.bot.send_message(chat.id, text)
+        except Exception as e:
+            logger.debug(f"[SESSION] notify failed: {e}")
+    if query is not None:
+        raise ApplicationHandlerStop
+
+
+def get_session_questions(context: ContextTypes.DEFAULT_TYPE) -> Sequence[Question]:
+    """Питання поточного тесту сесії (read-only, індексуються як список)."""
+    ref = context.user_data.get("test_ref")
+    if ref:
+        if context.user_data.get("session_restored"):
+            return _verify_restored_session(context, ref)
+        pinned = context.user_data.get(TEST_PIN_KEY)
+        if pinned is not None:
+            return pinned
+        return get_compiled_test(ref)
+    return context.user_data.get("questions") or []
+
+
+def session_topic_pool(context: ContextTypes.DEFAULT_TYPE, topic: str,
+                       lo: int = 0, hi: Optional[int] = None) -> List[int]:
+    """
+    Індекси питань поточного тесту з темою topic у діапазоні [lo, hi).
+
+    Для кожної частини тесту (базовий / custom JSON) береться готовий
+    інвертований індекс каталогу, якщо відбиток файла збігається з версією
+    скомпільованого тесту; інакше — прохід по Question.topics цієї частини.
+    """
+    questions = get_session_questions(context)
+    total = len(questions)
+    hi = total if hi is None else min(hi, total)
+    lo = max(0, lo)
+    if not topic or lo >= hi:
+        return []
+
+    if not isinstance(questions, CompiledTest):
+        # старий формат сесії (повна копія питань у user_data)
+        key = topic.strip().lower()
+        return [
+            i for i in range(lo, hi)
+            if isinstance(questions[i].get("topics"), list)
+            and any(isinstance(tp, str) and tp.strip().lower() == key for tp in questions[i]["topics"])
+        ]
+
+    catalog = get_catalog()
+    pool: List[int] = []
+    offset = 0
+    for (json_path, _media), (json_fp, _media_fp), size in zip(
+        questions.parts, questions.version, questions.part_sizes
+    ):
+        start, end = max(lo, offset), min(hi, offset + size)
+        if start < end:
+            indices = catalog.topic_indices(json_path, topic, fingerprint=json_fp)
+            if indices is not None:
+                # індекси відсортовані — зрізаємо діапазон бінарним пошуком
+                j = bisect_left(indices, start - offset)
+                k = bisect_left(indices, end - offset)
+                pool.extend(offset + i for i in indices[j:k])
+            else:
+                pool.extend(i for i in range(start, end) if questions[i].has_topic(topic))
+        offset += size
+    return pool
+
+
 async def reload_current_test_state(context: ContextTypes.DEFAULT_TYPE):
     """
     Перечитує базовий і кастомний JSON поточного тесту, підтягує зображення,
-    оновлює context.user_data['questions'] та ['total_questions'].
+    оновлює context.user_data['test_ref'] та ['total_questions'].
 
     Викликайте перед стартом режимів (навчання/тестування) і після генерації DOCX,
-    щоб RAM-стан завжди відповідав файлам на диску.
+    щоб RAM-стан завжди відповідав файлам на диску. Перекомпіляція відбувається
+    лише якщо файли змінились (див. utils.question).
     """
     test_name = context.user_data.get("current_test")
     test_dir = context.user_data.get("current_test_dir")
@@ -53,49 +223,17 @@ async def reload_current_test_state(context: ContextTypes.DEFAULT_TYPE):
     base_path = _find_json_for_test(test_dir, test_name)
     custom_path = os.path.join(test_dir, f"{test_name} (custom).json")
 
-    base_questions, custom_questions = [], []
+    # для базових зображень беремо теку за фактичною основою імені JSON
+    base_images_dir_name = test_name
+    if base_path:
+        base_images_dir_name = os.path.splitext(os.path.basename(base_path))[0]
 
-    # Читаємо базовий JSON
-    try:
-        if base_path and os.path.exists(base_path):
-            with open(base_path, "r", encoding="utf-8") as f:
-                base_questions = json.load(f) or []
-            if not isinstance(base_questions, list):
-                base_questions = []
-    except Exception as e:
-        logger.warning(f"[RELOAD] base load error: {e}")
+    parts = []
+    if base_path:
+        parts.append((base_path, os.path.join(test_dir, base_images_dir_name)))
+    parts.append((custom_path, os.path.join(test_dir, f"{test_name} (custom)")))
 
-    # Читаємо кастомний JSON
     try:
-        if os.path.exists(custom_path):
-            with open(custom_path, "r", encoding="utf-8") as f:
-                custom_questions = json.load(f) or []
-            if not isinstance(custom_questions, list):
-                custom_questions = []
+        await load_session_test(context, parts)
     except Exception as e:
-        logger.warning(f"[RELOAD] custom load error: {e}")
-
-    # Підтягуємо зображення асинхронно через executor (attach_images — синхронна)
-    loop = asyncio.get_event_loop()
-    try:
-        # для базових зображень беремо теку за фактичною основою імені JSON
-        base_images_dir_name = test_name
-        if base_path:
-            base_images_dir_name = os.path.splitext(os.path.basename(base_path))[0]
-        base_questions = await loop.run_in_executor(
-            None, attach_images, base_questions, os.path.join(test_dir, base_images_dir_name)
-        )
-    except Exception as e:
-        logger.warning(f"[RELOAD] attach base images error: {e}")
-
-    try:
-        custom_questions = await loop.run_in_executor(
-            None, attach_images, custom_questions, os.path.join(test_dir, f"{test_name} (custom)")
-        )
-    except Exception as e:
-        logger.warning(f"[RELOAD] attach custom images error: {e}")
-
-    # Об’єднуємо та оновлюємо RAM-стан
-    questions = (base_questions or []) + (custom_questions or [])
-    context.user_data["questions"] = questions
-    context.user_data["total_questions"] = len(questions)
+        logger.warning(f"[RELOAD] load error: {e}")
@@ -1,110 +1,40 @@
 import os
 import json
-import aiosqlite
 import asyncio
 from datetime import datetime
 from typing import List, Dict, Any, Tuple, Optional
 
+from handlers.db import db
+from handlers.write_behind import create_write_queue
+from handlers.migrations import apply_migrations
+
 # Константи
-DB_FILENAME = os.path.join(os.path.dirname(__file__), "..", "stats.db")
 JSON_BACKUP = os.path.join(os.path.dirname(__file__), "..", "user_stats.json")
 
-# Глобальне асинхронне підключення
-_db_connection: Optional[aiosqlite.Connection] = None
+# True, якщо SQLite зібрана з FTS5 і таблиця search_fts створена (див. handlers/search_index.py)
+SEARCH_FTS_AVAILABLE = False
 
-async def get_db_connection():
-    """Повертає асинхронне підключення до БД"""
-    global _db_connection
-    if _db_connection is None:
-        _db_connection = await aiosqlite.connect(DB_FILENAME)
-        await _db_connection.execute("PRAGMA journal_mode=WAL;")
-        await _db_connection.execute("PRAGMA synchronous=NORMAL;")
-        await _db_connection.execute("PRAGMA foreign_keys=ON;")
-    return _db_connection
+# Записи з гарячого шляху (відповіді, улюблені, file_id) — через write-behind чергу
+_write_queue = create_write_queue(db.transaction)
 
-# ===== Допоміжні утиліти для міграцій =====
+async def flush_pending_writes() -> None:
+    await _write_queue.flush()
 
-async def _column_exists(conn: aiosqlite.Connection, table: str, column: str) -> bool:
-    try:
-        async with conn.execute(f"PRAGMA table_info({table});") as cur:
-            rows = await cur.fetchall()
-            return any(row[1] == column for row in rows)  # row[1] = name
-    except Exception:
-        return False
+async def shutdown_write_queue() -> None:
+    """Злити write-behind чергу (викликається у post_shutdown до закриття БД)."""
+    await _write_queue.shutdown()
 
-async def _ensure_column(conn: aiosqlite.Connection, table: str, column_def_sql: str):
-    """
-    Додає колонку, якщо її немає.
-    column_def_sql: наприклад 'current_streak INTEGER DEFAULT 0'
-    """
-    col_name = column_def_sql.split()[0]
-    exists = await _column_exists(conn, table, col_name)
-    if not exists:
-        try:
-            await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_def_sql};")
-            await conn.commit()
-        except Exception:
-            # Якщо одночасний доступ або стара SQLite без IF NOT EXISTS — ігноруємо
-            pass
+def write_queue_stats() -> Dict[str, Any]:
+    return _write_queue.stats()
 
 # ===== Ініціалізація / Міграції =====
 
 async def init_db():
-    """Асинхронне створення таблиць + міні-міграції"""
-    conn = await get_db_connection()
-
-    # Результати тестів
-    await conn.execute("""
-    CREATE TABLE IF NOT EXISTS user_results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        username TEXT,
-        test_name TEXT NOT NULL,
-        mode TEXT,
-        score INTEGER,
-        total_questions INTEGER,
-        duration REAL,
-        percent REAL,
-        current_streak INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON user_results(user_id);")
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON user_results(created_at DESC);")
-
-    # ⭐ Улюблені питання
-    await conn.execute("""
-    CREATE TABLE IF NOT EXISTS favorites (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        username TEXT,
-        test_name TEXT NOT NULL,
-        q_index INTEGER,
-        question_text TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_fav_user_id ON favorites(user_id);")
-
-    # ❌ Неправильні відповіді (персональні списки помилок по тестах)
-    await conn.execute("""
-    CREATE TABLE IF NOT EXISTS wrong_answers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        test_name TEXT NOT NULL,
-        q_index INTEGER NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        UNIQUE(user_id, test_name, q_index)
-    );
-    """)
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_wrong_user ON wrong_answers(user_id);")
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_wrong_user_test ON wrong_answers(user_id, test_name);")
-
-    await conn.commit()
-
-    # ---------- МІНІ-МІГРАЦІЇ ----------
-    # 1) Додати колонку current_streak у user_results, якщо відсутня
-    await _ensure_column(conn, "user_results", "current_streak INTEGER DEFAULT 0")
+    """Довести схему до актуальної версії (handlers/migrations.py)"""
+    global SEARCH_FTS_AVAILABLE
+    await apply_migrations(db)
+    row = await db.fetchone("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_fts'")
+    SEARCH_FTS_AVAILABLE = row is not None
 
 async def migrate_from_json(json_path=JSON_BACKUP):
     """Асинхронна міграція зі старого JSON (залишаємо як було)"""
@@ -117,9 +47,7 @@ async def migrate_from_json(json_path=JSON_BACKUP):
     except Exception as e:
         return {"migrated": 0, "error": f"cannot read json: {e}"}
 
-    migrated = 0
-    conn = await get_db_connection()
-    
+    rows = []
     for user_key, results in data.items():
         try:
             user_id = int(user_key)
@@ -140,19 +68,25 @@ async def migrate_from_json(json_path=JSON_BACKUP):
                 username = r.get("username") or None
                 created_at = r.get("date") or None
                 current_streak = int(r.get("current_streak", 0))
-
-                await conn.execute("""
-                    INSERT INTO user_results(user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
-                """, (user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak, created_at))
-                migrated += 1
-                if migrated % 100 == 0:
-                    await conn.commit()
+                rows.append((user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak, created_at))
             except Exception as e:
                 print(f"Error migrating record: {e}")
                 continue
+
+    # пачками по 100 у транзакціях писача (під його замком), як і решта записів
+    migrated = 0
+    for start in range(0, len(rows), 100):
+        async with db.transaction() as conn:
+            for row in rows[start:start + 100]:
+                try:
+                    await conn.execute("""
+                        INSERT INTO user_results(user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                    """, row)
+                    migrated += 1
+                except Exception as e:
+                    print(f"Error migrating record: {e}")
     
-    await conn.commit()
     try:
         os.rename(json_path, json_path + ".bak")
     except Exception as e:
@@ -171,9 +105,13 @@ async def save_user_result_db(
     duration: float = None, 
     percent: float = None, 
     username: str = None,
-    current_streak: int = 0
+    current_streak: int = 0,
+    wait: bool = False
 ) -> int:
-    """Зберігає результат тесту"""
+    """
+    Зберігає результат тесту (через write-behind чергу).
+    wait=True — дочекатися запису і повернути id рядка; інакше повертає 0.
+    """
     if percent is None and score is not None and total_questions:
         try:
             percent = (score / total_questions) * 100.0
@@ -181,15 +119,11 @@ async def save_user_result_db(
             percent = None
 
     try:
-        conn = await get_db_connection()
-        cursor = await conn.execute("""
+        fut = _write_queue.enqueue("""
             INSERT INTO user_results(user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak))
-        
-        last_id = cursor.lastrowid
-        await conn.commit()
-        return last_id
+        """, (user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak), want_result=wait)
+        return (await fut) if fut is not None else 0
     except Exception as e:
         print(f"Error saving user result: {e}")
         return -1
@@ -197,31 +131,30 @@ async def save_user_result_db(
 async def get_user_results(user_id: int, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
     """Отримати результати користувача"""
     try:
-        conn = await get_db_connection()
-        async with conn.execute("""
+        await _write_queue.flush()
+        rows = await db.fetchall("""
             SELECT id, user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak, created_at
             FROM user_results
             WHERE user_id = ?
             ORDER BY created_at DESC, id DESC
             LIMIT ? OFFSET ?
-        """, (user_id, limit, offset)) as cursor:
-            rows = await cursor.fetchall()
-            return [
-                {
-                    "id": row[0],
-                    "user_id": row[1],
-                    "username": row[2],
-                    "test_name": row[3],
-                    "mode": row[4],
-                    "score": row[5],
-                    "total_questions": row[6],
-                    "duration": row[7],
-                    "percent": row[8],
-                    "current_streak": row[9],
-                    "created_at": row[10]
-                }
-                for row in rows
-            ]
+        """, (user_id, limit, offset))
+        return [
+            {
+                "id": row[0],
+                "user_id": row[1],
+                "username": row[2],
+                "test_name": row[3],
+                "mode": row[4],
+                "score": row[5],
+                "total_questions": row[6],
+                "duration": row[7],
+                "percent": row[8],
+                "current_streak": row[9],
+                "created_at": row[10]
+            }
+            for row in rows
+        ]
     except Exception as e:
         print(f"Error getting user results: {e}")
         return []
@@ -229,73 +162,163 @@ async def get_user_results(user_id: int, limit: int = 50, offset: int = 0) -> Li
 async def get_latest_results(limit: int = 100) -> List[Dict[str, Any]]:
     """Отримати останні результати всіх"""
     try:
-        conn = await get_db_connection()
-        async with conn.execute("""
+        await _write_queue.flush()
+        rows = await db.fetchall("""
             SELECT id, user_id, username, test_name, mode, score, total_questions, duration, percent, current_streak, created_at
             FROM user_results
             ORDER BY created_at DESC, id DESC
             LIMIT ?
-        """, (limit,)) as cursor:
-            rows = await cursor.fetchall()
-            return [
-                {
-                    "id": row[0],
-                    "user_id": row[1],
-                    "username": row[2],
-                    "test_name": row[3],
-                    "mode": row[4],
-                    "score": row[5],
-                    "total_questions": row[6],
-                    "duration": row[7],
-                    "percent": row[8],
-                    "current_streak": row[9],
-                    "created_at": row[10]
-                }
-                for row in rows
-            ]
+        """, (limit,))
+        return [
+            {
+                "id": row[0],
+                "user_id": row[1],
+                "username": row[2],
+                "test_name": row[3],
+                "mode": row[4],
+                "score": row[5],
+                "total_questions": row[6],
+                "duration": row[7],
+                "percent": row[8],
+                "current_streak": row[9],
+                "created_at": row[10]
+            }
+            for row in rows
+        ]
     except Exception as e:
         print(f"Error getting latest results: {e}")
         return []
 
+# ===== 📊 Агрегати (user_stats / user_test_stats, оновлюються тригером) =====
+
+async def get_user_totals(user_id: int) -> Optional[Dict[str, Any]]:
+    """Підсумки користувача за весь час (None — ще немає жодного результату)"""
+    try:
+        await _write_queue.flush()
+        row = await db.fetchone("""
+            SELECT username, attempts, total_score, total_questions, sum_percent, best_percent,
+                   best_streak, last_test, last_percent, last_at,
+                   (SELECT COUNT(*) FROM user_test_stats WHERE user_id = s.user_id)
+            FROM user_stats s
+            WHERE user_id = ?
+        """, (user_id,))
+        if not row:
+            return None
+        attempts = row[1] or 0
+        return {
+            "username": row[0],
+            "attempts": attempts,
+            "total_score": row[2],
+            "total_questions": row[3],
+            "avg_percent": (row[4] / attempts) if attempts else 0.0,
+            "best_percent": row[5],
+            "best_streak": row[6],
+            "last_test": row[7],
+            "last_percent": row[8],
+            "last_at": row[9],
+            "tests": row[10],
+        }
+    except Exception as e:
+        print(f"Error getting user totals: {e}")
+        return None
+
+async def get_user_test_stats(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    """Підсумки користувача по тестах (спершу нещодавні)"""
+    try:
+        await _write_queue.flush()
+        rows = await db.fetchall("""
+            SELECT test_name, attempts, best_score, best_percent, sum_percent, best_streak, last_percent, last_at
+            FROM user_test_stats
+            WHERE user_id = ?
+            ORDER BY last_at DESC
+            LIMIT ?
+        """, (user_id, limit))
+        return [
+            {
+                "test_name": row[0],
+                "attempts": row[1],
+                "best_score": row[2],
+                "best_percent": row[3],
+                "avg_percent": (row[4] / row[1]) if row[1] else 0.0,
+                "best_streak": row[5],
+                "last_percent": row[6],
+                "last_at": row[7],
+            }
+            for row in rows
+        ]
+    except Exception as e:
+        print(f"Error getting user test stats: {e}")
+        return []
+
+async def get_test_leaderboard(test_name: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Рейтинг тесту: найкращий відсоток, за рівності — менше спроб"""
+    try:
+        await _write_queue.flush()
+        rows = await db.fetchall("""
+            SELECT t.user_id, s.username, t.best_percent, t.best_score, t.attempts
+            FROM user_test_stats t
+            LEFT JOIN user_stats s ON s.user_id = t.user_id
+            WHERE t.test_name = ?
+            ORDER BY t.best_percent DESC, t.attempts
+            LIMIT ?
+        """, (test_name, limit))
+        return [
+            {"user_id": row[0], "username": row[1], "best_percent": row[2], "best_score": row[3], "attempts": row[4]}
+            for row in rows
+        ]
+    except Exception as e:
+        print(f"Error getting leaderboard: {e}")
+        return []
+
+async def get_user_test_rank(user_id: int, test_name: str) -> Optional[Tuple[int, int]]:
+    """(місце, учасників) користувача в рейтингу тесту; None — не проходив"""
+    try:
+        await _write_queue.flush()
+        row = await db.fetchone("""
+            SELECT
+                (SELECT COUNT(*) FROM user_test_stats o
+                 WHERE o.test_name = t.test_name
+                   AND (o.best_percent > t.best_percent
+                        OR (o.best_percent = t.best_percent AND o.attempts < t.attempts))) + 1,
+                (SELECT COUNT(*) FROM user_test_stats o WHERE o.test_name = t.test_name)
+            FROM user_test_stats t
+            WHERE t.user_id = ? AND t.test_name = ?
+        """, (user_id, test_name))
+        return (row[0], row[1]) if row else None
+    except Exception as e:
+        print(f"Error getting user rank: {e}")
+        return None
+
 # ===== ⭐ Favorites =====
 
 async def save_favorite_db(user_id: int, username: str, test_name: str, q_index: int, question_text: str):
     """Зберегти улюблене питання (із захистом від дублікатів)"""
     try:
-        conn = await get_db_connection()
-        # Перевірка на дубль
-        async with conn.execute("""
-            SELECT 1 FROM favorites WHERE user_id=? AND test_name=? AND q_index=? LIMIT 1
-        """, (user_id, test_name, q_index)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return  # вже існує
-
-        await conn.execute("""
+        # Перевірка на дубль — у тому ж операторі (черга виконує його пізніше)
+        _write_queue.enqueue("""
             INSERT INTO favorites(user_id, username, test_name, q_index, question_text)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, username, test_name, q_index, question_text))
-        await conn.commit()
+            SELECT ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM favorites WHERE user_id=? AND test_name=? AND q_index=?
+            )
+        """, (user_id, username, test_name, q_index, question_text, user_id, test_name, q_index))
     except Exception as e:
         print(f"Error saving favorite: {e}")
 
 async def delete_favorite_db(user_id: int, test_name: str, q_index: int):
     """Видалити питання з улюблених"""
     try:
-        conn = await get_db_connection()
-        await conn.execute("""
+        _write_queue.enqueue("""
             DELETE FROM favorites WHERE user_id=? AND test_name=? AND q_index=?
         """, (user_id, test_name, q_index))
-        await conn.commit()
     except Exception as e:
         print(f"Error deleting favorite: {e}")
 
 async def delete_all_favorites(user_id: int) -> int:
     """Видалити ВСІ улюблені питання користувача (по всіх тестах). Повертає кількість видалених рядків."""
     try:
-        conn = await get_db_connection()
-        cursor = await conn.execute("DELETE FROM favorites WHERE user_id=?", (user_id,))
-        await conn.commit()
+        await _write_queue.flush()
+        cursor = await db.execute("DELETE FROM favorites WHERE user_id=?", (user_id,))
         count = cursor.rowcount if cursor and cursor.rowcount is not None else 0
         return max(count, 0)
     except Exception as e:
@@ -305,25 +328,24 @@ async def delete_all_favorites(user_id: int) -> int:
 async def get_user_favorites(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
     """Отримати улюблені питання користувача (усі тести)"""
     try:
-        conn = await get_db_connection()
-        async with conn.execute("""
+        await _write_queue.flush()
+        rows = await db.fetchall("""
             SELECT id, test_name, q_index, question_text, created_at
             FROM favorites
             WHERE user_id = ?
             ORDER BY created_at DESC
             LIMIT ?
-        """, (user_id, limit)) as cursor:
-            rows = await cursor.fetchall()
-            return [
-                {
-                    "id": row[0],
-                    "test_name": row[1],
-                    "q_index": row[2],
-                    "question": row[3],
-                    "created_at": row[4]
-                }
-                for row in rows
-            ]
+        """, (user_id, limit))
+        return [
+            {
+                "id": row[0],
+                "test_name": row[1],
+                "q_index": row[2],
+                "question": row[3],
+                "created_at": row[4]
+            }
+            for row in rows
+        ]
     except Exception as e:
         print(f"Error getting favorites: {e}")
         return []
@@ -331,25 +353,24 @@ async def get_user_favorites(user_id: int, limit: int = 20) -> List[Dict[str, An
 async def get_user_favorites_by_test(user_id: int, test_name: str, limit: int = 10000) -> List[Dict[str, Any]]:
     """Отримати улюблені питання користувача конкретного тесту"""
     try:
-        conn = await get_db_connection()
-        async with conn.execute("""
+        await _write_queue.flush()
+        rows = await db.fetchall("""
             SELECT id, test_name, q_index, question_text, created_at
             FROM favorites
             WHERE user_id = ? AND test_name = ?
             ORDER BY created_at DESC
             LIMIT ?
-        """, (user_id, test_name, limit)) as cursor:
-            rows = await cursor.fetchall()
-            return [
-                {
-                    "id": row[0],
-                    "test_name": row[1],
-                    "q_index": row[2],
-                    "question": row[3],
-                    "created_at": row[4]
-                }
-                for row in rows
-            ]
+        """, (user_id, test_name, limit))
+        return [
+            {
+                "id": row[0],
+                "test_name": row[1],
+                "q_index": row[2],
+                "question": row[3],
+                "created_at": row[4]
+            }
+            for row in rows
+        ]
     except Exception as e:
         print(f"Error getting favorites by test: {e}")
         return []
@@ -357,16 +378,15 @@ async def get_user_favorites_by_test(user_id: int, test_name: str, limit: int =
 async def get_favorite_counts_by_test(user_id: int) -> List[Dict[str, Any]]:
     """Повертає кількість улюблених по кожному тесту для користувача"""
     try:
-        conn = await get_db_connection()
-        async with conn.execute("""
+        await _write_queue.flush()
+        rows = await db.fetchall("""
             SELECT test_name, COUNT(*) as cnt
             FROM favorites
             WHERE user_id = ?
             GROUP BY test_name
             ORDER BY test_name
-        """, (user_id,)) as cursor:
-            rows = await cursor.fetchall()
-            return [{"test_name": row[0], "count": row[1]} for row in rows]
+        """, (user_id,))
+        return [{"test_name": row[0], "count": row[1]} for row in rows]
     except Exception as e:
         print(f"Error getting favorite counts: {e}")
         return []
@@ -379,12 +399,10 @@ async def add_wrong_answer(user_id: int, test_name: str, q_index: int) -> None:
     Унікальність на (user_id, test_name, q_index) — дублікати ігноруються.
     """
     try:
-        conn = await get_db_connection()
-        await conn.execute("""
+        _write_queue.enqueue("""
             INSERT OR IGNORE INTO wrong_answers(user_id, test_name, q_index)
             VALUES (?, ?, ?)
         """, (user_id, test_name, q_index))
-        await conn.commit()
     except Exception as e:
         print(f"Error adding wrong answer: {e}")
 
@@ -393,16 +411,15 @@ async def get_wrong_counts_by_test(user_id: int) -> List[Dict[str, Any]]:
     Повертає [{'test_name': str, 'count': int}, ...] — скільки помилкових питань у кожному тесті.
     """
     try:
-        conn = await get_db_connection()
-        async with conn.execute("""
+        await _write_queue.flush()
+        rows = await db.fetchall("""
             SELECT test_name, COUNT(*) AS cnt
             FROM wrong_answers
             WHERE user_id = ?
             GROUP BY test_name
             ORDER BY test_name
-        """, (user_id,)) as cur:
-            rows = await cur.fetchall()
-            return [{"test_name": r[0], "count": r[1]} for r in rows]
+        """, (user_id,))
+        return [{"test_name": r[0], "count": r[1]} for r in rows]
     except Exception as e:
         print(f"Error getting wrong counts: {e}")
         return []
@@ -410,15 +427,14 @@ async def get_wrong_counts_by_test(user_id: int) -> List[Dict[str, Any]]:
 async def get_wrong_indices_by_test(user_id: int, test_name: str) -> List[int]:
     """Повертає відсортований список індексів питань зі списку помилок для вказаного тесту."""
     try:
-        conn = await get_db_connection()
-        async with conn.execute("""
+        await _write_queue.flush()
+        rows = await db.fetchall("""
             SELECT q_index
             FROM wrong_answers
             WHERE user_id = ? AND test_name = ?
             ORDER BY q_index
-        """, (user_id, test_name)) as cur:
-            rows = await cur.fetchall()
-            return [r[0] for r in rows]
+        """, (user_id, test_name))
+        return [r[0] for r in rows]
     except Exception as e:
         print(f"Error getting wrong indices by test: {e}")
         return []
@@ -426,17 +442,165 @@ async def get_wrong_indices_by_test(user_id: int, test_name: str) -> List[int]:
 async def clear_wrong_for_test(user_id: int, test_name: str) -> int:
     """Видалити всі записи помилок користувача для конкретного тесту. Повертає кількість видалених рядків."""
     try:
-        conn = await get_db_connection()
-        cur = await conn.execute("""
+        await _write_queue.flush()
+        cur = await db.execute("""
             DELETE FROM wrong_answers
             WHERE user_id = ? AND test_name = ?
         """, (user_id, test_name))
-        await conn.commit()
         return cur.rowcount or 0
     except Exception as e:
         print(f"Error clearing wrong answers: {e}")
         return 0
 
+# ===== 📝 Журнал відповідей (для аналітики складності питань) =====
+
+async def add_answer_event(
+    user_id: Optional[int],
+    test_name: str,
+    q_index: int,
+    chosen: Optional[int],
+    correct: bool,
+    latency_ms: Optional[int] = None,
+) -> None:
+    """Дописати подію відповіді (через write-behind чергу; агрегує handlers/answer_analytics.py)"""
+    try:
+        _write_queue.enqueue("""
+            INSERT INTO answer_events(user_id, test_name, q_index, chosen, correct, latency_ms)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, test_name, q_index, chosen, 1 if correct else 0, latency_ms))
+    except Exception as e:
+        print(f"Error adding answer event: {e}")
+
+# ===== 💬 Коментарі до питань =====
+
+async def add_comment_db(test_name: str, q_index: int, user_id: Optional[int], username: Optional[str],
+                         text: str, created_at: Optional[str] = None) -> bool:
+    """Додати коментар одразу, власною транзакцією (текст користувача — не через write-behind). False — не збережено"""
+    try:
+        await db.execute("""
+            INSERT INTO comments(test_name, q_index, user_id, username, text, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (test_name, q_index, user_id, username, text, created_at))
+        return True
+    except Exception as e:
+        print(f"Error adding comment: {e}")
+        return False
+
+async def import_comments_db(rows: List[Tuple[str, int, Optional[int], Optional[str], str, Optional[str]]]) -> int:
+    """Масово імпортувати коментарі (test_name, q_index, user_id, username, text, created_at) однією транзакцією"""
+    if not rows:
+        return 0
+    await _write_queue.flush()
+    async with db.transaction() as conn:
+        await conn.executemany("""
+            INSERT INTO comments(test_name, q_index, user_id, username, text, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+    return len(rows)
+
+async def get_comments_db(test_name: str, q_index: int) -> List[Dict[str, Any]]:
+    """Коментарі до питання (у порядку додавання)"""
+    try:
+        await _write_queue.flush()
+        rows = await db.fetchall("""
+            SELECT user_id, username, text, created_at
+            FROM comments
+            WHERE test_name = ? AND q_index = ?
+            ORDER BY id
+        """, (test_name, q_index))
+        return [{"user_id": row[0], "username": row[1], "text": row[2], "ts": row[3]} for row in rows]
+    except Exception as e:
+        print(f"Error getting comments: {e}")
+        return []
+
+async def get_comment_counts_db(test_name: str) -> Dict[int, int]:
+    """{q_index: кількість коментарів} для тесту"""
+    try:
+        await _write_queue.flush()
+        rows = await db.fetchall("""
+            SELECT q_index, COUNT(*) FROM comments
+            WHERE test_name = ?
+            GROUP BY q_index
+        """, (test_name,))
+        return {row[0]: row[1] for row in rows}
+    except Exception as e:
+        print(f"Error getting comment counts: {e}")
+        return {}
+
+# ===== 💾 Сесії квізу (handlers/persistence.py) =====
+
+async def save_session_db(user_id: int, test_ref: str, content_hash: Optional[str], order_blob: bytes,
+                          step: int, score: int, wrong_blob: bytes, meta: str) -> None:
+    """Зберегти/оновити сесію користувача (через write-behind чергу)"""
+    try:
+        _write_queue.enqueue("""
+            INSERT INTO user_sessions(user_id, test_ref, content_hash, order_blob, step, score, wrong_blob, meta, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                test_ref = excluded.test_ref, content_hash = excluded.content_hash,
+                order_blob = excluded.order_blob, step = excluded.step, score = excluded.score,
+                wrong_blob = excluded.wrong_blob, meta = excluded.meta, updated_at = CURRENT_TIMESTAMP
+        """, (user_id, test_ref, content_hash, order_blob, step, score, wrong_blob, meta))
+    except Exception as e:
+        print(f"Error saving session: {e}")
+
+async def delete_session_db(user_id: int) -> None:
+    try:
+        _write_queue.enqueue("DELETE FROM user_sessions WHERE user_id = ?", (user_id,))
+    except Exception as e:
+        print(f"Error deleting session: {e}")
+
+async def load_sessions_db() -> List[tuple]:
+    """Усі збережені сесії: (user_id, test_ref, content_hash, order_blob, step, score, wrong_blob, meta)"""
+    try:
+        await _write_queue.flush()
+        return await db.fetchall("""
+            SELECT user_id, test_ref, content_hash, order_blob, step, score, wrong_blob, meta
+            FROM user_sessions
+        """)
+    except Exception as e:
+        print(f"Error loading sessions: {e}")
+        return []
+
+# ===== 📎 Media registry (file_id) =====
+
+async def get_media_file_id(path: str, kind: str, size: int, mtime: float) -> Optional[str]:
+    """
+    Повертає збережений file_id для файла, якщо розмір і mtime збігаються з записаними.
+    Якщо файл змінився — запис вважається недійсним (повертаємо None).
+    """
+    try:
+        row = await db.fetchone("""
+            SELECT file_id FROM media_registry
+            WHERE path = ? AND kind = ? AND size = ? AND mtime = ?
+        """, (path, kind, size, mtime))
+        return row[0] if row else None
+    except Exception as e:
+        print(f"Error getting media file_id: {e}")
+        return None
+
+async def save_media_file_id(path: str, kind: str, size: int, mtime: float, file_id: str) -> None:
+    """Зберегти/оновити file_id для (path, kind) разом з відбитком файла."""
+    try:
+        _write_queue.enqueue("""
+            INSERT INTO media_registry(path, kind, size, mtime, file_id)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(path, kind) DO UPDATE SET
+                size = excluded.size,
+                mtime = excluded.mtime,
+                file_id = excluded.file_id,
+                updated_at = CURRENT_TIMESTAMP
+        """, (path, kind, size, mtime, file_id))
+    except Exception as e:
+        print(f"Error saving media file_id: {e}")
+
+async def delete_media_file_id(path: str, kind: str) -> None:
+    """Прибрати file_id (наприклад, якщо Telegram його більше не приймає)."""
+    try:
+        _write_queue.enqueue("DELETE FROM media_registry WHERE path = ? AND kind = ?", (path, kind))
+    except Exception as e:
+        print(f"Error deleting media file_id: {e}")
+
 # ===== Очищення всієї статистики =====
 
 async def delete_all_results(user_id: int) -> int:
@@ -445,9 +609,11 @@ async def delete_all_results(user_id: int) -> int:
     Повертає кількість видалених рядків.
     """
     try:
-        conn = await get_db_connection()
-        cursor = await conn.execute("DELETE FROM user_results WHERE user_id=?", (user_id,))
-        await conn.commit()
+        await _write_queue.flush()
+        async with db.transaction() as conn:
+            cursor = await conn.execute("DELETE FROM user_results WHERE user_id=?", (user_id,))
+            await conn.execute("DELETE FROM user_test_stats WHERE user_id=?", (user_id,))
+            await conn.execute("DELETE FROM user_stats WHERE user_id=?", (user_id,))
         count = cursor.rowcount if cursor and cursor.rowcount is not None else 0
         return max(count, 0)
     except Exception as e:
@@ -457,16 +623,15 @@ async def delete_all_results(user_id: int) -> int:
 # ===== Закриття / Ініціалізація =====
 
 async def close_db_connection():
-    """Закрити з’єднання з БД"""
-    global _db_connection
-    if _db_connection:
-        await _db_connection.close()
-        _db_connection = None
+    """Закрити з’єднання з БД (спершу зливаємо write-behind чергу)"""
+    await _write_queue.shutdown()
+    await db.close()
 
 async def initialize_database():
     """Ініціалізація БД при запуску бота"""
+    # помилка міграції схеми не ковтається: бот не стартує на напівоновленій БД
+    await init_db()
     try:
-        await init_db()
         if os.path.exists(JSON_BACKUP):
             result = await migrate_from_json(JSON_BACKUP)
             print(f"Migrated {result.get('migrated', 0)} records from JSON")
@@ -1,11 +1,11 @@
 import os
-import asyncio
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
 from utils.keyboards import tests_menu, main_menu, browse_menu, add_cancel_kb
 from utils.i18n import t
-from utils.loader import attach_images, discover_tests_hierarchy, build_listing_for_path, discover_tests
+from utils.loader import discover_tests_hierarchy, build_listing_for_path, load_catalog_and_tree
+from handlers.state_sync import load_session_test
 from handlers.statistics_db import get_user_favorites_by_test
 
 logger = logging.getLogger("test_bot")
@@ -70,8 +70,9 @@ _RESERVED_INPUTS = {
 # ---- refresh & tree helpers ----
 
 async def _refresh_catalogs(context: ContextTypes.DEFAULT_TYPE):
-    context.bot_data["tests_catalog"] = discover_tests("tests")
-    context.bot_data["tests_tree"] = discover_tests_hierarchy("tests")
+    catalog, tree = load_catalog_and_tree("tests")
+    context.bot_data["tests_catalog"] = catalog
+    context.bot_data["tests_tree"] = tree
 
 async def _send_browse_node_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
     """Відправити повідомлення з поточним вузлом дерева за user_data['browse_path']"""
@@ -297,20 +298,14 @@ async def handle_test_selection(update: Update, context: ContextTypes.DEFAULT_TY
 
     entry = catalog[text]
 
-    # Завантажуємо зображення (як і було)
-    try:
-        logger.info(f"[TEST_SELECT] Loading images for test: {text}")
-        loop = asyncio.get_event_loop()
-        questions = await loop.run_in_executor(None, attach_images, entry["questions"], entry.get("images_dir"))
-        logger.info(f"[TEST_SELECT] Images attached: {len(questions)} questions")
-    except Exception as e:
-        logger.error(f"[TEST_SELECT] Error attaching images: {e}")
-        questions = entry["questions"]
+    # Скомпільований тест (питання + медіа) — спільний для всіх сесій;
+    # у user_data лише посилання на нього
+    logger.info(f"[TEST_SELECT] Loading test: {text}")
+    compiled = await load_session_test(context, [(entry.get("json_path"), entry.get("images_dir"))])
+    logger.info(f"[TEST_SELECT] Test ready: {len(compiled)} questions")
 
     context.user_data["current_test"] = text
     context.user_data["current_test_dir"] = entry.get("dir")
-    context.user_data["questions"] = questions
-    context.user_data["total_questions"] = entry["total"]
 
     # скидаємо можливі флаги пошуку/створення
     for k in ("awaiting_search", "search_mode", "awaiting_new_folder", "awaiting_new_test"):
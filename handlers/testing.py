@@ -1,22 +1,22 @@
 import os
-import io
 import random
+import asyncio
 import logging
-import base64
 import re
 from datetime import datetime
 from typing import Optional, Tuple, Any, List
 
 from telegram import (
     Update,
-    InputMediaPhoto,
-    InputMediaVideo,
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaAnimation,
+    InputFile,
 )
 from telegram.ext import ContextTypes
 
+from handlers.media_registry import PLACEHOLDER_KEY, PLACEHOLDER_PNG, LOOKUP, deliver, lookup_file_id
+from handlers.prefetch import PreparedMedia, store_prepared, take_prepared, note_failed
+from handlers.message_state import remember_sent, update_question_media, update_question_caption
+from handlers.rate_limiter import bulk_sends
+from utils.media_reader import open_upload, preload, cached
 from utils.keyboards import (
     build_options_markup,
     get_progress_bar,
@@ -25,6 +25,7 @@ from utils.keyboards import (
     learning_range_keyboard,
 )
 from utils.formatting import format_question_text
+from utils.render_cache import cached_caption, question_key
 from handlers.statistics_db import save_user_result_db
 from utils.i18n import t
 
@@ -32,7 +33,12 @@ from utils.keyboards import browse_menu
 from utils.loader import discover_tests_hierarchy, build_listing_for_path
 
 from handlers.office import office_buttons_handler
-from handlers.statistics_db import add_wrong_answer
+from handlers.statistics_db import add_wrong_answer, add_answer_event
+from handlers.state_sync import get_session_questions, session_topic_pool
+from utils.question import Question, correct_index
+from handlers.callback_pipeline import answer_once, fast_ack_callback
+from handlers.comments import get_comments_count
+from handlers.quiz_session import QuizSession, get_session, end_session
 
 logger = logging.getLogger("test_bot.testing")
 
@@ -61,35 +67,30 @@ def _get_user_from_source(src: Any):
         return getattr(u, "id", None), getattr(u, "username", None)
     return None, None
 
+_QUESTION_MEDIA_TYPES = {"image": "photo", "video": "video", "audio": "audio", "document": "doc"}
+
 def _detect_media(q: dict, base_dir: Optional[str]) -> Tuple[str, Optional[str]]:
     path = None
     mtype = "none"
-    for key, t in (("image", "photo"), ("photo", "photo"),
-                   ("video", "video"), ("audio", "audio"),
-                   ("document", "doc"), ("doc", "doc")):
-        p = q.get(key)
-        if p:
-            path = p
-            mtype = t
-            break
+    if isinstance(q, Question):
+        # медіа вже знайдене при компіляції тесту
+        if q.media_path:
+            path, mtype = q.media_path, _QUESTION_MEDIA_TYPES[q.media_kind]
+    else:
+        for key, t in (("image", "photo"), ("photo", "photo"),
+                       ("video", "video"), ("audio", "audio"),
+                       ("document", "doc"), ("doc", "doc")):
+            p = q.get(key)
+            if p:
+                path = p
+                mtype = t
+                break
     if not path:
         return "none", None
     if base_dir and not os.path.isabs(path):
         return mtype, os.path.join(base_dir, path)
     return mtype, path
 
-def _placeholder_png_bytes() -> bytes:
-    b64 = (
-        b'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAA'
-        b'AAC0lEQVR42mP8/x8AAwMCAO+XU2sAAAAASUVORK5CYII='
-    )
-    return base64.b64decode(b64)
-
-def _bio_with_name(data: bytes, filename: str) -> io.BytesIO:
-    bio = io.BytesIO(data)
-    bio.name = filename
-    return bio
-
 # --- «Повітря» та відступи ---
 
 def _ensure_question_answers_gap(body: str) -> str:
@@ -159,33 +160,43 @@ def _compose_caption_testing(
     step_idx: int,
     total_in_session: int,
     highlight: Optional[Tuple[int, bool]] = None,
-    hide_correct_on_wrong: bool = True
+    hide_correct_on_wrong: bool = True,
+    qkey: Optional[tuple] = None,
 ) -> str:
+    """qkey — question_key() питання; тіло підпису береться з кешу рендеру."""
     bar = get_progress_bar(step_idx + 1, total_in_session)
     progress = f"{step_idx + 1}/{total_in_session}"
-    body = format_question_text(
-        q, highlight=highlight, hide_correct_on_wrong=hide_correct_on_wrong, mode="testing"
+    body = cached_caption(
+        qkey and qkey + ("testing", highlight, hide_correct_on_wrong),
+        lambda: _with_spacing(format_question_text(
+            q, highlight=highlight, hide_correct_on_wrong=hide_correct_on_wrong, mode="testing"
+        )),
     )
-    body = _with_spacing(body)
     return f"{bar}\n{progress}\n\n{body}"
 
 def _compose_caption_learning(
     q: dict,
     step_idx: int,
     total_in_session: int,
-    highlight: Optional[Tuple[int, bool]] = None
+    highlight: Optional[Tuple[int, bool]] = None,
+    qkey: Optional[tuple] = None,
 ) -> str:
     bar = get_progress_bar(step_idx + 1, total_in_session)
-    body = format_question_text(
-        q, highlight=highlight, hide_correct_on_wrong=False, mode="learning"
+    body = cached_caption(
+        qkey and qkey + ("learning", highlight),
+        lambda: _with_spacing(format_question_text(
+            q, highlight=highlight, hide_correct_on_wrong=False, mode="learning"
+        )),
     )
-    body = _with_spacing(body)
     return f"{bar}\n\n{body}"
 
-def _open_media_bio(path: str, filename: str) -> io.BytesIO:
-    with open(path, "rb") as f:
-        data = f.read()
-    return _bio_with_name(data, filename)
+async def _open_media_upload(path: str, filename: str, prepared: Optional[PreparedMedia] = None,
+                             attach: bool = False) -> InputFile:
+    """InputFile для аплоаду; читання файла — у пулі utils.media_reader, не в циклі подій."""
+    if path == PLACEHOLDER_KEY:
+        return InputFile(PLACEHOLDER_PNG, filename=filename, attach=attach)
+    data = cached(prepared.data_key) if prepared else None
+    return await open_upload(path, filename, data, attach=attach)
 
 def _decide_inline_kind_and_filename(media_type: str, media_path: str) -> Tuple[str, str]:
     base = os.path.basename(media_path)
@@ -210,86 +221,95 @@ def _decide_inline_kind_and_filename(media_type: str, media_path: str) -> Tuple[
 
     return "document", f"{stem or 'file'}{ext_low or '.bin'}"
 
-def _build_input_media(media_type: str, media_path: str, caption: str):
-    kind, fname = _decide_inline_kind_and_filename(media_type, media_path)
-    try:
-        if kind == "photo":
-            return InputMediaPhoto(media=_open_media_bio(media_path, fname), caption=caption, parse_mode="HTML")
-        if kind == "animation":
-            return InputMediaAnimation(media=_open_media_bio(media_path, fname), caption=caption, parse_mode="HTML")
-        if kind == "video":
-            return InputMediaVideo(media=_open_media_bio(media_path, fname), caption=caption, parse_mode="HTML")
-        if kind == "audio":
-            return InputMediaAudio(media=_open_media_bio(media_path, fname), caption=caption, parse_mode="HTML")
-        return InputMediaDocument(media=_open_media_bio(media_path, fname), caption=caption, parse_mode="HTML")
-    except Exception as e:
-        logger.warning("[TESTING] _build_input_media failed: %s", e)
-    return None
+def _media_target(media_type: str, media_path: Optional[str]) -> Tuple[str, str, str]:
+    """
+    (kind, key, filename) для відправки. Питання без медіа (або з відсутнім файлом)
+    показуємо плейсхолдером — його key спільний для всіх, тож file_id теж один.
+    """
+    if media_type != "none" and media_path and os.path.exists(media_path):
+        kind, fname = _decide_inline_kind_and_filename(media_type, media_path)
+        return kind, media_path, fname
+    return "photo", PLACEHOLDER_KEY, "q.png"
+
+_SEND_METHODS = {
+    "photo": ("send_photo", "photo"),
+    "animation": ("send_animation", "animation"),
+    "video": ("send_video", "video"),
+    "audio": ("send_audio", "audio"),
+    "document": ("send_document", "document"),
+}
+
+def _has_media(message) -> bool:
+    return bool(
+        getattr(message, "photo", None) or getattr(message, "video", None)
+        or getattr(message, "audio", None) or getattr(message, "document", None)
+        or getattr(message, "animation", None)
+    )
 
 # ========= Рендер питання =========
 
-async def _send_new_question_message(chat_id: int, bot, media_type: str, media_path: Optional[str], caption: str, kb):
-    sent = None
+def _target(media_type: str, media_path: Optional[str], prepared: Optional[PreparedMedia]) -> Tuple[str, str, str]:
+    if prepared is not None:
+        return prepared.kind, prepared.key, prepared.filename
+    return _media_target(media_type, media_path)
+
+async def _send_new_question_message(chat_id: int, bot, media_type: str, media_path: Optional[str], caption: str, kb,
+                                     prepared: Optional[PreparedMedia] = None, chat_data=None):
+    kind, key, fname = _target(media_type, media_path, prepared)
+    method, field = _SEND_METHODS.get(kind, _SEND_METHODS["document"])
+    send = getattr(bot, method)
+
+    async def _send(media):
+        return await send(chat_id=chat_id, caption=caption, reply_markup=kb, parse_mode="HTML", **{field: media})
+
+    async def _upload():
+        return await _open_media_upload(key, fname, prepared)
+
     try:
-        if media_type != "none" and media_path and os.path.exists(media_path):
-            kind, fname = _decide_inline_kind_and_filename(media_type, media_path)
-            with open(media_path, "rb") as f:
-                bio = _bio_with_name(f.read(), fname)
-            if kind == "photo":
-                sent = await bot.send_photo(chat_id=chat_id, photo=bio, caption=caption, reply_markup=kb, parse_mode="HTML")
-            elif kind == "animation":
-                sent = await bot.send_animation(chat_id=chat_id, animation=bio, caption=caption, reply_markup=kb, parse_mode="HTML")
-            elif kind == "video":
-                sent = await bot.send_video(chat_id=chat_id, video=bio, caption=caption, reply_markup=kb, parse_mode="HTML")
-            elif kind == "audio":
-                sent = await bot.send_audio(chat_id=chat_id, audio=bio, caption=caption, reply_markup=kb, parse_mode="HTML")
-            else:
-                sent = await bot.send_document(chat_id=chat_id, document=bio, caption=caption, reply_markup=kb, parse_mode="HTML")
-        else:
-            ph = _bio_with_name(_placeholder_png_bytes(), "q.png")
-            sent = await bot.send_photo(chat_id=chat_id, photo=ph, caption=caption, reply_markup=kb, parse_mode="HTML")
+        sent = await deliver(key, kind, _send, _upload, prepared.file_id if prepared else LOOKUP)
+        remember_sent(chat_data, sent, kind, key, caption, kb)
+        return sent
     except Exception as e:
         logger.exception("[TESTING] send new message failed: %s", e)
-        sent = await bot.send_message(chat_id=chat_id, text=caption, reply_markup=kb, parse_mode="HTML")
-    return sent
+        return await bot.send_message(chat_id=chat_id, text=caption, reply_markup=kb, parse_mode="HTML")
 
-async def _render_question_on_existing_message(message, media_type: str, media_path: Optional[str], caption: str, kb) -> bool:
-    try:
-        if media_type == "none":
-            if getattr(message, "caption", None) is not None or getattr(message, "photo", None) or getattr(message, "video", None) or getattr(message, "audio", None) or getattr(message, "document", None):
-                ph = _bio_with_name(_placeholder_png_bytes(), "q.png")
-                im = InputMediaPhoto(media=ph, caption=caption, parse_mode="HTML")
-                await message.edit_media(media=im, reply_markup=kb)
-                return True
-            return False
-
-        if not media_path or not os.path.exists(media_path):
-            return False
-
-        im = _build_input_media(media_type, media_path, caption)
-        if im is None:
-            return False
-
-        await message.edit_media(media=im, reply_markup=kb)
-        return True
-    except Exception as e:
-        logger.warning("[TESTING] render on existing message failed: %s", e)
+async def _render_question_on_existing_message(message, media_type: str, media_path: Optional[str], caption: str, kb,
+                                               prepared: Optional[PreparedMedia] = None, chat_data=None) -> bool:
+    # Текстове повідомлення не можна перетворити на медіа через edit_media
+    if not _has_media(message):
         return False
 
+    kind, key, fname = _target(media_type, media_path, prepared)
+
+    async def _upload():
+        return await _open_media_upload(key, fname, prepared, attach=True)
+
+    # те саме медіа (напр. заглушка) — лише підпис; інше — edit_media за file_id/аплоадом
+    return await update_question_media(
+        message, chat_data, kind, key, caption, kb, _upload, prepared.file_id if prepared else LOOKUP
+    )
+
 async def _show_question(source, context: ContextTypes.DEFAULT_TYPE, q_index: int) -> None:
-    questions = context.user_data.get("questions", [])
+    questions = get_session_questions(context)
     if not questions or not (0 <= q_index < len(questions)):
         return
 
-    order = context.user_data.get("order", []) or []
-    total_in_session = len(order) if order else len(questions)
-    step_idx = context.user_data.get("step", 0)
+    session = get_session(context.user_data)
+    total_in_session = session.total if session and session.total else len(questions)
+    step_idx = session.step if session else 0
 
     q = questions[q_index]
     test_dir = context.user_data.get("current_test_dir")
     media_type, media_path = _detect_media(q, test_dir)
-
-    caption = _compose_caption_testing(q, step_idx, total_in_session, highlight=None, hide_correct_on_wrong=True)
+    # підготовлене після попередньої відповіді (_prefetch_next) — без звернень до диска
+    prepared = take_prepared(context.user_data, q_index)
+    if session:
+        session.mark_shown()  # латентність відповіді (answer_events)
+
+    caption = _compose_caption_testing(
+        q, step_idx, total_in_session, highlight=None, hide_correct_on_wrong=True,
+        qkey=question_key(questions, q_index),
+    )
     kb = build_options_markup(q_index, highlight=False, two_columns=True)
 
     chat_id = _get_chat_id(source)
@@ -297,10 +317,13 @@ async def _show_question(source, context: ContextTypes.DEFAULT_TYPE, q_index: in
 
     msg = getattr(source, "message", None) if not isinstance(source, Update) else None
 
+    kind, _key, _fname = _target(media_type, media_path, prepared)
+
     if msg:
-        ok = await _render_question_on_existing_message(msg, media_type, media_path, caption, kb)
+        ok = await _render_question_on_existing_message(
+            msg, media_type, media_path, caption, kb, prepared, context.chat_data
+        )
         if ok:
-            kind, _ = _decide_inline_kind_and_filename(media_type, media_path) if (media_type != "none" and media_path) else ("photo", None)
             context.user_data["last_media_type"] = kind
             context.user_data["last_msg_id"] = msg.message_id
             return
@@ -309,37 +332,63 @@ async def _show_question(source, context: ContextTypes.DEFAULT_TYPE, q_index: in
         except Exception:
             pass
 
-    sent = await _send_new_question_message(chat_id, bot, media_type, media_path, caption, kb)
+    sent = await _send_new_question_message(
+        chat_id, bot, media_type, media_path, caption, kb, prepared, context.chat_data
+    )
     if sent:
-        kind, _ = _decide_inline_kind_and_filename(media_type, media_path) if (media_type != "none" and media_path) else ("photo", None)
         context.user_data["last_media_type"] = kind
         context.user_data["last_msg_id"] = sent.message_id
     else:
         context.user_data["last_media_type"] = "none"
         context.user_data.pop("last_msg_id", None)
 
+async def _prefetch_next(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Фоново готує наступне питання сесії (handlers/prefetch.py): прогріває кеш
+    рендеру, знаходить file_id медіа або читає байти файла в пам'ять.
+    """
+    try:
+        session = get_session(context.user_data)
+        if session is None or session.step + 1 >= session.total:
+            return
+        step = session.step + 1
+        q_index = session.order[step]
+        questions = get_session_questions(context)
+        if not (0 <= q_index < len(questions)):
+            return
+        q = questions[q_index]
+        _compose_caption_testing(
+            q, step, session.total, highlight=None, hide_correct_on_wrong=True,
+            qkey=question_key(questions, q_index),
+        )
+        build_options_markup(q_index, highlight=False, two_columns=True)
+
+        media_type, media_path = _detect_media(q, context.user_data.get("current_test_dir"))
+        loop = asyncio.get_running_loop()
+        kind, key, fname = await loop.run_in_executor(None, _media_target, media_type, media_path)
+        file_id = await lookup_file_id(key, kind)
+        data_key = None
+        if not file_id and key != PLACEHOLDER_KEY:
+            data_key = await preload(key)
+        store_prepared(context.user_data, PreparedMedia(q_index, kind, key, fname, file_id, data_key))
+    except Exception as e:
+        note_failed()
+        logger.debug("[TESTING] prefetch failed: %s", e)
+
 # ========= Скорами/результати =========
 
-def _save_answer_and_score(context: ContextTypes.DEFAULT_TYPE, q_index: int, choice: int) -> Tuple[bool, Optional[int]]:
-    questions = context.user_data.get("questions", [])
+def _save_answer_and_score(
+    context: ContextTypes.DEFAULT_TYPE, q_index: int, choice: int
+) -> Tuple[bool, Optional[int], Optional[int]]:
+    """(чи правильно, правильний індекс, латентність мс)."""
+    questions = get_session_questions(context)
     if not questions or not (0 <= q_index < len(questions)):
-        return False, None
-    q = questions[q_index]
-    answers = q.get("answers")
-    if isinstance(answers, list) and answers:
-        correct = next((i for i, a in enumerate(answers[:4]) if a.get("correct")), None)
-    else:
-        correct = q.get("answer")
+        return False, None, None
+    correct = correct_index(questions[q_index])
     is_ok = (choice == correct)
-    if is_ok:
-        context.user_data["score"] = context.user_data.get("score", 0) + 1
-        context.user_data["current_streak"] = context.user_data.get("current_streak", 0) + 1
-    else:
-        wrong = context.user_data.get("wrong_pairs", [])
-        wrong.append((q_index, choice))
-        context.user_data["wrong_pairs"] = wrong
-        context.user_data["current_streak"] = 0
-    return is_ok, correct
+    session = get_session(context.user_data)
+    latency_ms = session.answer(q_index, choice, is_ok) if session else None
+    return is_ok, correct, latency_ms
 
 def _letter(idx: Optional[int]) -> str:
     return "ABCD"[idx] if isinstance(idx, int) and 0 <= idx < 4 else "?"
@@ -377,10 +426,7 @@ def _build_wrong_details_text(questions: List[dict], wrong_pairs: List[Tuple[int
         q_text = q.get("question", "").strip()
 
         answers = q.get("answers", [])
-        if isinstance(answers, list) and answers:
-            correct_idx = next((i for i, a in enumerate(answers[:4]) if isinstance(a, dict) and a.get("correct")), None)
-        else:
-            correct_idx = q.get("answer")
+        correct_idx = correct_index(q)
 
         chosen_text = ""
         correct_text = ""
@@ -418,14 +464,11 @@ async def show_results(
     username: Optional[str] = None,
 ) -> None:
     test_name = context.user_data.get("current_test", "Невідомий тест")
-    order = context.user_data.get("order", []) or []
-    total = len(order)
-    score = context.user_data.get("score", 0)
-    start_time: datetime = context.user_data.get("start_time") or datetime.now()
-    duration = (datetime.now() - start_time).total_seconds()
-    percent = (score / total * 100.0) if total else 0.0
-    current_streak = context.user_data.get("current_streak", 0)
-    wrong_pairs = list(context.user_data.get("wrong_pairs", []))
+    session = end_session(context.user_data, clear_mode=True) or QuizSession("test", ())
+    summary = session.finish()
+    total = summary["total"]
+    score = summary["score"]
+    percent = summary["percent"]
 
     if save and user_id:
         try:
@@ -435,10 +478,10 @@ async def show_results(
                 mode="test",
                 score=score,
                 total_questions=total,
-                duration=duration,
+                duration=summary["duration"],
                 percent=percent,
                 username=username or None,
-                current_streak=current_streak
+                current_streak=summary["current_streak"]
             )
         except Exception as e:
             logger.warning("[TESTING] save_user_result_db failed: %s", e)
@@ -457,13 +500,10 @@ async def show_results(
         "score": score,
         "total": total,
         "percent": percent,
-        "wrong_pairs": wrong_pairs,
+        "wrong_pairs": summary["wrong_pairs"],
         "finished_at": datetime.now().isoformat(timespec="seconds"),
     }
 
-    for k in ("mode", "order", "step", "score", "wrong_pairs", "start_time", "current_streak", "last_msg_id", "last_media_type"):
-        context.user_data.pop(k, None)
-
 async def _finish_test_and_save(source, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         chat_id = _get_chat_id(source)
@@ -474,14 +514,6 @@ async def _finish_test_and_save(source, context: ContextTypes.DEFAULT_TYPE) -> N
 
 # ========= Публічні хендлери (ТЕСТ) =========
 
-def _match_topic_filter(q: dict, topic: str) -> bool:
-    if not topic:
-        return True
-    tps = q.get("topics")
-    if not isinstance(tps, list):
-        return False
-    return any(isinstance(tp, str) and tp.strip().lower() == topic.strip().lower() for tp in tps)
-
 async def handle_test_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     choice = (update.message.text or "").strip()
     total_questions = context.user_data.get("total_questions", 0)
@@ -498,8 +530,7 @@ async def handle_test_settings(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # Формуємо пул із урахуванням topic_filter
     topic = context.user_data.get("topic_filter")
-    questions = context.user_data.get("questions", [])
-    pool = [i for i in range(total_questions) if 0 <= i < len(questions) and _match_topic_filter(questions[i], topic)] if topic else list(range(total_questions))
+    pool = session_topic_pool(context, topic, 0, total_questions) if topic else list(range(total_questions))
     if not pool:
         pool = list(range(total_questions))
 
@@ -531,13 +562,7 @@ async def handle_test_settings(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         order = random.sample(pool, count)
 
-    context.user_data["mode"] = "test"
-    context.user_data["order"] = order
-    context.user_data["step"] = 0
-    context.user_data["score"] = 0
-    context.user_data["wrong_pairs"] = []
-    context.user_data["current_streak"] = 0
-    context.user_data["start_time"] = datetime.now()
+    QuizSession.start(context.user_data, "test", order)
     context.user_data.pop("__pool_cache", None)
 
     await _show_question(update, context, order[0])
@@ -561,12 +586,11 @@ async def handle_custom_test_count(update: Update, context: ContextTypes.DEFAULT
         return
 
     total_questions = context.user_data.get("total_questions", 0)
-    questions = context.user_data.get("questions", [])
     topic = context.user_data.get("topic_filter")
 
     pool = context.user_data.pop("__pool_cache", None)
     if not isinstance(pool, list):
-        pool = [i for i in range(total_questions) if 0 <= i < len(questions) and _match_topic_filter(questions[i], topic)] if topic else list(range(total_questions))
+        pool = session_topic_pool(context, topic, 0, total_questions) if topic else list(range(total_questions))
         if not pool:
             pool = list(range(total_questions))
 
@@ -581,93 +605,86 @@ async def handle_custom_test_count(update: Update, context: ContextTypes.DEFAULT
     # остаточно прибираємо прапор очікування custom-count
     context.user_data.pop("awaiting_custom_count", None)
 
-    context.user_data["mode"] = "test"
-    context.user_data["order"] = order
-    context.user_data["step"] = 0
-    context.user_data["score"] = 0
-    context.user_data["wrong_pairs"] = []
-    context.user_data["current_streak"] = 0
-    context.user_data["start_time"] = datetime.now()
+    QuizSession.start(context.user_data, "test", order)
 
     await _show_question(update, context, order[0])
 
+@fast_ack_callback
 async def answer_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     parts = (query.data or "").split("|")
     if len(parts) != 3 or parts[0] != "ans":
-        try:
-            await query.answer()
-        except Exception:
-            pass
+        await answer_once(query)
         return
     try:
         q_index = int(parts[1]); choice = int(parts[2])
     except ValueError:
-        try:
-            await query.answer()
-        except Exception:
-            pass
+        await answer_once(query)
         return
 
-    is_ok, _correct_idx = _save_answer_and_score(context, q_index, choice)
+    is_ok, _correct_idx, latency_ms = _save_answer_and_score(context, q_index, choice)
+    await answer_once(query)
+    if _correct_idx is not None:
+        context.application.create_task(_prefetch_next(context), update=update)
 
-    if not is_ok:
+    try:
+        await _edit_after_answer(query, context, q_index, choice, is_ok)
+    finally:
+        # побічні записи — після того, як користувач уже бачить результат
         try:
             test_name = context.user_data.get("current_test")
             uid, _uname = _get_user_from_source(query)
-            if uid and test_name is not None:
+            if test_name is not None and _correct_idx is not None:
+                await add_answer_event(uid, test_name, q_index, choice, is_ok, latency_ms)
+            if not is_ok and uid and test_name is not None:
                 await add_wrong_answer(uid, test_name, q_index)
         except Exception as e:
-            logger.debug("[TESTING] add_wrong_answer failed: %s", e)
+            logger.debug("[TESTING] answer side writes failed: %s", e)
 
-    try:
-        await query.answer()
-    except Exception:
-        pass
-
-    questions = context.user_data.get("questions", [])
+async def _edit_after_answer(query, context: ContextTypes.DEFAULT_TYPE, q_index: int, choice: int, is_ok: bool):
+    questions = get_session_questions(context)
     if not questions or not (0 <= q_index < len(questions)):
         return
     q = questions[q_index]
 
-    order = context.user_data.get("order", []) or []
-    total_in_session = max(1, len(order))
-    step_idx = context.user_data.get("step", 0)
+    session = get_session(context.user_data)
+    total_in_session = max(1, session.total) if session else 1
+    step_idx = session.step if session else 0
 
-    mode = context.user_data.get("mode")
-
-    if mode == "learning":
-        caption = _compose_caption_learning(q, step_idx, total_in_session, highlight=(choice, is_ok))
+    qkey = question_key(questions, q_index)
+    if session and session.mode == "learning":
+        caption = _compose_caption_learning(q, step_idx, total_in_session, highlight=(choice, is_ok), qkey=qkey)
     else:
-        caption = _compose_caption_testing(q, step_idx, total_in_session, highlight=(choice, is_ok), hide_correct_on_wrong=True)
+        caption = _compose_caption_testing(
+            q, step_idx, total_in_session, highlight=(choice, is_ok), hide_correct_on_wrong=True, qkey=qkey
+        )
 
     fav_set = context.user_data.get("fav_set") or set()
     is_fav = q_index in fav_set if isinstance(fav_set, set) else False
-    comments_count = q.get("comments_count", 0)
+    try:
+        comments_count = await get_comments_count(
+            context.user_data.get("current_test"), q_index, context.user_data.get("current_test_dir")
+        )
+    except Exception:
+        comments_count = q.get("comments_count", 0)
     kb = build_options_markup(q_index, highlight=True, is_favorited=is_fav, comments_count=comments_count)
 
     try:
-        if getattr(query.message, "text", None) and not getattr(query.message, "caption", None):
-            await query.message.edit_text(text=caption, reply_markup=kb, parse_mode="HTML")
-        else:
-            await query.message.edit_caption(caption=caption, reply_markup=kb, parse_mode="HTML")
+        await update_question_caption(query.message, context.chat_data, caption, kb)
     except Exception as e:
         logger.warning("[TESTING] edit after answer failed: %s", e)
 
+@fast_ack_callback
 async def next_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    try:
-        await query.answer()
-    except Exception:
-        pass
+    await answer_once(query)
 
-    order = context.user_data.get("order", [])
-    step = context.user_data.get("step", 0)
-    if not order:
+    session = get_session(context.user_data)
+    if not session or not session.total:
         return
 
-    step += 1
-    if step >= len(order):
+    next_q_index = session.advance()
+    if next_q_index is None:
         try:
             await query.message.edit_reply_markup(reply_markup=None)
         except Exception:
@@ -675,8 +692,6 @@ async def next_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await _finish_test_and_save(query, context)
         return
 
-    context.user_data["step"] = step
-    next_q_index = order[step]
     await _show_question(query, context, next_q_index)
 
 async def retry_wrong_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -686,7 +701,8 @@ async def retry_wrong_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception:
         pass
 
-    wrong_pairs = context.user_data.get("wrong_pairs", [])
+    session = get_session(context.user_data)
+    wrong_pairs = session.wrong_pairs if session else []
     if not wrong_pairs:
         last = context.user_data.get("last_result") or {}
         wrong_pairs = list(last.get("wrong_pairs") or [])
@@ -696,13 +712,7 @@ async def retry_wrong_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     order = [i for (i, _) in wrong_pairs]
-    context.user_data["mode"] = "test"
-    context.user_data["order"] = order
-    context.user_data["step"] = 0
-    context.user_data["score"] = 0
-    context.user_data["wrong_pairs"] = []
-    context.user_data["current_streak"] = 0
-    context.user_data["start_time"] = datetime.now()
+    QuizSession.start(context.user_data, "test", order)
 
     await _show_question(query, context, order[0])
 
@@ -713,14 +723,13 @@ async def detailed_stats_handler(update: Update, context: ContextTypes.DEFAULT_T
     except Exception:
         pass
 
-    live_total = len(context.user_data.get("order", []) or [])
+    session = get_session(context.user_data)
     wrong_pairs = None
     title = None
 
-    if live_total:
-        live_score = context.user_data.get("score", 0)
-        title = f"Детальна статистика (поточна сесія):\nПравильних: {live_score}\nУсього: {live_total}\n"
-        wrong_pairs = list(context.user_data.get("wrong_pairs", []))
+    if session and session.total:
+        title = f"Детальна статистика (поточна сесія):\nПравильних: {session.score}\nУсього: {session.total}\n"
+        wrong_pairs = session.wrong_pairs
     else:
         last = context.user_data.get("last_result")
         if not last:
@@ -736,7 +745,7 @@ async def detailed_stats_handler(update: Update, context: ContextTypes.DEFAULT_T
         )
         wrong_pairs = list(last.get("wrong_pairs", []))
 
-    questions = context.user_data.get("questions", []) or []
+    questions = get_session_questions(context)
     chunks = _build_wrong_details_text(questions, wrong_pairs or [])
 
     if not chunks:
@@ -749,11 +758,12 @@ async def detailed_stats_handler(update: Update, context: ContextTypes.DEFAULT_T
     except Exception as e:
         logger.warning("[TESTING] send detailed first failed: %s", e)
 
-    for chunk in chunks[1:]:
-        try:
-            await query.message.reply_text("Продовження розбору помилок:\n\n" + chunk)
-        except Exception as e:
-            logger.warning("[TESTING] send detailed chunk failed: %s", e)
+    with bulk_sends():
+        for chunk in chunks[1:]:
+            try:
+                await query.message.reply_text("Продовження розбору помилок:\n\n" + chunk)
+            except Exception as e:
+                logger.warning("[TESTING] send detailed chunk failed: %s", e)
 
 async def back_to_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -761,8 +771,7 @@ async def back_to_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.answer()
     except Exception:
         pass
-    for k in ("mode", "order", "step", "score", "wrong_pairs", "start_time", "current_streak", "last_msg_id", "last_media_type"):
-        context.user_data.pop(k, None)
+    end_session(context.user_data, clear_mode=True)
     await query.message.reply_text("Повернення до меню тесту.", reply_markup=main_menu())
 
 async def cancel_session_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -772,13 +781,9 @@ async def cancel_session_handler(update: Update, context: ContextTypes.DEFAULT_T
     except Exception:
         pass
 
-    keys_to_clear = {
-        "mode", "order", "step", "score", "wrong_pairs", "start_time",
-        "current_streak", "last_msg_id", "last_media_type",
-        "learning_range", "awaiting_custom_range"
-    }
-    for k in keys_to_clear:
-        context.user_data.pop(k, None)
+    end_session(context.user_data, clear_mode=True)
+    context.user_data.pop("learning_range", None)
+    context.user_data.pop("awaiting_custom_range", None)
 
     lang = context.bot_data.get("lang", "uk")
     try:
@@ -800,9 +805,10 @@ async def back_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     mode = context.user_data.get("mode")
-    order = context.user_data.get("order") or []
+    session = get_session(context.user_data)
+    active = bool(session and session.total)
 
-    if mode == "test" and not order:
+    if mode == "test" and not active:
         context.user_data.pop("awaiting_custom_count", None)
         context.user_data.pop("mode", None)
         context.user_data["suppress_test_select_once"] = True
@@ -813,9 +819,8 @@ async def back_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    if mode == "test" and order:
-        for k in ("mode", "order", "step", "score", "wrong_pairs", "start_time", "current_streak", "last_msg_id", "last_media_type"):
-            context.user_data.pop(k, None)
+    if mode == "test" and active:
+        end_session(context.user_data, clear_mode=True)
         context.user_data["suppress_test_select_once"] = True
         lang = context.bot_data.get("lang", "uk")
         await update.message.reply_text(
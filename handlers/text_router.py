@@ -0,0 +1,273 @@
+# handlers/text_router.py
+"""
+Єдиний диспетчер текстових повідомлень для груп хендлерів (0, 1, 2).
+
+Раніше main() реєстрував понад 40 MessageHandler(filters.Regex(...)), і PTB для
+кожного тексту проганяв їх по черзі в кожній групі; роутер group=0 і
+handle_test_selection ще й самі перевіряли прапорці user_data. Тепер у кожній
+групі — один MessageHandler(TEXT & ~COMMAND) з TextRouter, який зберігає
+семантику PTB «перший збіг у порядку реєстрації», але шукає його так:
+
+  - exact(...)   — фіксовані підписи кнопок: dict → O(1);
+  - pattern(...) — параметричні (діапазони, числа, @username): усі шаблони групи
+                   зібрані в один попередньо скомпільований regex з альтернативами
+                   в порядку реєстрації, тож перший збіг = найраніший маршрут;
+  - state(...)   — машина станів: user_data[key] → хендлер одним dict-lookup;
+  - when(...)    — довільна умова (reply, активний майстер...);
+  - fallback(...) — усе інше (вибір тесту).
+
+Маршрут з handler=None «поглинає» текст без дії (як колись ~filters.Regex(...)).
+Умовні маршрути перевіряються лише якщо стоять раніше за знайдений exact/pattern.
+
+Налагодження: python -m handlers.text_router dump  — таблиця маршрутів
+(з підписами, які перекриті ранішими маршрутами); без аргументів — бенчмарк
+диспетчеризації проти ланцюжка PTB-хендлерів.
+"""
+import re
+import sys
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Pattern, Tuple, Union
+
+from telegram import Update
+from telegram.ext import ContextTypes, MessageHandler, filters
+
+logger = logging.getLogger("test_bot.router")
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+Predicate = Callable[[Update, Dict[str, Any]], bool]
+
+_stats = {"dispatched": 0, "exact": 0, "pattern": 0, "state": 0, "when": 0, "fallback": 0, "unmatched": 0}
+
+
+class Route:
+    __slots__ = ("order", "kind", "spec", "handler", "predicate", "states", "name")
+
+    def __init__(self, order: int, kind: str, spec: Any, handler: Optional[Handler],
+                 predicate: Optional[Predicate] = None, states: Optional[Dict[Any, Handler]] = None,
+                 name: str = ""):
+        self.order = order
+        self.kind = kind
+        self.spec = spec
+        self.handler = handler
+        self.predicate = predicate
+        self.states = states
+        self.name = name
+
+    def handler_for(self, user_data: Dict[str, Any]) -> Optional[Handler]:
+        if self.states is not None:
+            return self.states.get(user_data.get(self.spec))
+        return self.handler
+
+
+def _handler_name(handler: Optional[Handler]) -> str:
+    if handler is None:
+        return "(ignore)"
+    return getattr(handler, "__qualname__", None) or getattr(handler, "__name__", None) or repr(handler)
+
+
+class TextRouter:
+    """Маршрути однієї групи хендлерів у порядку реєстрації."""
+
+    def __init__(self, group: int):
+        self.group = group
+        self.routes: List[Route] = []
+        self._exact: Dict[str, Route] = {}
+        self._patterns: List[Route] = []
+        self._guarded: List[Route] = []
+        self._fallback: Optional[Route] = None
+        self._combined: Optional[Pattern] = None
+        self._by_group: Dict[str, Route] = {}
+
+    def _add(self, route: Route) -> Route:
+        if self._fallback is not None:
+            raise ValueError("fallback must be the last route of the group")
+        self.routes.append(route)
+        return route
+
+    def exact(self, labels: Union[str, Iterable[str]], handler: Optional[Handler]) -> "TextRouter":
+        labels = (labels,) if isinstance(labels, str) else tuple(labels)
+        route = self._add(Route(len(self.routes), "exact", labels, handler))
+        for label in labels:
+            self._exact.setdefault(label, route)  # раніший маршрут перекриває пізніший
+        return self
+
+    def pattern(self, regex: Union[str, Pattern], handler: Optional[Handler]) -> "TextRouter":
+        compiled = re.compile(regex) if isinstance(regex, str) else regex
+        if compiled.flags & ~re.UNICODE or compiled.groupindex:
+            raise ValueError(f"pattern {compiled.pattern!r}: flags/named groups are not supported")
+        self._patterns.append(self._add(Route(len(self.routes), "pattern", compiled, handler)))
+        self._combined = None
+        return self
+
+    def state(self, key: str, states: Dict[Any, Handler]) -> "TextRouter":
+        """user_data[key] == value → states[value]; інші значення — маршрут не спрацьовує."""
+        self._guarded.append(self._add(Route(len(self.routes), "state", key, None, states=dict(states))))
+        return self
+
+    def when(self, predicate: Predicate, handler: Optional[Handler], name: str) -> "TextRouter":
+        """predicate(update, user_data) → маршрут спрацьовує."""
+        self._guarded.append(self._add(Route(len(self.routes), "when", name, handler, predicate=predicate, name=name)))
+        return self
+
+    def fallback(self, handler: Handler) -> "TextRouter":
+        self._fallback = self._add(Route(len(self.routes), "fallback", None, handler))
+        return self
+
+    def _compile(self) -> Optional[Pattern]:
+        if self._combined is None and self._patterns:
+            parts = []
+            for i, route in enumerate(self._patterns):
+                src = route.spec.pattern
+                # PTB Regex — re.search: не прив'язаний до початку шаблон шукаємо через [\s\S]*?
+                if not src.startswith("^"):
+                    src = r"[\s\S]*?(?:" + src + ")"
+                parts.append(f"(?P<p{i}>{src})")
+                self._by_group[f"p{i}"] = route
+            self._combined = re.compile("|".join(parts))
+        return self._combined
+
+    def resolve(self, update: Update, user_data: Dict[str, Any]) -> Tuple[Optional[Route], Optional[Handler]]:
+        """Маршрут, який обрав би ланцюжок PTB-хендлерів цієї групи, і його хендлер."""
+        message = update.effective_message
+        text = (message.text if message is not None else None) or ""
+
+        best = self._exact.get(text)
+        combined = self._compile()
+        if combined is not None:
+            m = combined.match(text)
+            if m is not None:
+                route = self._by_group[m.lastgroup]
+                if best is None or route.order < best.order:
+                    best = route
+
+        limit = best.order if best is not None else len(self.routes)
+        for route in self._guarded:
+            if route.order >= limit:
+                break
+            if route.kind == "state":
+                handler = route.handler_for(user_data)
+                if handler is not None:
+                    return route, handler
+            elif route.predicate(update, user_data):
+                return route, route.handler
+
+        if best is not None:
+            return best, best.handler
+        if self._fallback is not None:
+            return self._fallback, self._fallback.handler
+        return None, None
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        route, handler = self.resolve(update, context.user_data if context.user_data is not None else {})
+        _stats["dispatched"] += 1
+        if route is None:
+            _stats["unmatched"] += 1
+            return None
+        _stats[route.kind] += 1
+        if handler is None:
+            return None
+        return await handler(update, context)
+
+    def handler(self) -> MessageHandler:
+        return MessageHandler(filters.TEXT & ~filters.COMMAND, self)
+
+    # ---- налагодження ----
+
+    def dump(self) -> str:
+        """Таблиця маршрутів групи; підписи, перекриті ранішими маршрутами, позначені."""
+        lines = [f"group={self.group}: {len(self.routes)} маршрутів, "
+                 f"{len(self._exact)} підписів, {len(self._patterns)} шаблонів"]
+        for r in self.routes:
+            if r.kind == "exact":
+                shown = []
+                for label in r.spec:
+                    owner = self._exact[label]
+                    shown.append(label if owner is r else f"{label} [перекрито #{owner.order}]")
+                spec = " | ".join(shown)
+            elif r.kind == "pattern":
+                spec = r.spec.pattern
+            elif r.kind == "state":
+                spec = f"user_data[{r.spec!r}] ∈ {{{', '.join(map(repr, r.states))}}}"
+            else:
+                spec = r.name or "*"
+            if r.kind == "state" and len(set(r.states.values())) > 1:
+                target = ", ".join(f"{k!r}→{_handler_name(h)}" for k, h in r.states.items())
+            elif r.kind == "state":
+                target = _handler_name(next(iter(r.states.values()), None))
+            else:
+                target = _handler_name(r.handler)
+            lines.append(f"  #{r.order:<3} {r.kind:8} {spec}  →  {target}")
+        return "\n".join(lines)
+
+
+def text_router_stats() -> Dict[str, int]:
+    return dict(_stats)
+
+
+# ===================== Бенчмарк =====================
+
+def _legacy_handlers(router: TextRouter) -> List[MessageHandler]:
+    """Еквівалентний ланцюжок PTB-хендлерів (як реєструвався до роутера)."""
+    noop = router.__call__
+    out = []
+    for r in router.routes:
+        if r.kind == "exact":
+            flt = filters.Regex("^(" + "|".join(map(re.escape, r.spec)) + ")$")
+        elif r.kind == "pattern":
+            flt = filters.Regex(r.spec)
+        elif r.kind == "when" and r.name == "reply":
+            flt = filters.REPLY & filters.TEXT & ~filters.COMMAND
+        else:  # state / when / fallback — хендлер сам перевіряв прапорці
+            flt = filters.TEXT & ~filters.COMMAND
+        out.append(MessageHandler(flt, noop))
+    return out
+
+
+def _benchmark(rounds: int = 2000) -> None:
+    import time
+    import bot
+
+    routers = bot.build_text_routers()
+    legacy = [_legacy_handlers(r) for r in routers]
+    texts = [
+        "🎓 Режим навчання", "📝 Режим тестування", "🔙 Назад", "⬅️ Назад", "12-40", "25",
+        "🔟 10 питань", "Анатомія 2 курс", "👤 Мій кабінет", "@some_user", "Мої помилки",
+        "🔙 Обрати інший тест", "будь-який інший текст користувача",
+    ]
+    updates = [
+        Update.de_json({"update_id": i, "message": {
+            "message_id": i, "date": 0, "text": t,
+            "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "U"},
+        }}, None)
+        for i, t in enumerate(texts)
+    ]
+    user_data: Dict[str, Any] = {}
+
+    def _legacy() -> None:
+        for upd in updates:
+            for chain in legacy:
+                for h in chain:
+                    if h.check_update(upd):
+                        break
+
+    def _routed() -> None:
+        for upd in updates:
+            for router in routers:
+                router.resolve(upd, user_data)
+
+    for name, fn in (("ланцюжок PTB-хендлерів", _legacy), ("TextRouter", _routed)):
+        fn()
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        per_msg = (time.perf_counter() - t0) / (rounds * len(updates)) * 1e6
+        print(f"{name:24}: {per_msg:6.2f} мкс на текстове повідомлення (усі групи)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "dump":
+        import bot
+        for _router in bot.build_text_routers():
+            print(_router.dump())
+    else:
+        _benchmark()
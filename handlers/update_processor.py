@@ -0,0 +1,239 @@
+# handlers/update_processor.py
+"""
+Паралельна обробка оновлень зі збереженням порядку для кожного користувача.
+
+Без concurrent_updates PTB обробляє оновлення строго по одному: поки один
+користувач чекає DOCX-експорт чи розпакування ZIP, кнопки відповідей решти
+студентів стоять у черзі. Тепер (UserOrderedUpdateProcessor):
+
+  - оновлення різних користувачів обробляються паралельно, до
+    UPDATE_CONCURRENCY (за замовчуванням 32) одночасно;
+  - оновлення одного користувача — строго по черзі, у порядку надходження,
+    тож user_data змінюється без гонок (перевірка стану → await → запис);
+  - у групах додатково тримається замок чату (chat_data). Порядок захоплення
+    завжди «користувач → чат», тому взаємних блокувань немає;
+  - замки живуть лише доки є хоч одне оновлення ключа, що обробляється або
+    чекає: без активності запис одразу прибирається з мапи.
+
+Оновлення, що чекає на свій замок, не займає слот паралельності — один
+користувач, що «закидав» бота повідомленнями, не блокує інших.
+
+UPDATE_CONCURRENCY=1 — послідовна обробка, як раніше.
+Стрес-тест (пропускна здатність, втрачені записи, порядок):
+  python -m handlers.update_processor
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger("test_bot.updates")
+
+# PTB-семафор лише обмежує кількість задач оновлень; реальну паралельність задає _workers
+_MAX_PENDING = 4096
+
+
+class _KeyLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # оновлень, що тримають або чекають цей замок
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Паралельно між користувачами, послідовно в межах користувача (і групового чату)."""
+
+    def __init__(self, workers: int = 32):
+        super().__init__(max_concurrent_updates=_MAX_PENDING)
+        self.workers = max(1, workers)
+        self._workers = asyncio.Semaphore(self.workers)
+        self._locks: Dict[Hashable, _KeyLock] = {}
+        self._stats = {
+            "processed": 0,
+            "waited": 0,
+            "wait_ms_max": 0,
+            "active": 0,
+            "active_max": 0,
+            "locks_max": 0,
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._locks.clear()
+
+    @staticmethod
+    def _keys(update: object) -> List[Hashable]:
+        if not isinstance(update, Update):
+            return []
+        keys: List[Hashable] = []
+        user = update.effective_user
+        chat = update.effective_chat
+        if user is not None:
+            keys.append(("u", user.id))
+        # приватний чат має той самий id, що й користувач — окремий замок не потрібен
+        if chat is not None and (user is None or chat.id != user.id):
+            keys.append(("c", chat.id))
+        return keys
+
+    def _enter(self, key: Hashable) -> _KeyLock:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _KeyLock()
+            self._stats["locks_max"] = max(self._stats["locks_max"], len(self._locks))
+        entry.users += 1
+        return entry
+
+    def _leave(self, key: Hashable, entry: _KeyLock) -> None:
+        entry.users -= 1
+        if entry.users == 0 and self._locks.get(key) is entry:
+            del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        keys = self._keys(update)
+        entries = [(k, self._enter(k)) for k in keys]
+        acquired: List[asyncio.Lock] = []
+        started = False
+        t0 = time.perf_counter()
+        try:
+            for _key, entry in entries:
+                await entry.lock.acquire()
+                acquired.append(entry.lock)
+            async with self._workers:
+                waited = int((time.perf_counter() - t0) * 1000)
+                if waited:
+                    self._stats["waited"] += 1
+                    self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], waited)
+                self._stats["active"] += 1
+                self._stats["active_max"] = max(self._stats["active_max"], self._stats["active"])
+                started = True
+                try:
+                    await coroutine
+                finally:
+                    self._stats["active"] -= 1
+                    self._stats["processed"] += 1
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key, entry in entries:
+                self._leave(key, entry)
+            if not started and hasattr(coroutine, "close"):
+                coroutine.close()  # скасовано до старту — без «coroutine was never awaited»
+
+    def stats(self) -> Dict[str, int]:
+        out = dict(self._stats)
+        out["workers"] = self.workers
+        out["locks"] = len(self._locks)
+        return out
+
+
+_processor: Optional[UserOrderedUpdateProcessor] = None
+
+
+def create_update_processor() -> Optional[UserOrderedUpdateProcessor]:
+    """UserOrderedUpdateProcessor на UPDATE_CONCURRENCY слотів; None — послідовна обробка (1)."""
+    global _processor
+    try:
+        workers = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+    except ValueError:
+        workers = 32
+    if workers <= 1:
+        return None
+    _processor = UserOrderedUpdateProcessor(workers)
+    return _processor
+
+
+def update_processor_stats() -> Optional[Dict[str, int]]:
+    return _processor.stats() if _processor is not None else None
+
+
+# ===================== Стрес-тест =====================
+
+async def _stress(n_users: int = 200, per_user: int = 20, workers: int = 32) -> None:
+    """
+    n_users користувачів, кожен надсилає per_user оновлень; хендлер читає лічильник
+    з user_data, «ходить у БД» (sleep 1–5 мс) і записує лічильник+1 — типовий
+    read-modify-write квізу. Один користувач робить повільний експорт (0.5 с).
+    Порівнюємо: послідовно (як раніше), паралельно без замків, паралельно з замками,
+    і з замками для хендлера під @fast_ack_callback (як answer_handler / next_handler).
+    """
+    import random
+    from types import SimpleNamespace
+    from telegram.ext import SimpleUpdateProcessor
+    from handlers.callback_pipeline import fast_ack_callback
+
+    rnd = random.Random(7)
+    arrivals = [u for _ in range(per_user) for u in range(1, n_users + 1)]
+    updates = [
+        Update.de_json({
+            "update_id": i,
+            "message": {
+                "message_id": i, "date": 0, "text": "x",
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "U"},
+            },
+        }, None)
+        for i, uid in enumerate(arrivals)
+    ]
+    delays = [rnd.uniform(0.001, 0.005) for _ in updates]
+    expected = per_user
+
+    async def _run(name: str, processor: Optional[BaseUpdateProcessor], fast_ack: bool = False) -> None:
+        user_data: Dict[int, Dict[str, Any]] = {}
+        seen: Dict[int, List[int]] = {}
+        slow_user = 1
+        others_latency: List[float] = []
+
+        async def handler(update: Update, t_in: float) -> None:
+            uid = update.effective_user.id
+            ud = user_data.setdefault(uid, {"count": 0})
+            count = ud["count"]
+            await asyncio.sleep(0.5 if (uid == slow_user and count == 0) else delays[update.update_id])
+            ud["count"] = count + 1
+            seen.setdefault(uid, []).append(update.update_id)
+            if uid != slow_user:
+                others_latency.append(time.perf_counter() - t_in)
+
+        # усі оновлення приходять одним сплеском — латентність рахуємо від t0
+        t0 = time.perf_counter()
+        run = handler
+        if fast_ack:
+            acked = fast_ack_callback(lambda upd, ctx: handler(upd, ctx.t_in))
+            context = SimpleNamespace(
+                t_in=t0,
+                application=SimpleNamespace(create_task=lambda coro, update=None: asyncio.create_task(coro)),
+            )
+            run = lambda upd, _t_in: acked(upd, context)  # noqa: E731
+        if processor is None:
+            for upd in updates:
+                await run(upd, t0)
+        else:
+            async with processor:
+                tasks = [asyncio.create_task(processor.process_update(upd, run(upd, t0))) for upd in updates]
+                await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - t0
+
+        lost = sum(expected - ud["count"] for ud in user_data.values())
+        out_of_order = sum(1 for ids in seen.values() if ids != sorted(ids))
+        others_latency.sort()
+        p95 = others_latency[int(len(others_latency) * 0.95)] * 1000
+        print(f"{name:22}: {len(updates) / elapsed:8.0f} оновлень/с, втрачено записів: {lost:4}, "
+              f"користувачів з порушеним порядком: {out_of_order:3}, p95 інших: {p95:7.1f} мс")
+
+    print(f"{n_users} користувачів × {per_user} оновлень, {workers} слотів:")
+    await _run("послідовно", None)
+    await _run("паралельно без замків", SimpleUpdateProcessor(workers))
+    ordered = UserOrderedUpdateProcessor(workers)
+    await _run("паралельно з замками", ordered)
+    print(f"  {ordered.stats()}")
+    await _run("з замками + fast-ack", UserOrderedUpdateProcessor(workers), fast_ack=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(_stress())
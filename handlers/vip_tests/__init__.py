@@ -18,6 +18,7 @@ from .vip_edit_menu import (
     vip_edit_open,
     vip_edit_rewrite_from_menu,
     vip_edit_add_images_from_menu,
+    vip_question_stats,
 )
 from .vip_trusted import (
     vip_trusted_open,
@@ -60,7 +61,7 @@ __all__ = [
     "vip_delete_select", "vip_delete_confirm",
     "vip_img_upload", "vip_img_later",
     "vip_cancel",
-    "vip_edit_open", "vip_edit_rewrite_from_menu", "vip_edit_add_images_from_menu",
+    "vip_edit_open", "vip_edit_rewrite_from_menu", "vip_edit_add_images_from_menu", "vip_question_stats",
     "vip_trusted_open", "vip_trusted_add_start", "vip_trusted_remove_open", "vip_trusted_remove_do",
     "vip_trusted_handle_username_text", "vip_trusted_pick_target",
     # ===== Запити (pending) =====
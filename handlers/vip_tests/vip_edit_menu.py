@@ -3,6 +3,7 @@ import os
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 
+from handlers.answer_analytics import run_rollup, question_stats_for_test, format_question_line
 from .vip_ui import _images_prompt_kb
 
 async def vip_edit_open(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -14,6 +15,7 @@ async def vip_edit_open(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     - Видалити всі файли медіатеки тесту (image*/audio*/video*/doc*)
     - Довірені користувачі
     - Змінити розділ (перемістити тест цілком)
+    - Статистика питань (складність, розподіл відповідей)
     """
     query = update.callback_query
     await query.answer()
@@ -37,6 +39,7 @@ async def vip_edit_open(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         [InlineKeyboardButton("🧹 Видалити всі файли", callback_data=f"vip_media_wipe|{idx}")],
         [InlineKeyboardButton("👥 Довірені користувачі", callback_data=f"vip_trusted|{idx}")],
         [InlineKeyboardButton("📂 Змінити розділ", callback_data=f"vip_edit_move|{idx}")],
+        [InlineKeyboardButton("📈 Статистика питань", callback_data=f"vip_qstats|{idx}")],
         [InlineKeyboardButton("❌ Закрити", callback_data="vip_cancel")],
     ])
     await query.message.reply_text(f"⚙️ Редагування тесту «{name}». Оберіть дію:", reply_markup=kb)
@@ -93,3 +96,38 @@ async def vip_edit_add_images_from_menu(update: Update, context: ContextTypes.DE
         "Імена мають містити номер питання (наприклад, image12.jpg, 12.png).",
         reply_markup=_images_prompt_kb()
     )
+
+async def vip_question_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Складність питань тесту: частка правильних, розподіл A–D, середній час відповіді."""
+    query = update.callback_query
+    await query.answer()
+
+    idx_str = (query.data.split("|", 1)[1] if "|" in query.data else "").strip()
+    try:
+        idx = int(idx_str)
+    except ValueError:
+        return
+
+    items = context.user_data.get("vip_mytests") or []
+    if not (0 <= idx < len(items)):
+        await query.message.reply_text("❌ Тест не знайдено.")
+        return
+
+    name = items[idx]["name"]
+    await run_rollup()
+    stats = await question_stats_for_test(name)
+    if not stats:
+        await query.message.reply_text(f"📈 Для тесту «{name}» ще немає відповідей.")
+        return
+
+    attempts = sum(x["attempts"] for x in stats)
+    avg_p = sum(x["correct"] for x in stats) / attempts if attempts else 0.0
+    hardest = sorted(stats, key=lambda x: (x["p_correct"], -x["attempts"]))[:15]
+    lines = [
+        f"📈 Статистика питань «{name}»",
+        f"Питань з відповідями: {len(stats)}, відповідей: {attempts}, у середньому правильних: {avg_p * 100:.0f}%",
+        "",
+        "Найскладніші:",
+    ]
+    lines += [f"• {format_question_line(x)}" for x in hardest]
+    await query.message.reply_text("\n".join(lines))
@@ -6,7 +6,8 @@ from telegram.ext import ContextTypes
 
 from .vip_storage import _load_owners
 from .vip_constants import TESTS_ROOT
-from utils.loader import discover_tests, attach_images
+from utils.loader import discover_tests
+from handlers.state_sync import load_session_test
 from utils.keyboards import main_menu
 from utils.i18n import t
 
@@ -163,31 +164,22 @@ async def vip_go_to_test(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.exception("discover_tests failed: %s", e)
         entry = None
 
-    questions = []
     if entry:
-        # Підв'язуємо зображення, якщо є
-        try:
-            questions = attach_images(entry["questions"], entry.get("images_dir"))
-        except Exception as e:
-            logger.warning("attach_images failed: %s", e)
-            questions = entry["questions"] or []
+        # Скомпільований тест (питання + медіа) — спільний для всіх сесій
+        parts = [(entry.get("json_path"), entry.get("images_dir"))]
     else:
-        # Фолбек: спробуємо прочитати JSON напряму
+        # Фолбек: JSON напряму, без медіа
         json_path = os.path.join(test_dir, f"{test_name}.json")
-        try:
-            import json
-            with open(json_path, "r", encoding="utf-8") as f:
-                questions = json.load(f)
-        except Exception as e:
-            logger.error("Failed to load test JSON directly: %s", e)
+        if not os.path.isfile(json_path):
+            logger.error("Failed to load test JSON directly: %s not found", json_path)
             await query.message.reply_text("❌ Не вдалося відкрити тест.")
             return
+        parts = [(json_path, None)]
 
     # Зберігаємо стан користувача для цього тесту
+    await load_session_test(context, parts)
     context.user_data["current_test"] = test_name
     context.user_data["current_test_dir"] = test_dir
-    context.user_data["questions"] = questions
-    context.user_data["total_questions"] = len(questions)
 
     # скидаємо можливі флаги пошуку/офісу
     context.user_data.pop("awaiting_search", None)
@@ -203,6 +195,6 @@ async def vip_go_to_test(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     lang = context.bot_data.get("lang", "uk")
     await query.message.reply_text(
-        t(lang, "test_selected", test=test_name, count=len(questions)),
+        t(lang, "test_selected", test=test_name, count=context.user_data.get("total_questions", 0)),
         reply_markup=main_menu()
     )
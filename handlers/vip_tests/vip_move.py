@@ -11,7 +11,7 @@ from .vip_storage import (
     _load_owners, _save_owners, _relative_to_tests, _refresh_catalogs, _cleanup_empty_dirs
 )
 from utils.export_docx import _safe_filename
-from utils.loader import IGNORED_JSON_SUFFIXES, discover_tests, discover_tests_hierarchy
+from utils.loader import IGNORED_JSON_SUFFIXES, load_catalog_and_tree
 
 logger = logging.getLogger("test_bot.vip_move")
 
@@ -316,8 +316,9 @@ async def vip_move_choose_here(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # 6) каталоги (перезбір дерева щоб головне меню/браузер оновились у пам'яті)
     try:
-        context.bot_data["tests_catalog"] = discover_tests(TESTS_ROOT)
-        context.bot_data["tests_tree"] = discover_tests_hierarchy(TESTS_ROOT)
+        catalog, tree = load_catalog_and_tree(TESTS_ROOT, rescan=True)
+        context.bot_data["tests_catalog"] = catalog
+        context.bot_data["tests_tree"] = tree
     except Exception:
         _refresh_catalogs(context)
 
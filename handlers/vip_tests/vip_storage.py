@@ -117,11 +117,13 @@ def _cleanup_empty_dirs(start_dir: str) -> None:
         logger.debug("[CLEANUP] unexpected error: %s", e)
 
 # ---- catalogs / discovery ----
-from utils.loader import discover_tests, discover_tests_hierarchy
+from utils.loader import discover_tests, load_catalog_and_tree
 
 def _refresh_catalogs(context: ContextTypes.DEFAULT_TYPE) -> None:
-    context.bot_data["tests_catalog"] = discover_tests(TESTS_ROOT)
-    context.bot_data["tests_tree"] = discover_tests_hierarchy(TESTS_ROOT)
+    # викликається після змін на диску — звіряємо дерево навіть якщо працює watcher
+    catalog, tree = load_catalog_and_tree(TESTS_ROOT, rescan=True)
+    context.bot_data["tests_catalog"] = catalog
+    context.bot_data["tests_tree"] = tree
 
 def _test_name_exists(context: ContextTypes.DEFAULT_TYPE, name: str) -> bool:
     context.bot_data["tests_catalog"] = discover_tests(TESTS_ROOT)
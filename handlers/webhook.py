@@ -0,0 +1,492 @@
+# handlers/webhook.py
+"""
+Режим webhook як альтернатива long polling (WEBHOOK_URL у .env).
+
+run_polling тримає постійний цикл getUpdates і після кожної відповіді ще й
+спить poll_interval (0.1 с) — кожне друге оновлення з пачки чекає ці 100 мс.
+З webhook Telegram сам надсилає оновлення POST-запитом, і воно одразу
+потрапляє в application.update_queue.
+
+Сервер — мінімальний HTTP/1.1 на asyncio (keep-alive, Content-Length), без
+tornado/aiohttp: бот зазвичай стоїть за reverse proxy (nginx/Caddy), який
+термінує TLS і проксує на WEBHOOK_LISTEN:WEBHOOK_PORT. Захист від повільних і
+кривих клієнтів: заголовки й тіло читаються під одним дедлайном
+(REQUEST_TIMEOUT_S), не більше MAX_HEADERS заголовків і MAX_HEAD_BYTES байтів,
+від'ємний чи нечисловий Content-Length — 400.
+
+  POST <WEBHOOK_PATH>  — оновлення від Telegram; заголовок
+                         X-Telegram-Bot-Api-Secret-Token звіряється з WEBHOOK_SECRET
+                         (не задано — генерується при старті); інакше 403;
+  GET  /healthz        — 200 {"ok": true, ...}, поки застосунок працює, інакше 503.
+
+Для перевірки без Telegram:
+  python -m handlers.webhook inject "текст" [порт]  — надіслати фейкове оновлення
+                                                     в запущений бот (з тим самим
+                                                     WEBHOOK_SECRET в env);
+  python -m handlers.webhook bench                  — латентність і CPU: polling
+                                                     проти webhook на локальному
+                                                     фейковому Bot API.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import signal
+import asyncio
+import logging
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger("test_bot.webhook")
+
+HEALTH_PATH = "/healthz"
+MAX_BODY = 1024 * 1024
+MAX_HEADERS = 64
+MAX_HEAD_BYTES = 16 * 1024   # request line + усі заголовки
+IDLE_TIMEOUT_S = 75.0        # очікування наступного запиту на keep-alive з'єднанні
+REQUEST_TIMEOUT_S = 10.0     # один дедлайн на заголовки і тіло запиту
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+            431: "Request Header Fields Too Large", 503: "Service Unavailable"}
+
+Response = Tuple[int, bytes]
+Handler = Callable[[str, str, Dict[str, str], bytes], Awaitable[Response]]
+
+_stats = {"received": 0, "rejected": 0, "bad_request": 0, "health": 0, "timeouts": 0}
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class _HttpServer:
+    """Найпростіший HTTP/1.1 сервер: request line, заголовки, тіло за Content-Length."""
+
+    def __init__(self, handler: Handler, host: str, port: int):
+        self._handler = handler
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        # limit обмежує довжину рядка для readline() — request line і кожного заголовка
+        self._server = await asyncio.start_server(self._client, self.host, self.port, limit=MAX_HEAD_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, status: int, body: bytes, keep_alive: bool) -> None:
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+    @staticmethod
+    async def _read_rest(reader: asyncio.StreamReader, used: int) -> Tuple[Dict[str, str], bytes]:
+        """Заголовки і тіло після request line; used — уже прочитані байти заголовної частини."""
+        headers: Dict[str, str] = {}
+        while True:
+            try:
+                h = await reader.readline()
+            except ValueError:  # рядок довший за limit
+                raise _BadRequest(431) from None
+            if h in (b"\r\n", b"\n"):
+                break
+            if not h:
+                raise asyncio.IncompleteReadError(b"", None)
+            used += len(h)
+            if used > MAX_HEAD_BYTES or len(headers) >= MAX_HEADERS:
+                raise _BadRequest(431)
+            k, sep, v = h.decode("latin-1").partition(":")
+            if not sep:
+                raise _BadRequest(400)
+            headers[k.strip().lower()] = v.strip()
+
+        if "transfer-encoding" in headers:
+            raise _BadRequest(411)
+        raw_length = headers.get("content-length", "0").strip() or "0"
+        if not raw_length.isdigit():
+            raise _BadRequest(400)  # від'ємний чи нечисловий Content-Length
+        length = int(raw_length)
+        if length > MAX_BODY:
+            raise _BadRequest(413)
+        body = await reader.readexactly(length) if length else b""
+        return headers, body
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT_S)
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    self._write(writer, 400, b"", False)
+                    break
+                try:
+                    headers, body = await asyncio.wait_for(self._read_rest(reader, len(line)), REQUEST_TIMEOUT_S)
+                except _BadRequest as e:
+                    self._write(writer, e.status, b"", False)
+                    await writer.drain()
+                    break
+                except asyncio.TimeoutError:
+                    _stats["timeouts"] += 1
+                    break
+
+                status, payload = await self._handler(method, target, headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                self._write(writer, status, payload if method != "HEAD" else b"", keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # ValueError — рядок довший за MAX_HEAD_BYTES (limit у readline)
+        except asyncio.CancelledError:
+            pass  # stop(): закриваємо keep-alive з'єднання
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+
+class WebhookServer:
+    """Приймає оновлення Telegram і кладе їх в application.update_queue."""
+
+    def __init__(self, application: Application, path: str, secret_token: Optional[str],
+                 host: str = "0.0.0.0", port: int = 8080):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self._http = _HttpServer(self._handle, host, port)
+        self._started = time.monotonic()
+
+    @property
+    def port(self) -> int:
+        return self._http.port
+
+    async def start(self) -> None:
+        await self._http.start()
+        self._started = time.monotonic()
+        logger.info("[WEBHOOK] listening on %s:%s%s", self._http.host, self._http.port, self.path)
+
+    async def stop(self) -> None:
+        await self._http.stop()
+
+    def _health(self) -> Response:
+        _stats["health"] += 1
+        app = self.application
+        body = {
+            "ok": bool(app.running),
+            "uptime_s": int(time.monotonic() - self._started),
+            "update_queue": app.update_queue.qsize(),
+            "received": _stats["received"],
+        }
+        return (200 if app.running else 503), json.dumps(body).encode()
+
+    async def _handle(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Response:
+        path = target.split("?", 1)[0]
+        if path == HEALTH_PATH and method in ("GET", "HEAD"):
+            return self._health()
+        if path != self.path:
+            return 404, b""
+        if method != "POST":
+            return 405, b""
+        if self.secret_token and not hmac.compare_digest(
+            headers.get("x-telegram-bot-api-secret-token", "").encode(), self.secret_token.encode()
+        ):
+            _stats["rejected"] += 1
+            logger.warning("[WEBHOOK] rejected request with wrong secret token")
+            return 403, b""
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            _stats["bad_request"] += 1
+            logger.warning("[WEBHOOK] bad update payload: %s", e)
+            return 400, b""
+        if update is None:
+            _stats["bad_request"] += 1
+            return 400, b""
+        _stats["received"] += 1
+        await self.application.update_queue.put(update)
+        return 200, b""
+
+
+# ===================== Конфіг і запуск =====================
+
+def webhook_config() -> Optional[Dict[str, Any]]:
+    """Параметри webhook з env; None — WEBHOOK_URL не задано (працюємо через polling)."""
+    url = (os.getenv("WEBHOOK_URL") or "").strip()
+    if not url:
+        return None
+    path = "/" + (os.getenv("WEBHOOK_PATH") or "telegram").strip().strip("/")
+    return {
+        "url": url.rstrip("/") + path,
+        "path": path,
+        "secret_token": (os.getenv("WEBHOOK_SECRET") or "").strip() or secrets.token_urlsafe(32),
+        "host": os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        "port": int(os.getenv("WEBHOOK_PORT", "8080")),
+        "max_connections": int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+    }
+
+
+async def _serve_webhook(application: Application, cfg: Dict[str, Any]) -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    server = WebhookServer(application, cfg["path"], cfg["secret_token"], cfg["host"], cfg["port"])
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.bot.set_webhook(
+            url=cfg["url"],
+            secret_token=cfg["secret_token"],
+            max_connections=cfg["max_connections"],
+            drop_pending_updates=True,
+        )
+        await application.start()
+        logger.info("[WEBHOOK] webhook set to %s", cfg["url"])
+        await stop.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application, cfg: Dict[str, Any]) -> None:
+    """Аналог application.run_polling(): ініціалізація, setWebhook, робота до SIGINT/SIGTERM."""
+    try:
+        asyncio.run(_serve_webhook(application, cfg))
+    except KeyboardInterrupt:
+        pass
+
+
+def webhook_stats() -> Dict[str, int]:
+    return dict(_stats)
+
+
+# ===================== Фейкові оновлення і бенчмарк =====================
+
+def fake_text_update(update_id: int, text: str, user_id: int = 1) -> Dict[str, Any]:
+    """JSON оновлення з текстовим повідомленням приватного чату (як від Telegram)."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+class UpdateInjector:
+    """Клієнт, що надсилає оновлення на webhook одним keep-alive з'єднанням."""
+
+    def __init__(self, host: str, port: int, path: str, secret_token: Optional[str]):
+        self.host, self.port, self.path, self.secret_token = host, port, path, secret_token
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def post(self, payload: Dict[str, Any]) -> int:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode()
+        head = (
+            f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        )
+        if self.secret_token:
+            head += f"X-Telegram-Bot-Api-Secret-Token: {self.secret_token}\r\n"
+        self._writer.write((head + "\r\n").encode("latin-1") + body)
+        await self._writer.drain()
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while True:
+            h = await self._reader.readline()
+            if h in (b"\r\n", b""):
+                break
+            if h.lower().startswith(b"content-length:"):
+                length = int(h.split(b":", 1)[1])
+        if length:
+            await self._reader.readexactly(length)
+        return status
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class _FakeBotApi:
+    """Локальний Bot API для бенчмарку: getMe, getUpdates (long poll), решта — true."""
+
+    def __init__(self):
+        self._http = _HttpServer(self._handle, "127.0.0.1", 0)
+        self._pending: List[Dict[str, Any]] = []
+        self._event = asyncio.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._http.port}/bot"
+
+    async def start(self) -> None:
+        await self._http.start()
+
+    async def stop(self) -> None:
+        await self._http.stop()
+
+    def push(self, update: Dict[str, Any]) -> None:
+        self._pending.append(update)
+        self._event.set()
+
+    async def _handle(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Response:
+        endpoint = target.rsplit("/", 1)[-1].split("?", 1)[0]
+        if "json" in headers.get("content-type", ""):
+            params = json.loads(body or b"{}")
+        else:
+            params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        if endpoint == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif endpoint == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            timeout = float(params.get("timeout") or 0)
+            self._pending = [u for u in self._pending if u["update_id"] >= offset]
+            if not self._pending and timeout:
+                self._event.clear()
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            result = self._pending[:100]
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+async def _benchmark(n_updates: int = 200, idle_s: float = 3.0) -> None:
+    """
+    Латентність «оновлення з'явилось → хендлер викликано» і CPU процесу в простої,
+    polling (poll_interval=0.1, як у bot.py) проти webhook. Оновлення йдуть
+    пачками по 5 з паузою 20 мс, як швидкі натискання кнопок кількома користувачами.
+    """
+    import random
+    from telegram.ext import TypeHandler
+
+    api = _FakeBotApi()
+    await api.start()
+    rnd = random.Random(1)
+
+    for mode in ("polling", "webhook"):
+        sent_at: Dict[int, float] = {}
+        latencies: List[float] = []
+        done = asyncio.Event()
+
+        async def _record(update: Update, _context) -> None:
+            latencies.append(time.perf_counter() - sent_at[update.update_id])
+            if len(latencies) >= n_updates:
+                done.set()
+
+        builder = Application.builder().token("1:bench").base_url(api.base_url)
+        if mode == "webhook":
+            builder = builder.updater(None)
+        app = builder.build()
+        app.add_handler(TypeHandler(Update, _record))
+        await app.initialize()
+        server = injector = None
+        if mode == "polling":
+            await app.updater.start_polling(poll_interval=0.1, timeout=10)
+        else:
+            server = WebhookServer(app, "/telegram", "bench-secret", "127.0.0.1", 0)
+            await server.start()
+            injector = UpdateInjector("127.0.0.1", server.port, "/telegram", "bench-secret")
+        await app.start()
+
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        await asyncio.sleep(idle_s)
+        idle_cpu = (time.process_time() - cpu0) / (time.perf_counter() - wall0) * 100
+
+        cpu0 = time.process_time()
+        for i in range(n_updates):
+            uid = 1000 + i
+            payload = fake_text_update(uid, f"bench {i}", user_id=1 + rnd.randrange(50))
+            sent_at[uid] = time.perf_counter()
+            if injector is not None:
+                await injector.post(payload)
+            else:
+                api.push(payload)
+            if i % 5 == 4:
+                await asyncio.sleep(0.02)
+        await asyncio.wait_for(done.wait(), 60)
+        busy_cpu_ms = (time.process_time() - cpu0) * 1000 / n_updates
+
+        if injector is not None:
+            await injector.close()
+        if server is not None:
+            await server.stop()
+        if app.updater is not None and app.updater.running:
+            await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+        print(f"{mode:8}: p50 {p50:7.2f} мс, p95 {p95:7.2f} мс, "
+              f"CPU {busy_cpu_ms:.2f} мс/оновлення, простій {idle_cpu:.2f}% CPU")
+
+    await api.stop()
+
+
+async def _inject(text: str, port: int) -> None:
+    cfg = webhook_config() or {}
+    path = cfg.get("path") or "/telegram"
+    injector = UpdateInjector("127.0.0.1", port, path, os.getenv("WEBHOOK_SECRET"))
+    status = await injector.post(fake_text_update(int(time.time()), text))
+    await injector.close()
+    print(f"POST {path} → {status}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "inject":
+        _text = sys.argv[2] if len(sys.argv) > 2 else "/start"
+        _port = int(sys.argv[3]) if len(sys.argv) > 3 else int(os.getenv("WEBHOOK_PORT", "8080"))
+        asyncio.run(_inject(_text, _port))
+    else:
+        asyncio.run(_benchmark())
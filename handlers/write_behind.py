@@ -0,0 +1,213 @@
+# handlers/write_behind.py
+"""
+Write-behind черга для записів у stats.db з гарячого шляху (кнопки відповідей).
+
+Замість commit() (а отже fsync) на кожне натискання записи складаються в чергу
+і скидаються однією транзакцією:
+  - щойно набралось DB_WRITE_BATCH_ROWS операцій (за замовчуванням 200), або
+  - через DB_WRITE_FLUSH_MS мс після першої операції пачки (за замовчуванням 200).
+
+Порядок операцій зберігається (вставка → видалення того самого рядка
+виконаються саме так). Читання, яким потрібні власні щойно зроблені записи
+користувача, викликають flush() — він чекає лише на операції, поставлені в
+чергу до виклику (за порядковим номером), а не на весь потік нових записів.
+
+Якщо транзакція пачки впала — відкат і повтор по одній операції, щоб
+«погана» операція не забрала з собою решту. При зупинці бота черга
+зливається повністю (shutdown() у post_shutdown).
+
+Метрики: stats() — глибина черги, кількість пачок/рядків, латентність скидання.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncContextManager, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("test_bot.db")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+# (sql, params, future | None)
+_Op = Tuple[str, Sequence[Any], Optional[asyncio.Future]]
+
+
+class WriteBehindQueue:
+    def __init__(self, transaction: Callable[[], AsyncContextManager[Any]],
+                 flush_ms: int = 200, batch_rows: int = 200):
+        # transaction() — контекст-менеджер транзакції на писачі (handlers.db)
+        self._transaction = transaction
+        self.flush_interval = flush_ms / 1000.0
+        self.batch_rows = batch_rows
+        self._ops: Deque[_Op] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # порядкові номери: поставлено в чергу / записано (успішно чи ні)
+        self._enqueued_seq = 0
+        self._done_seq = 0
+        # flush(): (номер останньої операції на момент виклику, future)
+        self._flush_waiters: List[Tuple[int, asyncio.Future]] = []
+        self._wakeup_now = False   # flush(): не чекати інтервал, писати одразу
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+            "max_batch": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    # ---------- публічний API ----------
+
+    def enqueue(self, sql: str, params: Sequence[Any] = (), want_result: bool = False) -> Optional[asyncio.Future]:
+        """
+        Поставити запис у чергу (без очікування диска).
+        want_result=True — повертає Future з lastrowid після commit.
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future() if want_result else None
+        self._ops.append((sql, tuple(params), fut))
+        self._stats["enqueued"] += 1
+        self._enqueued_seq += 1
+        self._ensure_task(loop)
+        self._wakeup.set()
+        return fut
+
+    async def flush(self) -> None:
+        """Дочекатися запису всього, що вже в черзі на момент виклику (read-your-writes)."""
+        target = self._enqueued_seq
+        if self._task is None or self._done_seq >= target:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._flush_waiters.append((target, fut))
+        self._wakeup_now = True
+        self._wakeup.set()
+        await fut
+
+    async def shutdown(self) -> None:
+        """Злити чергу і зупинити фонову задачу (post_shutdown)."""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        s = self.stats()
+        logger.info(
+            f"[DB_WB] drained: {s['written']} rows in {s['batches']} batches, "
+            f"avg flush {s['avg_flush_ms']} ms, failed {s['failed']}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        s = dict(self._stats)
+        s["depth"] = len(self._ops)
+        s["avg_flush_ms"] = round(s["total_flush_ms"] / s["batches"], 2) if s["batches"] else 0.0
+        s["last_flush_ms"] = round(s["last_flush_ms"], 2)
+        s["max_flush_ms"] = round(s["max_flush_ms"], 2)
+        s.pop("total_flush_ms")
+        return s
+
+    # ---------- фонове скидання ----------
+
+    def _ensure_task(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run(), name="db-write-behind")
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # збираємо пачку: до batch_rows або до спливання інтервалу
+            if not self._wakeup_now and len(self._ops) < self.batch_rows:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._ops) < self.batch_rows and not self._wakeup_now:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=left)
+                    except asyncio.TimeoutError:
+                        break
+            self._wakeup.clear()
+
+            while self._ops:
+                batch = [self._ops.popleft() for _ in range(min(self.batch_rows, len(self._ops)))]
+                try:
+                    await self._write_batch(batch)
+                finally:
+                    self._done_seq += len(batch)
+                    self._release_flushers()
+            self._wakeup_now = False
+
+    def _release_flushers(self) -> None:
+        """Відпустити flush(), чиї операції вже записані (нові операції їх не тримають)."""
+        if not self._flush_waiters:
+            return
+        waiting = []
+        for target, fut in self._flush_waiters:
+            if target <= self._done_seq:
+                if not fut.done():
+                    fut.set_result(None)
+            else:
+                waiting.append((target, fut))
+        self._flush_waiters = waiting
+
+    async def _write_batch(self, batch: list) -> None:
+        t0 = time.perf_counter()
+        results = []
+        try:
+            async with self._transaction() as conn:
+                for sql, params, _fut in batch:
+                    cur = await conn.execute(sql, params)
+                    results.append(cur.lastrowid)
+        except Exception as e:
+            logger.warning(f"[DB_WB] batch of {len(batch)} failed, retrying one by one: {e}")
+            results = []
+            for sql, params, _fut in batch:
+                try:
+                    async with self._transaction() as conn:
+                        cur = await conn.execute(sql, params)
+                    results.append(cur.lastrowid)
+                except Exception as e1:
+                    self._stats["failed"] += 1
+                    results.append(e1)
+                    logger.error("[DB_WB] op dropped: %s (%s)", sql, e1)
+
+        for (_sql, _params, fut), res in zip(batch, results):
+            if fut is not None and not fut.done():
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+
+        ms = (time.perf_counter() - t0) * 1000.0
+        st = self._stats
+        st["batches"] += 1
+        st["written"] += sum(1 for r in results if not isinstance(r, Exception))
+        st["max_batch"] = max(st["max_batch"], len(batch))
+        st["last_flush_ms"] = ms
+        st["max_flush_ms"] = max(st["max_flush_ms"], ms)
+        st["total_flush_ms"] += ms
+
+
+def create_write_queue(transaction: Callable[[], AsyncContextManager[Any]]) -> WriteBehindQueue:
+    """Черга з параметрами з оточення: DB_WRITE_FLUSH_MS, DB_WRITE_BATCH_ROWS."""
+    return WriteBehindQueue(
+        transaction,
+        flush_ms=_env_int("DB_WRITE_FLUSH_MS", 200),
+        batch_rows=_env_int("DB_WRITE_BATCH_ROWS", 200),
+    )
@@ -1,42 +1,22 @@
 # handlers/wrong_answers.py
-import os
-import aiosqlite
 import logging
 from typing import List, Tuple, Optional
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 
-logger = logging.getLogger("test_bot.wrong")
-
-DB_PATH = os.path.join(os.path.dirname(__file__), "..", "stats.db")
-
-
-# ===================== DB helpers =====================
-
-async def _ensure_table(conn: aiosqlite.Connection):
-    """Create table for wrong answers if it doesn't exist."""
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS wrong_answers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            test_name TEXT NOT NULL,
-            q_index INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, test_name, q_index) ON CONFLICT IGNORE
-        );
-    """)
-    await conn.execute("CREATE INDEX IF NOT EXISTS idx_wa_user_test ON wrong_answers(user_id, test_name);")
-    await conn.commit()
-
-
-async def _get_conn() -> aiosqlite.Connection:
-    conn = await aiosqlite.connect(DB_PATH)
-    await _ensure_table(conn)
-    return conn
+from handlers.statistics_db import (
+    add_wrong_answer,
+    get_wrong_counts_by_test,
+    get_wrong_indices_by_test,
+    clear_wrong_for_test as _db_clear_wrong_for_test,
+)
+from handlers.quiz_session import QuizSession
 
+logger = logging.getLogger("test_bot.wrong")
 
 # ===================== Public API (used by other handlers) =====================
+# Схема wrong_answers і підключення — у handlers.statistics_db / handlers.db.
 
 async def record_wrong_answer(user_id: int, test_name: str, q_index: int) -> None:
     """
@@ -45,70 +25,23 @@ async def record_wrong_answer(user_id: int, test_name: str, q_index: int) -> Non
     """
     if not test_name or q_index is None:
         return
-    try:
-        conn = await _get_conn()
-        await conn.execute(
-            "INSERT OR IGNORE INTO wrong_answers(user_id, test_name, q_index) VALUES(?,?,?)",
-            (user_id, test_name, int(q_index))
-        )
-        await conn.commit()
-        await conn.close()
-    except Exception as e:
-        logger.warning("[WRONG] record failed: %s", e)
+    await add_wrong_answer(user_id, test_name, int(q_index))
 
 
 async def get_wrong_tests(user_id: int) -> List[Tuple[str, int]]:
     """Return list of (test_name, count_wrong) for the user."""
-    try:
-        conn = await _get_conn()
-        async with conn.execute("""
-            SELECT test_name, COUNT(*) AS cnt
-            FROM wrong_answers
-            WHERE user_id=?
-            GROUP BY test_name
-            ORDER BY test_name
-        """, (user_id,)) as cur:
-            rows = await cur.fetchall()
-        await conn.close()
-        return [(r[0], r[1]) for r in rows]
-    except Exception as e:
-        logger.warning("[WRONG] get_wrong_tests failed: %s", e)
-        return []
+    rows = await get_wrong_counts_by_test(user_id)
+    return [(r["test_name"], r["count"]) for r in rows]
 
 
 async def get_wrong_indices(user_id: int, test_name: str) -> List[int]:
     """Return list of q_index for a user & test (sorted asc)."""
-    try:
-        conn = await _get_conn()
-        async with conn.execute("""
-            SELECT q_index
-            FROM wrong_answers
-            WHERE user_id=? AND test_name=?
-            ORDER BY q_index
-        """, (user_id, test_name)) as cur:
-            rows = await cur.fetchall()
-        await conn.close()
-        return [int(r[0]) for r in rows]
-    except Exception as e:
-        logger.warning("[WRONG] get_wrong_indices failed: %s", e)
-        return []
+    return [int(i) for i in await get_wrong_indices_by_test(user_id, test_name)]
 
 
 async def clear_wrong_for_test(user_id: int, test_name: str) -> int:
     """Delete wrong answers for a test; return deleted count."""
-    try:
-        conn = await _get_conn()
-        cur = await conn.execute(
-            "DELETE FROM wrong_answers WHERE user_id=? AND test_name=?",
-            (user_id, test_name)
-        )
-        await conn.commit()
-        deleted = cur.rowcount or 0
-        await conn.close()
-        return max(deleted, 0)
-    except Exception as e:
-        logger.warning("[WRONG] clear failed: %s", e)
-        return 0
+    return max(await _db_clear_wrong_for_test(user_id, test_name), 0)
 
 
 # ===================== UI builders =====================
@@ -225,12 +158,7 @@ async def wa_buttons_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Start session with only these indices
         if cmd == "wa_mode_learn":
             order = sorted(indices)
-            context.user_data["mode"] = "learning"
-            context.user_data["order"] = order
-            context.user_data["step"] = 0
-            context.user_data["score"] = 0
-            context.user_data["wrong_pairs"] = []
-            context.user_data["current_streak"] = 0
+            QuizSession.start(context.user_data, "learning", order)
 
             # reset live message anchors
             context.user_data.pop("question_chat_id", None)
@@ -246,15 +174,7 @@ async def wa_buttons_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
             order = list(indices)
             random.shuffle(order)
 
-            context.user_data["mode"] = "test"
-            context.user_data["order"] = order
-            context.user_data["step"] = 0
-            context.user_data["score"] = 0
-            context.user_data["wrong_pairs"] = []
-            context.user_data["current_streak"] = 0
-
-            from datetime import datetime
-            context.user_data["start_time"] = datetime.now()
+            QuizSession.start(context.user_data, "test", order)
 
             from handlers.testing import _show_question
             await q.message.reply_text("📝 Стартуємо тест тільки по помилках!", reply_markup=None)
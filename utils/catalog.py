@@ -0,0 +1,564 @@
+# utils/catalog.py
+"""
+Інкрементальний каталог тестів.
+
+Замість повного os.walk + json.load кожного тесту на кожне оновлення:
+  - один прохід os.scandir по дереву будує і плаский каталог, і дерево розділів;
+  - для кожного JSON тримаємо відбиток (mtime_ns, size) і перечитуємо лише змінені файли;
+  - стан зберігаємо у снапшот (<root>/_catalog_snapshot.json), тож холодний
+    старт не парсить увесь банк питань заново.
+
+Якщо працює watcher (utils.catalog_watcher), refresh() не обходить дерево:
+зміни доставляються подіями у apply_changes(), кожна зміна збільшує version
+і сповіщає слухачів (add_listener) — для інвалідації залежних кешів.
+
+Каталог тримає лише метадані (кількість питань, хеш вмісту, шляхи); тіла питань
+підвантажуються на вимогу через utils.question_cache.load_questions(entry["json_path"]).
+
+Під час того ж читання будується інвертований індекс тем кожного файла
+(topic.lower() -> відсортовані індекси питань) і глобальний список тем:
+/topics і пули за темою не проходять по всіх питаннях (all_topics, topic_indices).
+
+Семантика та сама, що й у discover_tests / discover_tests_hierarchy:
+  - приховані (#/_/.) теки та файли ігноруються, службові JSON теж;
+  - теки медіа тестів і *.comments не показуються у дереві, але JSON усередині
+    них усе одно потрапляють у каталог;
+  - при дублікатах назв лишається перший тест у порядку обходу.
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.loader import TESTS_ROOT, _is_hidden_name, _is_ignored_json
+
+logger = logging.getLogger("test_bot")
+
+SNAPSHOT_NAME = "_catalog_snapshot.json"
+SNAPSHOT_VERSION = 3
+
+_EMPTY_INDICES = array("I")
+
+
+def _snapshot_path_for(root_dir: str) -> Optional[str]:
+    """
+    CATALOG_SNAPSHOT: тека для снапшотів; "0"/"off" — вимкнути. Кожен корінь має
+    власний файл _catalog_snapshot.<хеш кореня>.json, тож каталоги різних коренів
+    не перезаписують снапшоти один одного. Шлях до .json — шаблон імені
+    (<ім'я>.<хеш кореня>.json поруч).
+    За замовчуванням — <root>/_catalog_snapshot.json (прихований, як _owners.json).
+    """
+    env = (os.getenv("CATALOG_SNAPSHOT") or "").strip()
+    if env.lower() in ("0", "off", "false", "no"):
+        return None
+    if not env:
+        return os.path.join(root_dir, SNAPSHOT_NAME)
+    root_key = hashlib.sha1(os.path.abspath(root_dir).encode("utf-8")).hexdigest()[:12]
+    if env.lower().endswith(".json"):
+        stem, ext = os.path.splitext(env)
+        return f"{stem}.{root_key}{ext}"
+    stem, ext = os.path.splitext(SNAPSHOT_NAME)
+    return os.path.join(env, f"{stem}.{root_key}{ext}")
+
+
+class _FileRecord:
+    __slots__ = ("mtime_ns", "size", "total", "hash", "topics", "labels")
+
+    def __init__(self, mtime_ns: int, size: int, total: int, content_hash: str,
+                 topics: Optional[Dict[str, array]] = None, labels: Tuple[str, ...] = ()):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.total = total
+        self.hash = content_hash
+        # інвертований індекс тем: topic.lower() -> відсортовані індекси питань
+        self.topics: Dict[str, array] = topics or {}
+        # теми як вони записані у файлі (для списку /topics)
+        self.labels = labels
+
+
+def _topic_index(items: list) -> Tuple[Dict[str, array], Tuple[str, ...]]:
+    topics: Dict[str, array] = {}
+    labels = set()
+    for i, q in enumerate(items):
+        if not isinstance(q, dict):
+            continue
+        tps = q.get("topics")
+        if not isinstance(tps, list):
+            continue
+        for tp in tps:
+            if not isinstance(tp, str):
+                continue
+            tp_clean = tp.strip()
+            if not tp_clean:
+                continue
+            labels.add(tp_clean)
+            arr = topics.setdefault(tp_clean.lower(), array("I"))
+            if not arr or arr[-1] != i:
+                arr.append(i)
+    return topics, tuple(sorted(labels))
+
+
+def _read_meta(path: str) -> Tuple[int, str, Dict[str, array], Tuple[str, ...]]:
+    """(кількість питань, хеш вмісту, індекс тем, теми) — JSON парситься, але не зберігається."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except Exception as e:
+        logger.error(f"[LOADER] Failed to load {path}: {e}")
+        return 0, "", {}, ()
+    content_hash = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    try:
+        data = json.loads(raw.decode("utf-8"))
+    except Exception as e:
+        logger.error(f"[LOADER] Failed to load {path}: {e}")
+        return 0, content_hash, {}, ()
+    # теми збираємо і з історичного формату {"items": [...]}, як collect_all_topics_for_all_tests
+    if isinstance(data, list):
+        items = data
+    elif isinstance(data, dict) and isinstance(data.get("items"), list):
+        items = data["items"]
+    else:
+        items = []
+    topics, labels = _topic_index(items)
+    return (len(data) if isinstance(data, list) else 0), content_hash, topics, labels
+
+
+class TestCatalog:
+    """Каталог одного кореня тестів (див. get_catalog)."""
+
+    def __init__(self, root_dir: str = TESTS_ROOT, snapshot_path: Optional[str] = None):
+        self.root_dir = root_dir
+        self.root_abs = os.path.abspath(root_dir)
+        self.snapshot_path = snapshot_path
+        self._records: Dict[str, _FileRecord] = {}   # rel_json_path -> record
+        self._entries: Dict[str, dict] = {}          # rel_json_path -> entry (стабільний об'єкт)
+        self._dirs: list = []                        # результат останнього обходу
+        self._files: list = []
+        self._file_pos: Dict[str, int] = {}          # rel_json_path -> позиція у self._files
+        self._signature = None
+        self._catalog: Dict[str, dict] = {}
+        self._tree: Optional[dict] = None
+        self._snapshot_loaded = False
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._listeners: List[Callable[[int, List[str]], None]] = []
+        # глобальний список тем: тема -> у скількох файлах зустрічається
+        self._topic_refs: Dict[str, int] = {}
+        self._topics_sorted: Optional[List[str]] = None
+        # версія каталогу: +1 при кожній зміні (для інвалідації залежних кешів)
+        self.version = 0
+        # True, поки зміни ФС доставляє watcher (utils.catalog_watcher) —
+        # тоді refresh() не обходить дерево, а бере готовий стан
+        self.watched = False
+        self.stats = {"refreshes": 0, "rescans": 0, "file_updates": 0,
+                      "parsed": 0, "reused": 0, "snapshot_hits": 0}
+
+    # ---------- public ----------
+
+    def refresh(self, rescan: Optional[bool] = None) -> Tuple[Dict[str, dict], dict]:
+        """
+        Повертає (catalog, tree).
+        Без watcher-а — звіряє ФС (обхід + перечитування лише змінених JSON).
+        З watcher-ом — готовий стан, O(1); rescan=True примусово звіряє ФС.
+        """
+        changed: List[str] = []
+        with self._lock:
+            self.stats["refreshes"] += 1
+            if rescan is None:
+                rescan = not self.watched or self._tree is None
+            if rescan:
+                changed = self._rescan()
+            catalog, tree, version = self._catalog, self._tree, self.version
+        if changed:
+            self._notify(version, changed)
+        return catalog, tree
+
+    def apply_changes(self, paths: Iterable[str], structural: bool = False) -> None:
+        """
+        Події ФС від watcher-а. Зміни вмісту відомих JSON — оновлюємо лише ці
+        файли (O(змінених)); створення/видалення/переміщення — звіряємо дерево.
+        """
+        paths = list(paths)
+        changed: List[str] = []
+        with self._lock:
+            if structural or self._tree is None:
+                changed = self._rescan()
+            else:
+                changed = self._update_files(paths)
+            version = self.version
+        if changed:
+            self._notify(version, changed)
+
+    def add_listener(self, callback: Callable[[int, List[str]], None]) -> None:
+        """callback(version, changed_json_paths) — після кожної зміни каталогу."""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[int, List[str]], None]) -> None:
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def catalog(self) -> Dict[str, dict]:
+        return self.refresh()[0]
+
+    def tree(self) -> dict:
+        return self.refresh()[1]
+
+    # ---------- topics ----------
+
+    def all_topics(self) -> List[str]:
+        """Усі теми з усіх JSON (унікальні, відсортовані без урахування регістру)."""
+        with self._lock:
+            if self._topics_sorted is None:
+                self._topics_sorted = sorted(self._topic_refs, key=lambda tp: (tp.lower(), tp))
+            return self._topics_sorted
+
+    def topic_indices(self, json_path: str, topic: str,
+                      fingerprint: Optional[Tuple[int, int]] = None) -> Optional[array]:
+        """
+        Відсортовані індекси питань файла з темою topic (без урахування регістру).
+        None — файла немає в каталозі або відбиток (mtime_ns, size) не збігся
+        (тоді викликач має порахувати сам).
+        """
+        rel = os.path.relpath(json_path, self.root_dir)
+        with self._lock:
+            rec = self._records.get(rel)
+            if rec is None or (fingerprint is not None and fingerprint != (rec.mtime_ns, rec.size)):
+                return None
+            return rec.topics.get(topic.strip().lower(), _EMPTY_INDICES)
+
+    def content_hash(self, json_path: str) -> Optional[str]:
+        """Хеш вмісту JSON з каталогу (None — файла немає в каталозі)."""
+        rel = os.path.relpath(json_path, self.root_dir)
+        with self._lock:
+            rec = self._records.get(rel)
+            return rec.hash if rec is not None else None
+
+    def _set_record(self, rel: str, rec: "_FileRecord") -> None:
+        self._drop_record(rel)
+        self._records[rel] = rec
+        for label in rec.labels:
+            n = self._topic_refs.get(label, 0)
+            if n == 0:
+                self._topics_sorted = None
+            self._topic_refs[label] = n + 1
+
+    def _drop_record(self, rel: str) -> None:
+        old = self._records.pop(rel, None)
+        if old is None:
+            return
+        for label in old.labels:
+            n = self._topic_refs.get(label, 0) - 1
+            if n <= 0:
+                self._topic_refs.pop(label, None)
+                self._topics_sorted = None
+            else:
+                self._topic_refs[label] = n
+
+    # ---------- update ----------
+
+    def _rescan(self) -> List[str]:
+        """Повний обхід ФС; парсяться лише змінені JSON. Повертає змінені шляхи."""
+        if not self._snapshot_loaded:
+            self._load_snapshot()
+            self._snapshot_loaded = True
+
+        dirs, files = self._walk()
+        self.stats["rescans"] += 1
+
+        changed: List[str] = []
+        seen = set()
+        for i, (rel, path, dir_path, base_name, images_dir, mtime_ns, size) in enumerate(files):
+            seen.add(rel)
+            rec = self._records.get(rel)
+            if rec is None or rec.mtime_ns != mtime_ns or rec.size != size or mtime_ns < 0:
+                # mtime_ns < 0: stat не вдався — перечитуємо щоразу
+                self._set_record(rel, _FileRecord(mtime_ns, size, *_read_meta(path)))
+                self._dirty = True
+                self._entries.pop(rel, None)
+                self.stats["parsed"] += 1
+                changed.append(path)
+            else:
+                self.stats["reused"] += 1
+
+        for rel in [r for r in self._records if r not in seen]:
+            self._drop_record(rel)
+            self._entries.pop(rel, None)
+            self._dirty = True
+            changed.append(os.path.join(self.root_dir, rel))
+
+        self._dirs, self._files = dirs, files
+        self._file_pos = {f[0]: i for i, f in enumerate(files)}
+        if self._rebuild() or changed:
+            self.version += 1
+            if not changed:
+                # змінилась лише структура тек / теки медіа
+                changed = [self.root_dir]
+
+        if self._dirty:
+            self._save_snapshot()
+        return changed
+
+    def _update_files(self, paths: List[str]) -> List[str]:
+        changed: List[str] = []
+        for p in paths:
+            rel = os.path.relpath(p, self.root_dir)
+            pos = self._file_pos.get(rel)
+            if pos is None:
+                # невідомий файл — хай розбирається повний обхід
+                return self._rescan()
+            _rel, path, dir_path, base_name, images_dir, mtime_ns, size = self._files[pos]
+            try:
+                st = os.stat(path)
+            except OSError:
+                return self._rescan()
+            if st.st_mtime_ns == mtime_ns and st.st_size == size:
+                continue
+            self._set_record(rel, _FileRecord(st.st_mtime_ns, st.st_size, *_read_meta(path)))
+            self._entries.pop(rel, None)
+            self._files[pos] = (rel, path, dir_path, base_name, images_dir, st.st_mtime_ns, st.st_size)
+            self._dirty = True
+            self.stats["parsed"] += 1
+            self.stats["file_updates"] += 1
+            changed.append(path)
+
+        if changed:
+            self._rebuild()
+            self.version += 1
+        if self._dirty:
+            self._save_snapshot()
+        return changed
+
+    def _rebuild(self) -> bool:
+        """Перебудова catalog/tree з поточних dirs/files; атомарна заміна. True — якщо змінились."""
+        sig_files = tuple((f[0], f[5], f[6], f[4]) for f in self._files)
+        signature = (tuple((d[0], d[1]) for d in self._dirs), sig_files)
+        if signature == self._signature and self._tree is not None:
+            return False
+        catalog = self._build_catalog(self._files)
+        tree = self._build_tree(self._dirs, catalog)
+        # атомарна заміна: читачі бачать або старий, або новий стан
+        self._catalog, self._tree, self._signature = catalog, tree, signature
+        return True
+
+    def _notify(self, version: int, changed: List[str]) -> None:
+        for cb in list(self._listeners):
+            try:
+                cb(version, changed)
+            except Exception as e:
+                logger.warning(f"[CATALOG] listener failed: {e}")
+
+    # ---------- walk ----------
+
+    def _walk(self):
+        """
+        Обхід у тому ж порядку, що й os.walk (top-down, без symlink-тек).
+        dirs:  [(abs_dir, parent_idx, name)]
+        files: [(rel, path, dir_path, base_name, images_dir, mtime_ns, size)]
+        """
+        dirs: List[Tuple[str, int, str]] = []
+        files: list = []
+
+        def visit(dir_path: str, parent_idx: int, name: str) -> None:
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = list(it)
+            except OSError:
+                return
+            idx = len(dirs)
+            dirs.append((os.path.abspath(dir_path), parent_idx, name))
+
+            subdir_names = set()
+            recurse = []
+            json_entries = []
+            for e in entries:
+                try:
+                    is_dir = e.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    subdir_names.add(os.path.normcase(e.name))
+                    if not _is_hidden_name(e.name) and not e.is_symlink():
+                        recurse.append(e)
+                    continue
+                fname = e.name
+                if _is_hidden_name(fname) or not fname.lower().endswith(".json") or _is_ignored_json(fname):
+                    continue
+                json_entries.append(e)
+
+            for e in json_entries:
+                base_name = os.path.splitext(e.name)[0]
+                images_dir = None
+                for cand in (base_name, f"#{base_name}", f"_{base_name}"):
+                    if os.path.normcase(cand) in subdir_names:
+                        images_dir = os.path.join(dir_path, cand)
+                        break
+                try:
+                    st = e.stat()
+                    mtime_ns, size = st.st_mtime_ns, st.st_size
+                except OSError:
+                    mtime_ns, size = -1, -1
+                path = os.path.join(dir_path, e.name)
+                rel = os.path.relpath(path, self.root_dir)
+                files.append((rel, path, dir_path, base_name, images_dir, mtime_ns, size))
+
+            for e in recurse:
+                visit(os.path.join(dir_path, e.name), idx, e.name)
+
+        visit(self.root_dir, -1, "")
+        return dirs, files
+
+    # ---------- build ----------
+
+    def _build_catalog(self, files) -> Dict[str, dict]:
+        catalog: Dict[str, dict] = {}
+        for rel, path, dir_path, base_name, images_dir, _mtime, _size in files:
+            if base_name in catalog:
+                logger.warning(f"[LOADER] Duplicate test name '{base_name}' at {path}. Keeping first occurrence.")
+                continue
+            entry = self._entries.get(rel)
+            if entry is None or entry["images_dir"] != images_dir:
+                rec = self._records[rel]
+                entry = {
+                    "total": rec.total,
+                    "hash": rec.hash,
+                    "images_dir": images_dir,
+                    "dir": dir_path,
+                    "json_path": path,
+                }
+                self._entries[rel] = entry
+            catalog[base_name] = entry
+        logger.debug(f"[LOADER] discover_tests: loaded {len(catalog)} tests")
+        return catalog
+
+    def _build_tree(self, dirs, catalog: Dict[str, dict]) -> dict:
+        root_abs = self.root_abs
+        images_dirs = {
+            os.path.abspath(e["images_dir"]) for e in catalog.values() if e.get("images_dir")
+        }
+
+        def make_node(dir_path: str) -> dict:
+            return {"subdirs": {}, "tests": [], "dir": dir_path}
+
+        root = make_node(root_abs)
+
+        def ensure_node(parts: List[str]) -> dict:
+            node = root
+            cur = root_abs
+            for p in parts:
+                cur = os.path.join(cur, p)
+                if p not in node["subdirs"]:
+                    node["subdirs"][p] = make_node(cur)
+                node = node["subdirs"][p]
+            return node
+
+        # 1) усі видимі теки (включно з порожніми); теки медіа та *.comments — разом із піддеревом
+        visible: List[bool] = []
+        for abs_dir, parent_idx, name in dirs:
+            if parent_idx < 0:
+                visible.append(True)
+                continue
+            ok = (
+                visible[parent_idx]
+                and abs_dir not in images_dirs
+                and not name.lower().endswith(".comments")
+            )
+            visible.append(ok)
+            if ok:
+                rel = os.path.relpath(abs_dir, root_abs)
+                ensure_node(rel.split(os.sep))
+
+        # 2) тести по своїх теках
+        for test_name, entry in catalog.items():
+            rel = os.path.relpath(os.path.abspath(entry["dir"]), root_abs)
+            parts = [] if rel == "." else rel.split(os.sep)
+            ensure_node(parts)["tests"].append(test_name)
+
+        # 3) сортування для стабільного вигляду
+        def sort_node(n: dict):
+            n["tests"].sort()
+            for key in sorted(n["subdirs"].keys()):
+                sort_node(n["subdirs"][key])
+
+        sort_node(root)
+        return root
+
+    # ---------- snapshot ----------
+
+    def _load_snapshot(self) -> None:
+        path = self.snapshot_path
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+                return
+            for rel, item in (data.get("files") or {}).items():
+                self._set_record(rel, _FileRecord(
+                    int(item["mtime_ns"]), int(item["size"]), int(item["total"]), str(item["hash"]),
+                    {k: array("I", v) for k, v in (item.get("topics") or {}).items()},
+                    tuple(item.get("labels") or ()),
+                ))
+            self.stats["snapshot_hits"] = len(self._records)
+            logger.info(f"[CATALOG] Snapshot loaded: {len(self._records)} files from {path}")
+        except Exception as e:
+            logger.warning(f"[CATALOG] Snapshot ignored ({path}): {e}")
+            for rel in list(self._records):
+                self._drop_record(rel)
+
+    def _save_snapshot(self) -> None:
+        path = self.snapshot_path
+        self._dirty = False
+        if not path:
+            return
+        payload = {
+            "version": SNAPSHOT_VERSION,
+            "files": {
+                rel: {
+                    "mtime_ns": r.mtime_ns, "size": r.size, "total": r.total, "hash": r.hash,
+                    "topics": {k: v.tolist() for k, v in r.topics.items()},
+                    "labels": list(r.labels),
+                }
+                for rel, r in self._records.items()
+            },
+        }
+        tmp = None
+        try:
+            d = os.path.dirname(os.path.abspath(path))
+            os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix="._catalog_", suffix=".tmp", dir=d)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, path)
+            tmp = None
+        except Exception as e:
+            logger.warning(f"[CATALOG] Snapshot save failed ({path}): {e}")
+        finally:
+            if tmp and os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+
+# ====== реєстр каталогів за коренем ======
+
+_catalogs: Dict[str, TestCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(root_dir: str = TESTS_ROOT) -> TestCatalog:
+    key = os.path.abspath(root_dir)
+    with _catalogs_lock:
+        cat = _catalogs.get(key)
+        if cat is None:
+            cat = TestCatalog(root_dir, _snapshot_path_for(root_dir))
+            _catalogs[key] = cat
+        return cat
@@ -0,0 +1,202 @@
+# utils/catalog_watcher.py
+"""
+Watcher теки тестів: доставляє зміни ФС у каталог (utils.catalog) без повних пересканів.
+
+Режими (змінна CATALOG_WATCH):
+  0 / off   — вимкнено (за замовчуванням): каталог звіряється з ФС при кожному refresh();
+  1 / auto  — inotify через пакет `watchdog`, якщо встановлений, інакше опитування;
+  poll      — лише опитування (фоновий обхід раз на CATALOG_WATCH_INTERVAL секунд).
+
+Поки watcher активний, refresh() повертає готовий стан за O(1), а події:
+  - зміна вмісту відомого JSON → перечитується лише цей файл;
+  - створення/видалення/переміщення файлів і тек → звірка дерева (парсяться лише змінені JSON).
+Події групуються (CATALOG_WATCH_DEBOUNCE_MS), після застосування каталог
+збільшує version і сповіщає слухачів (кеш питань, індекс тем тощо).
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from utils.catalog import TestCatalog, get_catalog
+from utils.loader import TESTS_ROOT, _is_hidden_name, _is_ignored_json
+from utils.question_cache import invalidate_questions
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:  # pragma: no cover - опційна залежність
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+logger = logging.getLogger("test_bot")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "CatalogWatcher"):
+        super().__init__()
+        self._watcher = watcher
+
+    def on_any_event(self, event):
+        etype = event.event_type
+        if etype in ("opened", "closed_no_write"):
+            return
+        paths = [event.src_path]
+        dest = getattr(event, "dest_path", None)
+        if dest:
+            paths.append(dest)
+        if event.is_directory:
+            # "modified" для теки = змінився її вміст; самі файли прийдуть окремими подіями
+            if etype == "modified":
+                return
+            self._watcher.push(paths, structural=True)
+            return
+        relevant = [p for p in paths if self._watcher.is_relevant_json(p)]
+        if relevant:
+            self._watcher.push(relevant, structural=etype not in ("modified", "closed"))
+
+
+class CatalogWatcher:
+    def __init__(self, catalog: TestCatalog, mode: str = "auto",
+                 interval: float = 5.0, debounce: float = 0.3):
+        self.catalog = catalog
+        self.mode = "inotify" if (mode == "auto" and WATCHDOG_AVAILABLE) else "poll"
+        self.interval = max(0.5, interval)
+        self.debounce = max(0.0, debounce)
+        self._pending: Dict[str, bool] = {}   # path -> structural
+        self._last_event = 0.0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"events": 0, "batches": 0, "polls": 0}
+
+    # ---------- lifecycle ----------
+
+    def start(self) -> None:
+        # перший повний обхід — щоб далі працювати лише зі змінами
+        self.catalog.refresh(rescan=True)
+        if self.mode == "inotify":
+            self._observer = Observer()
+            self._observer.schedule(_EventHandler(self), self.catalog.root_abs, recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+            target = self._flush_loop
+        else:
+            target = self._poll_loop
+        self._thread = threading.Thread(target=target, name="catalog-watcher", daemon=True)
+        self._thread.start()
+        self.catalog.watched = True
+        logger.info(f"[CATALOG] watcher started ({self.mode}) for {self.catalog.root_abs}")
+
+    def stop(self) -> None:
+        self.catalog.watched = False
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+                self._observer.join(timeout=2)
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        logger.info("[CATALOG] watcher stopped")
+
+    # ---------- events ----------
+
+    def is_relevant_json(self, path: str) -> bool:
+        name = os.path.basename(path)
+        if not name.lower().endswith(".json") or _is_ignored_json(name):
+            return False
+        rel = os.path.relpath(path, self.catalog.root_abs)
+        return not any(_is_hidden_name(part) for part in rel.split(os.sep))
+
+    def push(self, paths: List[str], structural: bool) -> None:
+        with self._cond:
+            for p in paths:
+                self._pending[p] = self._pending.get(p, False) or structural
+            self._last_event = time.monotonic()
+            self.stats["events"] += 1
+            self._cond.notify()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._pending and not self._stop.is_set():
+                    self._cond.wait()
+                # чекаємо «тишу», щоб зібрати пачку подій (збереження файла = кілька подій)
+                while not self._stop.is_set():
+                    quiet = time.monotonic() - self._last_event
+                    if quiet >= self.debounce:
+                        break
+                    self._cond.wait(self.debounce - quiet)
+                batch, self._pending = self._pending, {}
+            if not batch or self._stop.is_set():
+                continue
+            self.stats["batches"] += 1
+            try:
+                self.catalog.apply_changes(batch.keys(), structural=any(batch.values()))
+            except Exception as e:
+                logger.warning(f"[CATALOG] apply_changes failed: {e}")
+
+    def _poll_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.stats["polls"] += 1
+            try:
+                self.catalog.refresh(rescan=True)
+            except Exception as e:
+                logger.warning(f"[CATALOG] poll rescan failed: {e}")
+
+
+def _invalidate_question_cache(version: int, changed: List[str]) -> None:
+    for p in changed:
+        if p.lower().endswith(".json"):
+            invalidate_questions(p)
+
+
+_watchers: Dict[str, CatalogWatcher] = {}
+
+
+def start_catalog_watcher(root_dir: str = TESTS_ROOT) -> Optional[CatalogWatcher]:
+    """Запускає watcher згідно з CATALOG_WATCH; None — якщо вимкнено."""
+    mode = (os.getenv("CATALOG_WATCH") or "0").strip().lower()
+    if mode in ("", "0", "off", "false", "no"):
+        return None
+    if mode in ("1", "on", "true", "yes", "inotify"):
+        mode = "auto"
+    if mode == "auto" and not WATCHDOG_AVAILABLE:
+        logger.info("[CATALOG] watchdog is not installed — falling back to polling")
+
+    catalog = get_catalog(root_dir)
+    key = catalog.root_abs
+    if key in _watchers:
+        return _watchers[key]
+    watcher = CatalogWatcher(
+        catalog,
+        mode="auto" if mode == "auto" else "poll",
+        interval=_env_float("CATALOG_WATCH_INTERVAL", 5.0),
+        debounce=_env_float("CATALOG_WATCH_DEBOUNCE_MS", 300.0) / 1000.0,
+    )
+    catalog.add_listener(_invalidate_question_cache)
+    watcher.start()
+    _watchers[key] = watcher
+    return watcher
+
+
+def stop_catalog_watchers() -> None:
+    while _watchers:
+        _key, watcher = _watchers.popitem()
+        watcher.catalog.remove_listener(_invalidate_question_cache)
+        watcher.stop()
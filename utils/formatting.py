@@ -1,6 +1,8 @@
 import html
 from typing import Dict, Any, Optional, Tuple, List
 
+from utils.question import Question, correct_index
+
 def _escape(s: str) -> str:
     return html.escape(s or "")
 
@@ -37,46 +39,50 @@ def format_question_text(
       - show_topics: показувати topics над питанням
     """
     parts: List[str] = []
+    letters = ["A", "B", "C", "D"]  # у тебе клавіатура під 4 варіанти
+
+    if isinstance(q, Question):
+        # Швидкий шлях: усе вже розібрано при компіляції тесту
+        topics = q.topics
+        q_text = q.text
+        ans_texts = q.answer_texts
+        correct_idx = q.correct_idx
+        explanation = q.explanation
+    else:
+        topics = q.get("topics") if isinstance(q.get("topics"), list) else []
+        q_text = q.get('question', '')
+        answers = q.get("answers", [])
+        # Визначаємо індекс правильної відповіді (для формату [{text,correct}])
+        # або альтернативні історичні формати (якщо раптом)
+        correct_idx = correct_index(q)
+        ans_texts = []
+        for i, a in enumerate(answers or []):
+            if i >= len(letters):
+                break
+            # Витягуємо текст варіанту
+            if isinstance(a, dict):
+                ans_text = a.get("text") or a.get("answer") or a.get("value") or a.get("content") or ""
+                if not isinstance(ans_text, str):
+                    ans_text = str(ans_text)
+            else:
+                ans_text = str(a)
+            ans_texts.append(ans_text)
+        explanation = q.get("explanation") or ""
 
     # --- ТЕМИ (теги) ---
-    topics = q.get("topics") if isinstance(q.get("topics"), list) else []
     if show_topics and topics:
         parts.append(_format_topics(topics))
 
     # --- ТЕКСТ ПИТАННЯ ---
-    parts.append(f"<b>{_escape(q.get('question',''))}</b>\n\n")
+    parts.append(f"<b>{_escape(q_text)}</b>\n\n")
 
     # --- ВАРІАНТИ ---
-    letters = ["A", "B", "C", "D"]  # у тебе клавіатура під 4 варіанти
     picked_idx = None
     picked_is_correct = None
     if highlight is not None:
         picked_idx, picked_is_correct = highlight
 
-    answers = q.get("answers", [])
-    # Визначаємо індекс правильної відповіді (для формату [{text,correct}])
-    correct_idx = None
-    if isinstance(answers, list) and answers:
-        for i, a in enumerate(answers[:len(letters)]):
-            if isinstance(a, dict) and a.get("correct"):
-                correct_idx = i
-                break
-    else:
-        # альтернативні історичні формати (якщо раптом)
-        correct_idx = q.get("answer")
-
-    for i, a in enumerate(answers or []):
-        if i >= len(letters):
-            break
-
-        # Витягуємо текст варіанту
-        if isinstance(a, dict):
-            ans_text = a.get("text") or a.get("answer") or a.get("value") or a.get("content") or ""
-            if not isinstance(ans_text, str):
-                ans_text = str(ans_text)
-        else:
-            ans_text = str(a)
-
+    for i, ans_text in enumerate(ans_texts):
         ans_text = _escape(ans_text)
         is_correct = (i == correct_idx)
 
@@ -104,7 +110,6 @@ def format_question_text(
         parts.append(line + "\n")
 
     # --- ПОЯСНЕННЯ ---
-    explanation = q.get("explanation") or ""
     if explanation:
         if mode == "learning":
             # завжди у навчанні
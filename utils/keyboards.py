@@ -1,6 +1,8 @@
 from telegram import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from typing import List, Optional
 
+from utils.render_cache import cached_markup
+
 # Кеш для статичних клавіатур
 _main_menu_kb = None
 _learning_order_kb = None
@@ -106,7 +108,20 @@ def build_options_markup(
 ) -> InlineKeyboardMarkup:
     """
     Побудова inline клавіатури з варіантами відповідей + «⛔ Скасувати».
+    Готові клавіатури спільні й кешуються (utils.render_cache) — не змінюйте їх.
     """
+    highlight = bool(highlight)
+    key = (q_index, highlight, two_columns, is_favorited, comments_count, include_cancel)
+    return cached_markup(key, lambda: _build_options_markup(*key))
+
+def _build_options_markup(
+    q_index: int,
+    highlight: bool,
+    two_columns: bool,
+    is_favorited: bool,
+    comments_count: int,
+    include_cancel: bool,
+) -> InlineKeyboardMarkup:
     letters = ["A", "B", "C", "D"]
 
     # Після відповіді: "Далі", "Улюблене", "Коментарі (N)"
@@ -3,6 +3,8 @@ import json
 import logging
 from typing import Dict, List, Tuple, Optional
 
+from utils.media_index import get_media_index, MEDIA_KINDS
+
 logger = logging.getLogger("test_bot")
 
 TESTS_ROOT = "tests"
@@ -18,13 +20,6 @@ IGNORED_JSON_SUFFIXES = (
 )
 
 # ====== ПРИКРІПЛЕННЯ МЕДІА ДО ПИТАНЬ ======
-def _find_first_exist(base_dir: str, candidates: list[str]) -> Optional[str]:
-    for rel in candidates:
-        p = os.path.join(base_dir, rel)
-        if os.path.exists(p):
-            return p
-    return None
-
 def attach_images(questions: List[dict], media_dir: Optional[str]) -> List[dict]:
     """
     РОЗШИРЕНА версія (назва збережена для зворотної сумісності).
@@ -35,74 +30,32 @@ def attach_images(questions: List[dict], media_dir: Optional[str]) -> List[dict]
       - document: doc{i}|document{i}|q{i} з розширеннями: pdf, docx, doc, xlsx
     Записуємо у поля 'image'/'video'/'audio'/'document' абсолютні шляхи (якщо знайдено).
 
+    Теку читаємо одним os.scandir (utils.media_index) — індекс кешується за mtime теки.
+
     ВАЖЛИВО:
     - У відправниках (testing/learning) .mp4 піде як відео, інші відео — як документ (файл),
       аудіо — як audio, зображення — photo/animation (gif).
     """
     if not questions:
         return questions
-    if not media_dir or not os.path.isdir(media_dir):
+    index = get_media_index(media_dir)
+    if index is None:
         logger.debug("DEBUG: Знайдено медіа: 0/%d (теку не знайдено)", len(questions))
         return questions
 
-    image_exts = ["jpg", "jpeg", "png", "webp", "gif"]
-    video_exts = ["mp4", "3gp", "avi", "mkv", "webm", "mpeg", "mpg", "m4v", "mov", "ts", "flv"]
-    audio_exts = ["mp3", "wav", "ogg", "m4a", "aac", "flac"]
-    doc_exts   = ["pdf", "docx", "doc", "xlsx"]
-
-    # Пріоритет імен-файлів зберігаємо як було: image/img/q; video/vid/q; audio/aud/q; doc/document/q
-    def build_candidates(prefixes: List[str], exts: List[str], i: int) -> List[str]:
-        cands: List[str] = []
-        for pref in prefixes:
-            for ext in exts:
-                cands.append(f"{pref}{i}.{ext}")
-        return cands
-
     found_any = 0
-    for i, q in enumerate(questions, start=1):
-        if not isinstance(q, dict):
-            continue
-
-        # IMAGE
-        image_path = _find_first_exist(
-            media_dir,
-            build_candidates(["image", "img", "q"], image_exts, i)
-        )
-        if image_path:
-            q["image"] = os.path.abspath(image_path)
-
-        # VIDEO (mp4 залишиться inline-відео; інші формати підуть як документ)
-        # Пріоритет: спочатку шукаємо mp4, потім інші
-        video_path = _find_first_exist(
-            media_dir,
-            build_candidates(["video", "vid", "q"], ["mp4"], i)
-        )
-        if not video_path:
-            video_path = _find_first_exist(
-                media_dir,
-                build_candidates(["video", "vid", "q"], [e for e in video_exts if e != "mp4"], i)
-            )
-        if video_path:
-            q["video"] = os.path.abspath(video_path)
-
-        # AUDIO
-        audio_path = _find_first_exist(
-            media_dir,
-            build_candidates(["audio", "aud", "q"], audio_exts, i)
-        )
-        if audio_path:
-            q["audio"] = os.path.abspath(audio_path)
-
-        # DOCUMENT
-        doc_path = _find_first_exist(
-            media_dir,
-            build_candidates(["doc", "document", "q"], doc_exts, i)
-        )
-        if doc_path:
-            q["document"] = os.path.abspath(doc_path)
-
-        if image_path or video_path or audio_path or doc_path:
-            found_any += 1
+    if index:
+        for i, q in enumerate(questions, start=1):
+            if not isinstance(q, dict):
+                continue
+            found = False
+            for kind in MEDIA_KINDS:
+                path = index.get((kind, i))
+                if path:
+                    q[kind] = path
+                    found = True
+            if found:
+                found_any += 1
 
     logger.debug("DEBUG: Знайдено медіа (будь-якого типу) для %d/%d питань", found_any, len(questions))
     return questions
@@ -119,70 +72,6 @@ def _load_json(path: str) -> List[dict]:
         return []
 
 
-def _detect_images_dir(dir_path: str, base_name: str) -> Optional[str]:
-    """
-    Визначає теку з медіа для тесту (історично — "зображення").
-    Підтримує:
-      <dir>/<base_name>
-      <dir>/#<base_name>
-      <dir>/_<base_name>
-    Повертає існуючий шлях або None.
-    """
-    candidates = [
-        os.path.join(dir_path, base_name),
-        os.path.join(dir_path, f"#{base_name}"),
-        os.path.join(dir_path, f"_{base_name}"),
-    ]
-    # Розширений список "ймовірних" файлів для швидкої перевірки наявності медіа
-    probe_images = [f"image1.{ext}" for ext in ["jpg", "jpeg", "png", "webp", "gif"]] + \
-                   [f"img1.{ext}"   for ext in ["jpg", "jpeg", "png", "webp", "gif"]] + \
-                   [f"q1.{ext}"     for ext in ["jpg", "jpeg", "png", "webp", "gif"]]
-    probe_videos = [f"video1.{ext}" for ext in ["mp4", "3gp", "avi", "mkv", "webm", "mpeg", "mpg", "m4v", "mov", "ts", "flv"]] + \
-                   [f"vid1.{ext}"   for ext in ["mp4", "3gp", "avi", "mkv", "webm", "mpeg", "mpg", "m4v", "mov", "ts", "flv"]] + \
-                   [f"q1.{ext}"     for ext in ["mp4", "3gp", "avi", "mkv", "webm", "mpeg", "mpg", "m4v", "mov", "ts", "flv"]]
-    probe_audios = [f"audio1.{ext}" for ext in ["mp3", "wav", "ogg", "m4a", "aac", "flac"]] + \
-                   [f"aud1.{ext}"   for ext in ["mp3", "wav", "ogg", "m4a", "aac", "flac"]] + \
-                   [f"q1.{ext}"     for ext in ["mp3", "wav", "ogg", "m4a", "aac", "flac"]]
-    probe_docs   = [f"doc1.{ext}" for ext in ["pdf", "docx", "doc", "xlsx"]] + \
-                   [f"document1.{ext}" for ext in ["pdf", "docx", "doc", "xlsx"]] + \
-                   [f"q1.{ext}" for ext in ["pdf", "docx", "doc", "xlsx"]]
-
-    for cand in candidates:
-        if os.path.isdir(cand):
-            # Мінімальна перевірка: наявність хоча б якогось media першого питання
-            for probe in (*probe_images, *probe_videos, *probe_audios, *probe_docs):
-                if os.path.exists(os.path.join(cand, probe)):
-                    return cand
-            # навіть якщо нічого з типових не знайшли — повернемо cand;
-            # attach_images сам перевірить детальніше
-            return cand
-    return None
-
-
-def _entry_from_json(json_path: str) -> Tuple[str, dict]:
-    """
-    Повертає (test_name, entry)
-    entry = {
-        "questions": [...],
-        "total": int,
-        "images_dir": <dir or None>,
-        "dir": <directory>,
-        "json_path": <full path>
-    }
-    """
-    base_name = os.path.splitext(os.path.basename(json_path))[0]
-    dir_path = os.path.dirname(json_path)
-    images_dir = _detect_images_dir(dir_path, base_name)
-    questions = _load_json(json_path)
-    return base_name, {
-        "questions": questions,
-        "total": len(questions),
-        "images_dir": images_dir,
-        "dir": dir_path,
-        "json_path": json_path,
-    }
-
-
 def _is_hidden_name(name: str) -> bool:
     return name.startswith(HIDDEN_PREFIXES)
 
@@ -193,10 +82,6 @@ def _is_ignored_json(filename: str) -> bool:
     return any(fname.endswith(suf) for suf in IGNORED_JSON_SUFFIXES)
 
 
-def _is_potential_images_dir(abs_dir: str, images_dirs: set) -> bool:
-    return os.path.abspath(abs_dir) in images_dirs
-
-
 # ====== СКАНУВАННЯ ТЕСТІВ ======
 def discover_tests(root_dir: str = TESTS_ROOT) -> Dict[str, dict]:
     """
@@ -204,29 +89,12 @@ def discover_tests(root_dir: str = TESTS_ROOT) -> Dict[str, dict]:
     - Ігноруємо файли, що починаються з #/_/. (приховані)
     - Ігноруємо службові JSON (*.comments.json, *.docx.meta.json)
     - Рекурсивно обходимо підтеки.
-    """
-    catalog: Dict[str, dict] = {}
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        # ховаємо службові теки (починаються з #/_/.)
-        dirnames[:] = [d for d in dirnames if not _is_hidden_name(d)]
-
-        for fname in filenames:
-            if _is_hidden_name(fname):
-                continue
-            if not fname.lower().endswith(".json"):
-                continue
-            if _is_ignored_json(fname):
-                # службові JSON не є тестами
-                continue
+    entry = {"total", "hash", "images_dir", "dir", "json_path"} — лише метадані;
+    питання — через utils.question_cache.load_questions(entry["json_path"]).
 
-            json_path = os.path.join(dirpath, fname)
-            name, entry = _entry_from_json(json_path)
-            if name in catalog:
-                logger.warning(f"[LOADER] Duplicate test name '{name}' at {json_path}. Keeping first occurrence.")
-                continue
-            catalog[name] = entry
-    logger.debug(f"[LOADER] discover_tests: loaded {len(catalog)} tests")
-    return catalog
+    Інкрементально (utils.catalog): перечитуються лише змінені JSON.
+    """
+    return load_catalog_and_tree(root_dir)[0]
 
 
 # ====== ДЕРЕВО РОЗДІЛІВ (з урахуванням порожніх тек) ======
@@ -234,73 +102,29 @@ def discover_tests_hierarchy(root_dir: str = TESTS_ROOT) -> dict:
     """
     Будує дерево розділів, включаючи порожні теки, але:
       - ігнорує теки, що починаються з #/_/. (приховані)
-      - ігнорує теки, які є "теками зображень/медіа" для тестів (назва як у тесту, або #/_, і містять media типових назв)
+      - ігнорує теки, які є "теками зображень/медіа" для тестів, і теки *.comments
     Структура вузла:
       node = {"subdirs": {name: node, ...}, "tests": [test_name, ...], "dir": abs_path}
     """
-    root_abs = os.path.abspath(root_dir)
-
-    # Спочатку зберемо тести (щоб знати їх можливі теки з медіа)
-    catalog = discover_tests(root_dir)
-
-    # Набір тек із медіа (для відсіву при побудові дерева)
-    images_dirs: set = set()
-    for entry in catalog.values():
-        if entry.get("images_dir"):
-            images_dirs.add(os.path.abspath(entry["images_dir"]))
-
-    def make_node(dir_path: str) -> dict:
-        return {"subdirs": {}, "tests": [], "dir": dir_path}
-
-    root = make_node(root_abs)
-
-    def ensure_node(parts: List[str]) -> dict:
-        node = root
-        cur = root_abs
-        for p in parts:
-            cur = os.path.join(cur, p)
-            if p not in node["subdirs"]:
-                node["subdirs"][p] = make_node(cur)
-            node = node["subdirs"][p]
-        return node
-
-    # 1) Проходимо ФС і додаємо ВСІ (неприховані) теки
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        filtered = []
-        for d in dirnames:
-            abs_d = os.path.abspath(os.path.join(dirpath, d))
-            if _is_hidden_name(d):
-                continue
-            if _is_potential_images_dir(abs_d, images_dirs):
-                # Це тека з медіа до тесту — ховаємо її у браузері
-                continue
-            if d.lower().endswith(".comments"):
-                continue
-            filtered.append(d)
-        dirnames[:] = filtered
-
-        # Створюємо вузол у дереві (щоб показати порожні теки теж)
-        abs_dir = os.path.abspath(dirpath)
-        rel = os.path.relpath(abs_dir, root_abs)
-        parts = [] if rel == "." else rel.split(os.sep)
-        ensure_node(parts)
+    return load_catalog_and_tree(root_dir)[1]
 
-    # 2) Розкладаємо тести по своїх теках
-    for test_name, entry in catalog.items():
-        abs_dir = os.path.abspath(entry["dir"])
-        rel = os.path.relpath(abs_dir, root_abs)
-        parts = [] if rel == "." else rel.split(os.sep)
-        node = ensure_node(parts)
-        node["tests"].append(test_name)
 
-    # 3) Сортування для стабільного вигляду
-    def sort_node(n: dict):
-        n["tests"].sort()
-        for key in sorted(list(n["subdirs"].keys())):
-            sort_node(n["subdirs"][key])
-
-    sort_node(root)
-    return root
+def load_catalog_and_tree(
+    root_dir: str = TESTS_ROOT,
+    changed: Optional[List[str]] = None,
+    rescan: Optional[bool] = None,
+) -> Tuple[Dict[str, dict], dict]:
+    """
+    (catalog, tree) за один обхід ФС — використовуйте, коли потрібні обидва.
+    Якщо працює watcher (utils.catalog_watcher) — без обходу, з готового стану:
+      - changed: JSON, які щойно записав сам бот (оновляться одразу, не чекаючи події ФС);
+      - rescan=True: примусова звірка всього дерева (після видалення/переміщення тек тощо).
+    """
+    from utils.catalog import get_catalog
+    cat = get_catalog(root_dir)
+    if changed and cat.watched:
+        cat.apply_changes(changed)
+    return cat.refresh(rescan=rescan)
 
 
 def get_node_for_path(tree: dict, path: List[str]) -> Optional[dict]:
@@ -328,45 +152,11 @@ def build_listing_for_path(tree: dict, path: List[str]) -> Tuple[List[str], List
 # ====== ДОДАНО: збір усіх topics по каталогу ======
 def collect_all_topics_for_all_tests(root_dir: str = TESTS_ROOT) -> List[str]:
     """
-    Пройдеться по всіх *.json тестах (окрім службових) і збере унікальні topics.
-    Повертає відсортований список (case-insensitive).
+    Унікальні topics усіх *.json тестів (окрім службових), відсортовані (case-insensitive).
+    Теми індексуються каталогом (utils.catalog) під час читання метаданих,
+    тож тут перечитуються лише змінені файли.
     """
-    topics_set = set()
-
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        # пропускаємо приховані теки
-        dirnames[:] = [d for d in dirnames if not _is_hidden_name(d)]
-
-        for fn in filenames:
-            if _is_hidden_name(fn):
-                continue
-            if not fn.lower().endswith(".json"):
-                continue
-            if _is_ignored_json(fn):
-                continue
-
-            path = os.path.join(dirpath, fn)
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            except Exception:
-                continue
-
-            items = []
-            if isinstance(data, list):
-                items = data
-            elif isinstance(data, dict) and isinstance(data.get("items"), list):
-                items = data["items"]
-
-            for q in items:
-                if not isinstance(q, dict):
-                    continue
-                tps = q.get("topics")
-                if isinstance(tps, list):
-                    for tp in tps:
-                        if isinstance(tp, str):
-                            tp_clean = tp.strip()
-                            if tp_clean:
-                                topics_set.add(tp_clean)
-
-    return sorted(topics_set, key=str.lower)
+    from utils.catalog import get_catalog
+    cat = get_catalog(root_dir)
+    cat.refresh()
+    return list(cat.all_topics())
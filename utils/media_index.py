@@ -0,0 +1,170 @@
+# utils/media_index.py
+"""
+Індекс медіа-теки тесту: один os.scandir замість ~100 os.path.exists на питання.
+
+Правила пріоритету ті самі, що й у attach_images:
+  - image:    image{i} | img{i} | q{i}      × jpg, jpeg, png, webp, gif
+  - video:    video{i} | vid{i} | q{i}      × mp4 (завжди першим), 3gp, avi, mkv, webm, mpeg, mpg, m4v, mov, ts, flv
+  - audio:    audio{i} | aud{i} | q{i}      × mp3, wav, ogg, m4a, aac, flac
+  - document: doc{i} | document{i} | q{i}   × pdf, docx, doc, xlsx
+Перемагає кандидат з меншим (префікс, розширення) у порядку списків вище.
+
+Індекс кешується за mtime теки: додавання/видалення/перейменування файлів
+змінює mtime каталогу, тож кеш інвалідовується сам.
+
+Бенчмарк (синтетичне дерево на 5000 питань):
+    python -m utils.media_index
+"""
+import os
+import re
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("test_bot")
+
+# (kind, префікси за пріоритетом, розширення за пріоритетом)
+MEDIA_RULES: Tuple[Tuple[str, Tuple[str, ...], Tuple[str, ...]], ...] = (
+    ("image", ("image", "img", "q"), ("jpg", "jpeg", "png", "webp", "gif")),
+    ("video", ("video", "vid", "q"), ("mp4", "3gp", "avi", "mkv", "webm", "mpeg", "mpg", "m4v", "mov", "ts", "flv")),
+    ("audio", ("audio", "aud", "q"), ("mp3", "wav", "ogg", "m4a", "aac", "flac")),
+    ("document", ("doc", "document", "q"), ("pdf", "docx", "doc", "xlsx")),
+)
+MEDIA_KINDS: Tuple[str, ...] = tuple(kind for kind, _, _ in MEDIA_RULES)
+
+# {(prefix, ext): [(kind, rank), ...]} — одна пара може підходити кільком kind-ам (q1.*)
+_RANKS: Dict[Tuple[str, str], list] = {}
+for _kind, _prefixes, _exts in MEDIA_RULES:
+    for _pi, _pref in enumerate(_prefixes):
+        for _ei, _ext in enumerate(_exts):
+            # для відео mp4 має пріоритет над будь-яким префіксом
+            _rank = (_ext != "mp4", _pi, _ei) if _kind == "video" else (False, _pi, _ei)
+            _RANKS.setdefault((_pref, _ext), []).append((_kind, _rank))
+
+_NAME_RE = re.compile(r"^(image|img|video|vid|audio|aud|document|doc|q)([1-9]\d*)\.([a-z0-9]+)$")
+
+MediaIndex = Dict[Tuple[str, int], str]
+
+# abs_dir -> (mtime_ns, index)
+_cache: Dict[str, Tuple[int, MediaIndex]] = {}
+
+
+def build_media_index(media_dir: str) -> MediaIndex:
+    """Один прохід os.scandir → {(kind, номер_питання_з_1): абсолютний шлях}."""
+    abs_dir = os.path.abspath(media_dir)
+    best: Dict[Tuple[str, int], Tuple[tuple, str]] = {}
+    with os.scandir(abs_dir) as it:
+        for entry in it:
+            # normcase: на Windows ФС нечутлива до регістру — як і os.path.exists
+            m = _NAME_RE.match(os.path.normcase(entry.name))
+            if not m:
+                continue
+            pref, num, ext = m.group(1), int(m.group(2)), m.group(3)
+            for kind, rank in _RANKS.get((pref, ext), ()):
+                key = (kind, num)
+                cur = best.get(key)
+                if cur is None or rank < cur[0]:
+                    best[key] = (rank, os.path.join(abs_dir, entry.name))
+    return {key: path for key, (_rank, path) in best.items()}
+
+
+def get_media_index(media_dir: Optional[str]) -> Optional[MediaIndex]:
+    """
+    Індекс з кешу (перевірка — один stat теки). None, якщо теки немає.
+    """
+    if not media_dir:
+        return None
+    abs_dir = os.path.abspath(media_dir)
+    try:
+        st = os.stat(abs_dir)
+    except OSError:
+        _cache.pop(abs_dir, None)
+        return None
+    cached = _cache.get(abs_dir)
+    if cached is not None and cached[0] == st.st_mtime_ns:
+        return cached[1]
+    try:
+        index = build_media_index(abs_dir)
+    except (NotADirectoryError, OSError) as e:
+        logger.debug("[MEDIA_INDEX] scandir failed for %s: %s", abs_dir, e)
+        return None
+    _cache[abs_dir] = (st.st_mtime_ns, index)
+    return index
+
+
+def invalidate_media_index(media_dir: Optional[str] = None) -> None:
+    """Скинути кеш (для конкретної теки або повністю)."""
+    if media_dir is None:
+        _cache.clear()
+    else:
+        _cache.pop(os.path.abspath(media_dir), None)
+
+
+# ====== Бенчмарк ======
+
+def _probe_legacy(media_dir: str, n: int) -> MediaIndex:
+    """Стара схема: os.path.exists на кожного кандидата кожного питання."""
+    out: MediaIndex = {}
+    for i in range(1, n + 1):
+        for kind, prefixes, exts in MEDIA_RULES:
+            groups = [("mp4",), exts[1:]] if kind == "video" else [exts]
+            found = None
+            for group in groups:
+                for pref in prefixes:
+                    for ext in group:
+                        p = os.path.join(media_dir, f"{pref}{i}.{ext}")
+                        if os.path.exists(p):
+                            found = os.path.abspath(p)
+                            break
+                    if found:
+                        break
+                if found:
+                    break
+            if found:
+                out[(kind, i)] = found
+    return out
+
+
+def _benchmark(n_questions: int = 5000) -> None:
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as tmp:
+        media_dir = os.path.join(tmp, "Synthetic")
+        os.makedirs(media_dir)
+        for i in range(1, n_questions + 1):
+            names = []
+            if i % 3 == 0:
+                names.append(f"image{i}.jpg")
+            if i % 7 == 0:
+                names.append(f"q{i}.png")
+            if i % 11 == 0:
+                names += [f"video{i}.3gp", f"vid{i}.mp4"]
+            if i % 13 == 0:
+                names.append(f"audio{i}.mp3")
+            if i % 17 == 0:
+                names.append(f"doc{i}.pdf")
+            for name in names:
+                open(os.path.join(media_dir, name), "wb").close()
+
+        t0 = time.perf_counter()
+        legacy = _probe_legacy(media_dir, n_questions)
+        t_legacy = time.perf_counter() - t0
+
+        invalidate_media_index()
+        t0 = time.perf_counter()
+        cold = get_media_index(media_dir) or {}
+        t_cold = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        get_media_index(media_dir)
+        t_warm = time.perf_counter() - t0
+
+        assert cold == legacy, "index differs from legacy probing"
+        print(f"questions: {n_questions}, media files: {len(os.listdir(media_dir))}, matched: {len(cold)}")
+        print(f"legacy os.path.exists probing: {t_legacy * 1000:9.1f} ms")
+        print(f"scandir index (cold):          {t_cold * 1000:9.1f} ms  (x{t_legacy / max(t_cold, 1e-9):.0f})")
+        print(f"scandir index (cached):        {t_warm * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,208 @@
+# utils/media_reader.py
+"""
+Спільне асинхронне читання медіа питань для відправки в Telegram.
+
+Раніше тестовий режим читав файл через open().read() прямо в async-хендлері
+(40 МБ відео блокували цикл подій для всіх користувачів), а потім ще й
+копіював байти в BytesIO. Тепер:
+
+  - увесь дисковий доступ (stat / open / read) — у власному обмеженому пулі
+    потоків MEDIA_READ_WORKERS (за замовчуванням 4), а не в default executor-і,
+    який ділять з БД-утилітами і компіляцією тестів;
+  - невеликі файли (до MEDIA_STREAM_MIN_MB, 4 МБ; 0 — завжди цілком) читаються
+    в пулі і віддаються в PTB як InputFile(bytes) — без проміжного BytesIO;
+  - великі — відкритим дескриптором InputFile(..., read_file_handle=False):
+    httpx читає його шматками під час аплоаду, файл цілком у пам'ять не потрапляє;
+    після відправки дескриптор закриває close_upload() (media_registry.deliver);
+  - гарячі файли лежать у LRU байтів з бюджетом MEDIA_CACHE_MB (32 МБ) за ключем
+    (шлях, mtime_ns, size): змінений на диску файл не підміниться старими байтами.
+    Файли, більші за чверть бюджету, не кешуються, а preload() їх навіть не читає
+    (розмір перевіряється через stat до читання).
+"""
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from telegram import InputFile
+
+logger = logging.getLogger("test_bot.media")
+
+MediaKey = Tuple[str, int, int]
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+class MediaBytesCache:
+    """LRU байтів медіа з бюджетом пам'яті на процес (спільний для всіх користувачів)."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: Hashable, data: bytes) -> bool:
+        if len(data) > self.max_bytes // 4:
+            return False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._data[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._data:
+                _k, dropped = self._data.popitem(last=False)
+                self._bytes -= len(dropped)
+                self.evictions += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_cache = MediaBytesCache(int(_env_number("MEDIA_CACHE_MB", 32) * 1024 * 1024))
+_stream_min = int(_env_number("MEDIA_STREAM_MIN_MB", 4) * 1024 * 1024)
+_workers = max(1, int(_env_number("MEDIA_READ_WORKERS", 4)))
+_executor: Optional[ThreadPoolExecutor] = None
+_stats = {"reads": 0, "streamed": 0, "read_bytes": 0, "preload_skipped": 0}
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix="media-read")
+    return _executor
+
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_pool(), fn, *args)
+
+
+def _stat_key(path: str) -> MediaKey:
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def _load(path: str, key: Optional[MediaKey] = None) -> Tuple[MediaKey, bytes]:
+    """Блокує: ключ і байти файла (з кешу або з диска)."""
+    key = key or _stat_key(path)
+    data = _cache.get(key)
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+        _stats["reads"] += 1
+        _stats["read_bytes"] += len(data)
+        _cache.put(key, data)
+    return key, data
+
+
+def _open_for_upload(path: str) -> Tuple[Optional[MediaKey], Any]:
+    """Блокує: (ключ, bytes) для невеликих файлів або (None, відкритий файл) для великих."""
+    key = _stat_key(path)
+    if not _stream_min or key[2] < _stream_min:
+        return _load(path, key)
+    _stats["streamed"] += 1
+    return None, open(path, "rb")
+
+
+def _preload(path: str) -> Optional[MediaKey]:
+    """Блокує: прочитати файл у кеш, лише якщо кеш його прийме і він не піде потоком."""
+    key = _stat_key(path)
+    size = key[2]
+    if size > _cache.max_bytes // 4 or (_stream_min and size >= _stream_min):
+        _stats["preload_skipped"] += 1
+        return None
+    _load(path, key)
+    return key
+
+
+async def preload(path: str) -> Optional[MediaKey]:
+    """Покласти файл у кеш заздалегідь; ключ для cached() або None (не читається / завеликий)."""
+    try:
+        key = await _run(_preload, path)
+    except OSError as e:
+        logger.debug("[MEDIA] preload failed %s: %s", path, e)
+        return None
+    return key if key is not None and _cache.get(key) is not None else None
+
+
+def cached(key: Optional[Hashable]) -> Optional[bytes]:
+    """Байти з кешу без звернення до диска (None — треба читати)."""
+    return _cache.get(key) if key is not None else None
+
+
+async def read_bytes(path: str) -> Optional[bytes]:
+    """Увесь файл (через пул і кеш); None — файл не читається."""
+    try:
+        _key, data = await _run(_load, path)
+        return data
+    except OSError as e:
+        logger.debug("[MEDIA] read failed %s: %s", path, e)
+        return None
+
+
+async def open_upload(path: str, filename: str, data: Optional[bytes] = None, attach: bool = False) -> InputFile:
+    """
+    InputFile для send_*/edit_media: з готових байтів, з кешу/пулу (невеликі файли)
+    або потоковий дескриптор (великі). attach=True — для InputMedia* (edit_media).
+    OSError — файл не читається.
+    """
+    if data is None:
+        _key, data = await _run(_open_for_upload, path)
+    if isinstance(data, bytes):
+        return InputFile(data, filename=filename, attach=attach)
+    return InputFile(data, filename=filename, attach=attach, read_file_handle=False)
+
+
+def close_upload(media: Any) -> None:
+    """Закрити дескриптор потокового InputFile після відправки (інше — ігнорується)."""
+    content = getattr(media, "input_file_content", None)
+    close = getattr(content, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def media_reader_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = dict(_stats)
+    out["cache"] = _cache.stats()
+    return out
+
+
+def shutdown_media_reader() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
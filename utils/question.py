@@ -0,0 +1,235 @@
+# utils/question.py
+"""
+Скомпільовані (незмінні) питання, спільні для всіх сесій.
+
+Question — розібране питання: текст, варіанти (tuple), індекс правильного,
+пояснення, теми та вже знайдене медіа. Для сумісності зі старим кодом
+поводиться як read-only dict: q.get("question"), q["image"], "topics" in q.
+
+CompiledTest — послідовність Question для однієї версії тесту. Версія —
+відбитки (mtime_ns, size) JSON-файлів і mtime тек медіа; поки файли не
+змінились, усі користувачі ділять один і той самий об'єкт, а в user_data
+лежить посилання (test_ref), порядок питань і сам спільний об'єкт, закріплений
+за активною сесією. Скомпільовані тести зберігаються в тому ж LRU, що й тіла
+JSON (бюджет QUESTION_CACHE_MB), з оцінкою розміру кожного; витіснення з LRU
+не змушує перекомпільовувати тест, поки його тримає хоч одна сесія.
+"""
+import os
+import sys
+import logging
+import threading
+import weakref
+from types import MappingProxyType
+from typing import Any, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from utils.loader import attach_images
+from utils.question_cache import _deep_sizeof, load_questions, shared_cache
+
+logger = logging.getLogger("test_bot")
+
+ANSWER_LETTERS = 4  # клавіатура під 4 варіанти
+
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+# ключ у питанні -> kind; порядок — як у testing._detect_media
+_MEDIA_KEYS = (
+    ("image", "image"), ("photo", "image"),
+    ("video", "video"), ("audio", "audio"),
+    ("document", "document"), ("doc", "document"),
+)
+
+# (json_path, media_dir) — частини тесту (базовий JSON, custom JSON ...)
+TestParts = Tuple[Tuple[str, Optional[str]], ...]
+
+
+def _answer_text(a: Any) -> str:
+    """Текст варіанту — як у format_question_text."""
+    if isinstance(a, dict):
+        ans_text = a.get("text") or a.get("answer") or a.get("value") or a.get("content") or ""
+        return ans_text if isinstance(ans_text, str) else str(ans_text)
+    return str(a)
+
+
+def correct_index(q: Any) -> Optional[int]:
+    """Індекс правильної відповіді (формат [{text, correct}] або історичне поле 'answer')."""
+    if isinstance(q, Question):
+        return q.correct_idx
+    answers = q.get("answers")
+    if isinstance(answers, list) and answers:
+        return next(
+            (i for i, a in enumerate(answers[:ANSWER_LETTERS]) if isinstance(a, dict) and a.get("correct")),
+            None,
+        )
+    return q.get("answer")
+
+
+class Question:
+    __slots__ = (
+        "text", "answer_texts", "correct_idx", "explanation", "topics",
+        "media_kind", "media_path", "_data",
+    )
+
+    def __init__(self, raw: Any):
+        data = raw if isinstance(raw, dict) else {}
+        self._data: Mapping[str, Any] = MappingProxyType(data) if data else _EMPTY
+        self.text: str = str(data.get("question", "") or "")
+        answers = data.get("answers")
+        self.answer_texts: Tuple[str, ...] = (
+            tuple(_answer_text(a) for a in answers[:ANSWER_LETTERS]) if isinstance(answers, list) else ()
+        )
+        self.correct_idx: Optional[int] = correct_index(data)
+        self.explanation: str = data.get("explanation") or ""
+        tps = data.get("topics")
+        self.topics: Tuple[str, ...] = tuple(tps) if isinstance(tps, list) else ()
+        self.media_kind: Optional[str] = None
+        self.media_path: Optional[str] = None
+        for key, kind in _MEDIA_KEYS:
+            if data.get(key):
+                self.media_kind, self.media_path = kind, data[key]
+                break
+
+    # ---- read-only dict API для старого коду ----
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def keys(self):
+        return self._data.keys()
+
+    def has_topic(self, topic: str) -> bool:
+        """Чи є тема серед topics (без урахування регістру і пробілів по краях)."""
+        key = topic.strip().lower()
+        return any(isinstance(tp, str) and tp.strip().lower() == key for tp in self.topics)
+
+    def __repr__(self) -> str:
+        return f"Question({self.text[:40]!r})"
+
+
+class CompiledTest:
+    __slots__ = ("parts", "version", "questions", "part_sizes", "__weakref__")
+
+    def __init__(self, parts: TestParts, version: tuple, questions: Tuple[Question, ...],
+                 part_sizes: Tuple[int, ...] = ()):
+        self.parts = parts
+        self.version = version
+        self.questions = questions
+        # скільки питань дала кожна частина (для зсуву індексів частини в загальному списку)
+        self.part_sizes = part_sizes or (len(questions),)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def __getitem__(self, i):
+        return self.questions[i]
+
+    def __iter__(self) -> Iterator[Question]:
+        return iter(self.questions)
+
+    def __bool__(self) -> bool:
+        return bool(self.questions)
+
+
+def _stat_key(path: Optional[str]) -> Tuple[int, int]:
+    if not path:
+        return (-1, -1)
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return (-1, -1)
+
+
+def _version(parts: TestParts) -> tuple:
+    return tuple((_stat_key(p), _stat_key(m)) for p, m in parts)
+
+
+def compile_questions(parts: TestParts) -> Tuple[Tuple[Question, ...], Tuple[int, ...]]:
+    """(питання всіх частин підряд, кількість питань у кожній частині)."""
+    out: List[Question] = []
+    sizes: List[int] = []
+    for json_path, media_dir in parts:
+        # attach_images мутує dict-и — працюємо з копіями, а не зі спільним кешем
+        raw = [dict(q) if isinstance(q, dict) else q for q in load_questions(json_path)]
+        try:
+            attach_images(raw, media_dir)
+        except Exception as e:
+            logger.warning(f"[COMPILE] attach_images failed for {json_path}: {e}")
+        out.extend(Question(q) for q in raw)
+        sizes.append(len(raw))
+    return tuple(out), tuple(sizes)
+
+
+def _compiled_nbytes(questions: Tuple[Question, ...]) -> int:
+    """Оцінка пам'яті скомпільованого тесту (рядки, спільні з тілами JSON, рахуються ще раз)."""
+    size = sys.getsizeof(questions)
+    for q in questions:
+        size += sys.getsizeof(q) + sys.getsizeof(q.answer_texts) + sys.getsizeof(q.topics)
+        size += _deep_sizeof(q._data.copy()) if q._data else 0
+    return size
+
+
+# у спільному кеші — під ключем ("compiled", parts); у user_data — parts (test_ref)
+# і закріплений за активною сесією об'єкт (state_sync.TEST_PIN_KEY)
+_cache = shared_cache()
+# усі живі скомпільовані тести (слабкі посилання): тест, витіснений з LRU або
+# більший за бюджет, але закріплений хоч за однією сесією, не компілюється вдруге
+_live: "weakref.WeakValueDictionary[TestParts, CompiledTest]" = weakref.WeakValueDictionary()
+_live_lock = threading.Lock()
+
+
+def _cache_key(parts: TestParts) -> tuple:
+    return ("compiled", parts)
+
+
+def _lookup(key: TestParts, version: Optional[tuple] = None) -> Optional[CompiledTest]:
+    cur = _cache.lookup(_cache_key(key), version)
+    if cur is None:
+        with _live_lock:
+            cur = _live.get(key)
+        if cur is not None and version is not None and cur.version != version:
+            return None
+    return cur
+
+
+def normalize_parts(parts: Sequence[Sequence[Optional[str]]]) -> TestParts:
+    return tuple((str(p), (str(m) if m else None)) for p, m in parts)
+
+
+def load_compiled_test(parts: Sequence[Sequence[Optional[str]]]) -> CompiledTest:
+    """
+    Актуальна версія тесту: звіряє відбитки файлів і перекомпільовує лише
+    якщо щось змінилось. Викликати при виборі тесту / старті режиму.
+    """
+    key = normalize_parts(parts)
+    version = _version(key)
+    cur = _lookup(key, version)
+    if cur is not None:
+        return cur
+    compiled = CompiledTest(key, version, *compile_questions(key))
+    _cache.store(_cache_key(key), version, compiled, _compiled_nbytes(compiled.questions))
+    with _live_lock:
+        _live[key] = compiled
+    logger.debug(f"[COMPILE] {key[0][0] if key else '-'}: {len(compiled)} questions")
+    return compiled
+
+
+def find_compiled_test(parts: Sequence[Sequence[Optional[str]]]) -> Optional[CompiledTest]:
+    """Уже скомпільований тест (у кеші чи закріплений за сесією) або None — без компіляції."""
+    return _lookup(normalize_parts(parts))
+
+
+def get_compiled_test(parts: Sequence[Sequence[Optional[str]]]) -> CompiledTest:
+    """
+    Скомпільований тест без звірки з ФС. Промах компілює синхронно — в async-хендлерах
+    беріть закріплений за сесією тест (state_sync.get_session_questions).
+    """
+    key = normalize_parts(parts)
+    cur = _lookup(key)
+    if cur is not None:
+        return cur
+    return load_compiled_test(key)
@@ -0,0 +1,180 @@
+# utils/question_cache.py
+"""
+Спільний LRU-кеш тіл питань (список dict з JSON тесту).
+
+Каталог тримає лише метадані (шлях, кількість, тека медіа, хеш), а самі питання
+підвантажуються при першому зверненні і живуть тут у межах бюджету пам'яті:
+  QUESTION_CACHE_MB — бюджет у мегабайтах (за замовчуванням 64).
+
+Ключ — абсолютний шлях JSON; запис дійсний, поки не змінився відбиток файла
+(mtime_ns, size). Розмір запису оцінюється рекурсивним sys.getsizeof.
+
+Повернуті списки спільні для всіх користувачів — не мутуйте їх
+(для attach_images використовуйте clone_questions).
+
+У тому ж бюджеті живуть скомпільовані тести utils.question (lookup/store):
+кожен займає свою оцінку байтів, і LRU витісняє їх нарівні з тілами JSON.
+"""
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from utils.loader import _load_json
+
+logger = logging.getLogger("test_bot")
+
+DEFAULT_BUDGET_MB = 64
+
+
+def _budget_from_env() -> int:
+    try:
+        mb = float(os.getenv("QUESTION_CACHE_MB", DEFAULT_BUDGET_MB))
+    except (TypeError, ValueError):
+        mb = DEFAULT_BUDGET_MB
+    return max(0, int(mb * 1024 * 1024))
+
+
+def _deep_sizeof(obj: Any) -> int:
+    """Груба оцінка пам'яті JSON-структури (dict/list/str/числа)."""
+    size = 0
+    stack = [obj]
+    seen = set()
+    while stack:
+        o = stack.pop()
+        oid = id(o)
+        if oid in seen:
+            continue
+        seen.add(oid)
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return size
+
+
+class QuestionCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # abs_path -> (fingerprint, questions, nbytes); інші ключі (tuple) — записи store()
+        self._data: "OrderedDict[Hashable, Tuple[Any, Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, json_path: str) -> List[dict]:
+        abs_path = os.path.abspath(json_path)
+        try:
+            st = os.stat(abs_path)
+            fp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            self.invalidate(abs_path)
+            return []
+
+        with self._lock:
+            item = self._data.get(abs_path)
+            if item is not None and item[0] == fp:
+                self._data.move_to_end(abs_path)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+
+        questions = _load_json(abs_path)
+        nbytes = _deep_sizeof(questions)
+
+        with self._lock:
+            old = self._data.pop(abs_path, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if nbytes <= self.max_bytes:
+                self._data[abs_path] = (fp, questions, nbytes)
+                self._bytes += nbytes
+                self._evict_locked()
+        return questions
+
+    def lookup(self, key: Hashable, fp: Any = None) -> Any:
+        """Довільний запис store() (з тим самим відбитком, якщо fp задано) або None."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (fp is not None and item[0] != fp):
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def store(self, key: Hashable, fp: Any, value: Any, nbytes: int) -> bool:
+        """Покласти запис у спільний бюджет; False — більший за весь бюджет, не збережено."""
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if nbytes > self.max_bytes:
+                return False
+            self._data[key] = (fp, value, nbytes)
+            self._bytes += nbytes
+            self._evict_locked()
+            return key in self._data
+
+    def invalidate(self, json_path: Optional[str] = None) -> None:
+        with self._lock:
+            if json_path is None:
+                self._data.clear()
+                self._bytes = 0
+                return
+            old = self._data.pop(os.path.abspath(json_path), None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def _evict_locked(self) -> None:
+        while self._bytes > self.max_bytes and self._data:
+            path, (_fp, _qs, nbytes) = self._data.popitem(last=False)
+            self._bytes -= nbytes
+            self.evictions += 1
+            logger.debug("[QCACHE] evicted %s (%d bytes)", path, nbytes)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "compiled": sum(1 for k in self._data if not isinstance(k, str)),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate_pct": round(100.0 * self.hits / total, 1) if total else 0.0,
+            }
+
+
+_cache = QuestionCache(_budget_from_env())
+
+
+def load_questions(json_path: Optional[str]) -> List[dict]:
+    """Питання тесту з кешу (спільний список — лише для читання)."""
+    if not json_path:
+        return []
+    return _cache.get(json_path)
+
+
+def clone_questions(questions: List[dict]) -> List[dict]:
+    """Поверхневі копії питань — щоб attach_images не мутував спільний кеш."""
+    return [dict(q) if isinstance(q, dict) else q for q in questions]
+
+
+def invalidate_questions(json_path: Optional[str] = None) -> None:
+    _cache.invalidate(json_path)
+
+
+def cache_stats() -> Dict[str, int]:
+    return _cache.stats()
+
+
+def shared_cache() -> QuestionCache:
+    """Спільний кеш з бюджетом QUESTION_CACHE_MB (для скомпільованих тестів)."""
+    return _cache
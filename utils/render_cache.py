@@ -0,0 +1,204 @@
+# utils/render_cache.py
+"""
+LRU-кеш відрендерених підписів питань і inline-клавіатур квізу.
+
+Рендер питання — format_question_text (html.escape кожного варіанту), потім
+_with_spacing (кілька regex-проходів по рядках) і build_options_markup (нові
+InlineKeyboardButton на кожен показ). Для одного питання результат той самий
+у всіх користувачів, тож кешуємо:
+
+  - тіло підпису — за ключем (частини тесту, версія файлів, q_index, режим,
+    підсвітка...), див. question_key(); прогрес-бар дописується поверх, він дешевий;
+  - клавіатуру — за аргументами build_options_markup (q_index, підсвітка,
+    улюблене, кількість коментарів...). InlineKeyboardMarkup у PTB незмінний,
+    тож один об'єкт можна віддавати всім.
+
+Версія тесту — відбиток (mtime_ns, size) частин з CompiledTest.version, тому
+правка JSON сама по собі дає нові ключі; слухач каталогу (watch_catalog) ще й
+одразу прибирає записи змінених тестів, щоб вони не чекали витіснення.
+
+RENDER_CACHE_SIZE — записів у кожному з кешів (за замовчуванням 4096, 0 — вимкнено).
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Sequence
+
+logger = logging.getLogger("test_bot.render")
+
+DEFAULT_SIZE = 4096
+
+
+def _size_from_env() -> int:
+    try:
+        return max(0, int(os.getenv("RENDER_CACHE_SIZE", DEFAULT_SIZE)))
+    except (TypeError, ValueError):
+        return DEFAULT_SIZE
+
+
+class RenderCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key: Optional[Hashable], render: Callable[[], Any]) -> Any:
+        """Значення з кешу або render() (key=None — без кешу)."""
+        if key is None or not self.max_entries:
+            return render()
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = render()
+
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Прибрати всі записи (або ті, для ключів яких predicate істинний)."""
+        with self._lock:
+            if predicate is None:
+                n = len(self._data)
+                self._data.clear()
+                return n
+            stale = [k for k in self._data if predicate(k)]
+            for k in stale:
+                del self._data[k]
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate_pct": round(100.0 * self.hits / total, 1) if total else 0.0,
+            }
+
+
+_captions = RenderCache(_size_from_env())
+_keyboards = RenderCache(_size_from_env())
+
+
+def question_key(questions: Sequence[Any], q_index: int) -> Optional[tuple]:
+    """
+    Префікс ключа для питання скомпільованого тесту: (parts, version, q_index).
+    None — якщо питання не з CompiledTest (старий формат сесії): такі не кешуємо.
+    """
+    parts = getattr(questions, "parts", None)
+    version = getattr(questions, "version", None)
+    if parts is None or version is None:
+        return None
+    return (parts, version, q_index)
+
+
+def cached_caption(key: Optional[tuple], render: Callable[[], str]) -> str:
+    return _captions.get_or_render(key, render)
+
+
+def cached_markup(key: Hashable, render: Callable[[], Any]) -> Any:
+    return _keyboards.get_or_render(key, render)
+
+
+def invalidate_render_cache(json_paths: Optional[Iterable[str]] = None) -> int:
+    """Скинути підписи тестів, до яких входить хоч один із json_paths (None — усі)."""
+    if json_paths is None:
+        return _captions.invalidate()
+    changed = {os.path.abspath(p) for p in json_paths}
+
+    def _stale(key: Hashable) -> bool:
+        return any(os.path.abspath(json_path) in changed for json_path, _media in key[0])
+
+    return _captions.invalidate(_stale)
+
+
+def _on_catalog_change(version: int, changed: Sequence[str]) -> None:
+    dropped = invalidate_render_cache(changed)
+    if dropped:
+        logger.debug("[RENDER] catalog v%s: dropped %d cached captions", version, dropped)
+
+
+def watch_catalog(catalog) -> None:
+    """Підписати кеш на зміни каталогу (utils.catalog.TestCatalog.add_listener)."""
+    catalog.add_listener(_on_catalog_change)
+
+
+def render_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {"captions": _captions.stats(), "keyboards": _keyboards.stats()}
+
+
+def _benchmark(n_questions: int = 1000, rounds: int = 5) -> None:
+    """
+    Мікробенчмарк: CPU на один рендер питання (підпис + клавіатура) без кешу і з кешем.
+    Запуск: python -m utils.render_cache
+    """
+    import random
+    import time
+    from utils.question import CompiledTest, Question
+    from utils import render_cache as rc  # при запуску як __main__ — той самий модуль, що й у хендлерів
+    from utils.keyboards import _build_options_markup, build_options_markup
+    from handlers.testing import _compose_caption_testing
+
+    rnd = random.Random(1)
+    words = ["орган", "клітина", "<b>тег</b>", "м'яз", "A) не варіант", "кров & лімфа", "нерв"]
+
+    def _text(k: int) -> str:
+        return " ".join(rnd.choice(words) for _ in range(k))
+
+    raw = [
+        {
+            "question": _text(25) + "<br>" + _text(10),
+            "answers": [{"text": _text(6), "correct": j == i % 4} for j in range(4)],
+            "topics": ["анатомія", "тема %d" % (i % 7)],
+            "explanation": _text(15),
+        }
+        for i in range(n_questions)
+    ]
+    compiled = CompiledTest((("bench.json", None),), ((1, 1), (-1, -1)), tuple(Question(q) for q in raw))
+    highlights = [None, (0, True), (1, False)]
+
+    def _run(use_cache: bool) -> float:
+        renders = 0
+        t0 = time.process_time()
+        for _ in range(rounds):
+            for i in range(n_questions):
+                hl = highlights[i % 3]
+                key = rc.question_key(compiled, i) if use_cache else None
+                _compose_caption_testing(compiled[i], i, n_questions, highlight=hl, qkey=key)
+                if use_cache:
+                    build_options_markup(i, highlight=hl is not None, two_columns=hl is None)
+                else:
+                    _build_options_markup(i, hl is not None, hl is None, False, 0, True)
+                renders += 1
+        return (time.process_time() - t0) / renders * 1e6
+
+    rc._captions, rc._keyboards = rc.RenderCache(n_questions * 4), rc.RenderCache(n_questions * 4)
+    cold = _run(use_cache=False)
+    _run(use_cache=True)  # прогрів
+    warm = _run(use_cache=True)
+    print(f"{n_questions} питань × {rounds} проходів:")
+    print(f"  без кешу : {cold:8.1f} мкс CPU / рендер")
+    print(f"  з кешем  : {warm:8.1f} мкс CPU / рендер  (x{cold / warm:.1f})")
+    print(f"  {rc.render_cache_stats()}")
+
+
+if __name__ == "__main__":
+    _benchmark()